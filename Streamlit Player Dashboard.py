@@ -1,6 +1,35 @@
-# File names to change if needed
-raw_nongk = 'Raw FBRef 2024-2025'
-final_nongk = 'Final FBRef 2024-2025'
+# Competitions and seasons to build. Each (competition, season) pair is an independent job;
+# see `competitions` below for the available competition keys.
+current_season = '2024-2025'
+season = current_season
+jobs = [('Big5', season)]
+
+# Percentile pool: 'competition' ranks within each scraped competition and season (the Big-5 as
+# one pool), 'league' within each individual league and season, 'pooled' across all competitions
+# of a season
+percentile_pool = 'competition'
+
+# Process pool size for building several jobs at once
+max_workers = 4
+
+# Reuse the previous run's per-90 and team results for players whose scraped rows have not
+# changed since then. Percentiles are always re-ranked.
+incremental_refresh = True
+
+# Track peak memory per stage in the timing report. tracemalloc slows allocation-heavy stages
+# down, so turn this off when only timings are needed.
+profile_memory = True
+
+# Also build the goalkeepers from FBref's keeper pages, in the same process pool as the outfield
+# build (see build_keeper_competition_season)
+keeper_pipeline = True
+
+# Build every job from generated tables of this many player-seasons instead of scraping FBref, for
+# load and scaling tests; outputs then go to a scratch folder (see generate_synthetic_competition)
+synthetic_players = None
+
+# Player-seasons the benchmark generates when no --synthetic size is given
+benchmark_players = 10000
 
 from functools import lru_cache
 import matplotlib.pyplot as plt
@@ -14,8 +43,15 @@ warnings.filterwarnings("ignore")
 import requests
 from bs4 import BeautifulSoup, Comment
 import os
+import io
+import re
+import json
+import sys
 from pathlib import Path
 import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from types import MappingProxyType
 from scipy import stats
 from statistics import mean
 from math import pi
@@ -23,54 +59,366 @@ from math import pi
 # this is the file path root, i.e. where this file is located
 root = os.getcwd() + '/'
 
+# Recorded FBref pages for offline runs: 'record' saves every page fetched, 'replay' reads them
+# back instead of fetching
+fixture_mode = None
+fixture_dir = f"{root}FBref Fixtures"
+
+# `python "Streamlit Player Dashboard.py" benchmark` builds from generated tables (benchmark_players,
+# or --synthetic), writes its outputs to a scratch folder and then runs the benchmark suite at the
+# end of this file; `benchmark --fixtures` replays recorded pages instead
+benchmark_run = sys.argv[1:2] == ['benchmark']
+# `... serve` serves the latest snapshot over HTTP, rebuilt in the background (see the serving section)
+serve_run = sys.argv[1:2] == ['serve']
+# `... build` only builds and writes the data; the server's background refresh runs it
+build_run = sys.argv[1:2] == ['build']
+# `... export --output Shortlist.xlsx ...` writes a shortlist from the last build's combined store (see the export section)
+export_run = sys.argv[1:2] == ['export']
+# `streamlit run "Streamlit Player Dashboard.py" -- streamlit` opens the Streamlit page on the latest snapshot
+streamlit_run = sys.argv[1:2] == ['streamlit']
+# Process pool workers started with spawn (the default on Windows and macOS) run this file again,
+# as __mp_main__, to reach _build_job. They take the run's settings (root, synthetic_players,
+# fixture_mode) from the same command line, but every mode's work is gated on main_process so a
+# worker only defines the functions and never starts a run of its own.
+main_process = __name__ == '__main__'
+# Without a mode the file runs as the notebook: the ipywidgets selector and its metrics endpoint
+interactive_run = main_process and not (benchmark_run or serve_run or build_run or export_run or streamlit_run)
+# The serve, export and streamlit modes read what the last build wrote instead of building
+pipeline_run = main_process and not (serve_run or export_run or streamlit_run)
+# `--synthetic 100000` sets synthetic_players from the command line
+if '--synthetic' in sys.argv:
+    synthetic_players = int(sys.argv[sys.argv.index('--synthetic') + 1])
+if benchmark_run:
+    if '--fixtures' in sys.argv:
+        fixture_mode = 'replay'
+    else:
+        synthetic_players = synthetic_players or benchmark_players
+    incremental_refresh = False
+    profile_memory = False
+    root = f"{root}Benchmark Run/"
+    os.makedirs(root, exist_ok=True)
+elif synthetic_players:
+    incremental_refresh = False
+    root = f"{root}Synthetic Run/"
+    os.makedirs(root, exist_ok=True)
+
+# Streamlit re-runs this whole script on every interaction, which would start every module-level
+# cache (chart fonts and templates, the trend index, the serving state) over each time. In the
+# streamlit mode they are kept by st.cache_resource, once per server process.
+def process_cache(name, _factory=dict):
+    """
+    A module-level cache or lock that outlives Streamlit's re-runs of this script
+    
+    Args:
+    name (str): The cache's name, one per cache
+    _factory (callable): Makes the empty cache; underscored so Streamlit doesn't hash it
+    (default: dict)
+    """
+    return _factory()
+
+if streamlit_run:
+    import streamlit as st
+    process_cache = st.cache_resource(show_spinner=False)(process_cache)
+
+# This section records wall time, CPU time, peak traced memory and row counts for every fetch and
+# pipeline stage. Each run is appended to a JSON-lines history so the report can be compared
+# with the previous run.
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+profile_history_path = f"{root}Pipeline Profile.jsonl"
+stage_profiles = []
+_open_stages = []
+
+@contextmanager
+def profile_stage(stage, **details):
+    """
+    Records one stage. Set record['Rows'] inside the block to log a row count.
+    
+    Example usage:
+    with profile_stage('Per 90', competition='Big5') as record:
+        df = add_per90(path)
+        record['Rows'] = len(df)
+    """
+    if profile_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    record = {'Stage': stage, 'Depth': len(_open_stages), 'Rows': None, **details}
+    start_memory = tracemalloc.get_traced_memory()[0] if profile_memory else 0
+    if profile_memory:
+        # The traced peak is global, so the enclosing stage's peak so far is kept before resetting it
+        if _open_stages:
+            _open_stages[-1]['peak'] = max(_open_stages[-1]['peak'], tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+    _open_stages.append({'peak': 0})
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    finally:
+        record['Wall s'] = round(time.perf_counter() - start_wall, 4)
+        record['CPU s'] = round(time.process_time() - start_cpu, 4)
+        peak = _open_stages.pop()['peak']
+        if profile_memory:
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            if _open_stages:
+                _open_stages[-1]['peak'] = max(_open_stages[-1]['peak'], peak)
+        record['Peak MB'] = round((peak - start_memory) / 1e6, 2) if profile_memory else None
+        stage_profiles.append(record)
+
+def profiled(stage):
+    """
+    Decorator form of profile_stage; the row count is taken from the returned table, if any
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with profile_stage(stage) as record:
+                result = function(*args, **kwargs)
+                if isinstance(result, pd.DataFrame):
+                    record['Rows'] = len(result)
+            return result
+        return wrapper
+    return decorator
+
+def report_profile_run(path=profile_history_path):
+    """
+    Prints this run's stages summarised by stage name next to the previous run's wall time, then
+    appends this run to the history
+    
+    Returns:
+    Summary DataFrame with 'Calls', 'Wall s', 'CPU s', 'Peak MB', 'Rows', 'Previous wall s'
+    and 'Change %'
+    """
+    profiles = pd.DataFrame(stage_profiles)
+    summary = profiles.groupby('Stage', sort=False).agg(**{
+        'Calls': ('Stage', 'size'),
+        'Wall s': ('Wall s', 'sum'),
+        'CPU s': ('CPU s', 'sum'),
+        'Peak MB': ('Peak MB', 'max'),
+        'Rows': ('Rows', 'sum')
+    })
+    
+    previous = None
+    if os.path.exists(path):
+        with open(path) as f:
+            lines = f.read().splitlines()
+        if lines:
+            previous = pd.DataFrame(json.loads(lines[-1])['stages']).groupby('Stage')['Wall s'].sum()
+    if previous is not None:
+        summary['Previous wall s'] = previous.reindex(summary.index)
+        summary['Change %'] = ((summary['Wall s'] / summary['Previous wall s'] - 1) * 100).round(1)
+    summary = summary.round(3)
+    
+    with open(path, 'a') as f:
+        f.write(json.dumps({'Run': datetime.now().isoformat(timespec='seconds'),
+                            'stages': profiles.astype(object).where(profiles.notna(), None).to_dict('records')}) + '\n')
+    
+    print(summary.to_string())
+    if 'Change %' in summary.columns:
+        slower = summary[(summary['Change %'] > 25) & (summary['Wall s'] > 0.5)]
+        for stage, row in slower.iterrows():
+            print(f"Slower than the previous run: {stage} {row['Previous wall s']}s -> {row['Wall s']}s")
+    return summary
+
+# This section times each step of a dashboard interaction (player lookup, similarity, each chart
+# render and its serialization) and keeps a rolling window of latencies per step in process.
+# Percentiles are served by a small local HTTP endpoint that can be scraped, or printed with
+# latency_summary().
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+latency_window = 1000
+
+# Latency budget per step in milliseconds; steps whose p95 is over budget are flagged
+latency_budgets_ms = {
+    'select': 1500,
+    'lookup': 20,
+    'pizza render': 150,
+    'pizza serialize': 400,
+    'bars render': 100,
+    'bars serialize': 400,
+    'similarity': 300,
+    'trend': 400,
+    'payload': 20,
+    'client serialize': 50
+}
+
+interaction_latencies = {}
+_latency_lock = threading.Lock()
+
+@contextmanager
+def trace_span(step):
+    """
+    Times one step of a dashboard interaction into its rolling latency window
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with _latency_lock:
+            interaction_latencies.setdefault(step, deque(maxlen=latency_window)).append(elapsed_ms)
+
+def latency_summary():
+    """
+    p50/p95/p99 latency per step over the rolling window
+    
+    Returns:
+    DataFrame indexed by step with 'Count', 'p50 ms', 'p95 ms', 'p99 ms', 'Max ms',
+    'Budget ms' and 'Over budget'
+    """
+    with _latency_lock:
+        windows = {step: np.array(latencies) for step, latencies in interaction_latencies.items()}
+    rows = []
+    for step, latencies in windows.items():
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        budget = latency_budgets_ms.get(step)
+        rows.append([step, len(latencies), p50, p95, p99, latencies.max(), budget,
+                     budget is not None and p95 > budget])
+    return pd.DataFrame(rows, columns=['Step', 'Count', 'p50 ms', 'p95 ms', 'p99 ms', 'Max ms',
+                                       'Budget ms', 'Over budget']).set_index('Step').round(1)
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    # /metrics in Prometheus text format, /metrics.json as JSON
+    def do_GET(self):
+        summary = latency_summary()
+        if self.path == '/metrics.json':
+            body = summary.reset_index().to_json(orient='records')
+            content_type = 'application/json'
+        elif self.path == '/metrics':
+            lines = []
+            for step, row in summary.iterrows():
+                for quantile, column in [('0.5', 'p50 ms'), ('0.95', 'p95 ms'), ('0.99', 'p99 ms')]:
+                    lines.append(f'dashboard_latency_ms{{step="{step}",quantile="{quantile}"}} {row[column]}')
+                lines.append(f'dashboard_latency_ms_count{{step="{step}"}} {row["Count"]}')
+            body = '\n'.join(lines) + '\n'
+            content_type = 'text/plain; version=0.0.4'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.end_headers()
+        self.wfile.write(body.encode())
+    
+    def log_message(self, format, *args):
+        pass
+
+_metrics_server = {}
+
+def start_metrics_server(port=8765):
+    """
+    Serves the latency percentiles on http://127.0.0.1:<port>/metrics from a background thread.
+    Calling it again returns the running server.
+    """
+    if 'server' not in _metrics_server:
+        server = ThreadingHTTPServer(('127.0.0.1', port), _MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        _metrics_server['server'] = server
+    return _metrics_server['server']
+
 # This section creates the programs that gather data from FBRef.com... Data is from FBRef and Opta
-def _get_table(soup):
-    return soup.find_all('table')[0]
+def _get_table(soup, table_index=0, table_id=None):
+    if table_id is None:
+        return soup.find_all('table')[table_index]
+    
+    # Single-league pages only render the squad tables; player tables sit inside HTML comments
+    table = soup.find('table', id=table_id)
+    if table is None:
+        for comment in soup.find_all(string=lambda text: isinstance(text, Comment)):
+            if table_id in comment:
+                table = BeautifulSoup(comment, "html.parser").find('table', id=table_id)
+                break
+    return table
 
-def _get_opp_table(soup):
-    return soup.find_all('table')[1]
+def _get_headings(table):
+    # Column headings of the table itself, without the rank column
+    headtext = table.find('thead').find_all("th", scope="col")
+    return [heading.get_text() for heading in headtext if heading.get('data-stat') != 'ranker']
 
 def _parse_row(row):
-    cols = None
-    cols = row.find_all('td')
+    # Squad names are row headers on single-league pages, so keep row-level th cells too
+    cols = [ele for ele in row.find_all(['th', 'td'])
+            if ele.name == 'td' or (ele.get('scope') == 'row' and ele.get('data-stat') != 'ranker')]
     cols = [ele.text.strip() for ele in cols]
     return cols
 
-def get_df(path, max_retries=3, retry_delay=5):
+def _fixture_path(url):
+    # Recorded copy of a page, named after its URL
+    return os.path.join(fixture_dir, re.sub(r'[^A-Za-z0-9]+', '_', url.split('://', 1)[-1]).strip('_'))
+
+def fetch_page(url, delay=4):
+    """
+    Downloads a page after a polite delay. With fixture_mode 'record' the page is also saved to
+    fixture_dir; with 'replay' it is read from there instead, without sleeping.
+    
+    Returns:
+    Page content as bytes
+    """
+    if fixture_mode == 'replay':
+        with open(_fixture_path(url), 'rb') as f:
+            return f.read()
+    
+    with profile_stage('Fetch sleep', url=url):
+        time.sleep(delay)
+    
+    headers = {
+        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+    }
+    
+    with profile_stage('Fetch download', url=url):
+        page = requests.get(url, headers=headers, timeout=30)
+        page.raise_for_status()  # Raise an exception for bad status codes
+    
+    if fixture_mode == 'record':
+        os.makedirs(fixture_dir, exist_ok=True)
+        with open(_fixture_path(url), 'wb') as f:
+            f.write(page.content)
+    return page.content
+
+def parse_table_html(content, table_index=0, table_id=None):
+    """
+    Parses one stats table out of a page's HTML into a DataFrame of strings
+    """
+    soup = BeautifulSoup(content, "html.parser")
+    table = _get_table(soup, table_index, table_id)
+    data = []
+    headings = _get_headings(table)
+    data.append(headings)
+    table_body = table.find('tbody')
+    rows = table_body.find_all('tr')
+    player_ids = []
+
+    for row_index in range(len(rows)):
+        row = rows[row_index]
+        cols = _parse_row(row)
+        data.append(cols)
+        
+        # FBref's player id, kept so a player can be matched across scrapes
+        player_cell = row.find('td', attrs={'data-stat': 'player'})
+        player_ids.append(player_cell.get('data-append-csv') if player_cell else None)
+    
+    data = pd.DataFrame(data)
+    data = data.rename(columns=data.iloc[0])
+    data = data.reindex(data.index.drop(0))
+    data = data.replace('',0)
+    
+    # Appended last so the positional column slices further down are unaffected
+    if any(player_ids):
+        data['PlayerID'] = player_ids
+    return data
+
+def get_df(path, max_retries=3, retry_delay=5, table_index=0, table_id=None):
     for attempt in range(max_retries):
         try:
             URL = path
-            time.sleep(4 + attempt * retry_delay)  # Increasing delay between attempts
-            
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
+            content = fetch_page(URL, delay=4 + attempt * retry_delay)  # Increasing delay between attempts
             
-            page = requests.get(URL, headers=headers, timeout=30)
-            page.raise_for_status()  # Raise an exception for bad status codes
-            
-            soup = BeautifulSoup(page.content, "html.parser")
-            table = _get_table(soup)
-            data = []
-            headings=[]
-            headtext = soup.find_all("th",scope="col")
-            for i in range(len(headtext)):
-                heading = headtext[i].get_text()
-                headings.append(heading)
-            headings=headings[1:len(headings)]
-            data.append(headings)
-            table_body = table.find('tbody')
-            rows = table_body.find_all('tr')
-
-            for row_index in range(len(rows)):
-                row = rows[row_index]
-                cols = _parse_row(row)
-                data.append(cols)
-            
-            data = pd.DataFrame(data)
-            data = data.rename(columns=data.iloc[0])
-            data = data.reindex(data.index.drop(0))
-            data = data.replace('',0)
+            with profile_stage('Parse HTML', url=URL) as record:
+                data = parse_table_html(content, table_index, table_id)
+                record['Rows'] = len(data)
             return data
             
         except Exception as e:
@@ -80,1375 +428,4670 @@ def get_df(path, max_retries=3, retry_delay=5):
             time.sleep(retry_delay)
 
 def get_opp_df(path, max_retries=3, retry_delay=5):
-    for attempt in range(max_retries):
-        try:
-            URL = path
-            time.sleep(4 + attempt * retry_delay)  # Increasing delay between attempts
-            
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
-            
-            page = requests.get(URL, headers=headers, timeout=30)
-            page.raise_for_status()
-            
-            soup = BeautifulSoup(page.content, "html.parser")
-            table = _get_opp_table(soup)
-            data = []
-            headings=[]
-            headtext = soup.find_all("th",scope="col")
-            for i in range(len(headtext)):
-                heading = headtext[i].get_text()
-                headings.append(heading)
-            headings=headings[1:len(headings)]
-            data.append(headings)
-            table_body = table.find('tbody')
-            rows = table_body.find_all('tr')
-
-            for row_index in range(len(rows)):
-                row = rows[row_index]
-                cols = _parse_row(row)
-                data.append(cols)
-            
-            data = pd.DataFrame(data)
-            data = data.rename(columns=data.iloc[0])
-            data = data.reindex(data.index.drop(0))
-            data = data.replace('',0)
-            return data
-            
-        except Exception as e:
-            print(f"Attempt {attempt + 1} failed: {str(e)}")
-            if attempt == max_retries - 1:
-                raise Exception(f"Failed to fetch data after {max_retries} attempts")
-            time.sleep(retry_delay)
+    # The opposition ("vs") table is the second table on the squad pages
+    return get_df(path, max_retries, retry_delay, table_index=1)
 
+# This section defines the dtype schema for the processed tables and a memory report per stage.
+# Percentiles are already rounded to one decimal in 0-100 and raw stats carry a few decimals at
+# most, so float32 holds them at half the size (uint16 tenths would be smaller still for the
+# percentiles, but every composite and similarity calculation would then need converting back).
+# Repeated strings become categoricals.
 
-# this section gets the raw tables from FBRef.com
-
-standard = "https://fbref.com/en/comps/Big5/stats/players/Big-5-European-Leagues-Stats"
-shooting = "https://fbref.com/en/comps/Big5/shooting/players/Big-5-European-Leagues-Stats"
-passing = "https://fbref.com/en/comps/Big5/passing/players/Big-5-European-Leagues-Stats"
-pass_types = "https://fbref.com/en/comps/Big5/passing_types/players/Big-5-European-Leagues-Stats"
-gsca = "https://fbref.com/en/comps/Big5/gca/players/Big-5-European-Leagues-Stats"
-defense = "https://fbref.com/en/comps/Big5/defense/players/Big-5-European-Leagues-Stats"
-poss = "https://fbref.com/en/comps/Big5/possession/players/Big-5-European-Leagues-Stats"
-misc = "https://fbref.com/en/comps/Big5/misc/players/Big-5-European-Leagues-Stats"
-
-df_standard = get_df(standard)
-df_shooting = get_df(shooting)
-df_passing = get_df(passing)
-df_pass_types = get_df(pass_types)
-df_gsca = get_df(gsca)
-df_defense = get_df(defense)
-df_poss = get_df(poss)
-df_misc = get_df(misc)
-
-# this section sorts the raw tables then resets their indexes. Without this step, you will
-# run into issues with players who play minutes for 2 clubs in a season.
-
-df_standard.sort_values(['Player', 'Squad'], ascending=[True, True], inplace=True)
-df_shooting.sort_values(['Player', 'Squad'], ascending=[True, True], inplace=True)
-df_passing.sort_values(['Player', 'Squad'], ascending=[True, True], inplace=True)
-df_pass_types.sort_values(['Player', 'Squad'], ascending=[True, True], inplace=True)
-df_gsca.sort_values(['Player', 'Squad'], ascending=[True, True], inplace=True)
-df_defense.sort_values(['Player', 'Squad'], ascending=[True, True], inplace=True)
-df_poss.sort_values(['Player', 'Squad'], ascending=[True, True], inplace=True)
-df_misc.sort_values(['Player', 'Squad'], ascending=[True, True], inplace=True)
-
-df_standard = df_standard.reset_index(drop=True)
-df_shooting = df_shooting.reset_index(drop=True)
-df_passing = df_passing.reset_index(drop=True)
-df_pass_types = df_pass_types.reset_index(drop=True)
-df_gsca = df_gsca.reset_index(drop=True)
-df_defense = df_defense.reset_index(drop=True)
-df_poss = df_poss.reset_index(drop=True)
-df_misc = df_misc.reset_index(drop=True)
-
-# Now the fun part... merging all raw tables into one.
-# Change any column name you want to change:
-# Example --   'Gls': 'Goals'  changes column "Gls" to be named "Goals", etc.
-## Note that I inclide all columns but don't always change the names... this is useful to me when I need to update the columns, like when FBRef witched to Opta data haha. I got lucky as this made it easier on me!
-
-df = df_standard.iloc[:, 0:10]
-df = df.join(df_standard.iloc[:, 13])
-df = df.join(df_standard.iloc[:, 26])
-df = df.rename(columns={'G-PK': 'npGoals', 'Gls':'Glsxx'})
-df = df.join(df_shooting.iloc[:,8:25])
-df = df.rename(columns={'Gls': 'Goals', 'Sh': 'Shots', 'SoT': 'SoT', 'SoT%': 'SoT%', 'Sh/90': 'Sh/90', 'SoT/90': 'SoT/90', 'G/Sh': 'G/Sh', 'G/SoT': 'G/SoT', 'Dist': 'AvgShotDistance', 'FK': 'FKShots', 'PK': 'PK', 'PKatt': 'PKsAtt', 'xG': 'xG', 'npxG': 'npxG', 'npxG/Sh': 'npxG/Sh', 'G-xG': 'G-xG', 'np:G-xG': 'npG-xG'})
-
-df = df.join(df_passing.iloc[:,8:13])
-df = df.rename(columns={'Cmp': 'PassesCompleted', 'Att': 'PassesAttempted', 'Cmp%': 'TotCmp%', 'TotDist': 'TotalPassDist', 'PrgDist': 'ProgPassDist', })
-df = df.join(df_passing.iloc[:,13:16])
-df = df.rename(columns={'Cmp': 'ShortPassCmp', 'Att': 'ShortPassAtt', 'Cmp%': 'ShortPassCmp%', })
-df = df.join(df_passing.iloc[:,16:19])
-df = df.rename(columns={'Cmp': 'MedPassCmp', 'Att': 'MedPassAtt', 'Cmp%': 'MedPassCmp%', })
-df = df.join(df_passing.iloc[:,19:22])
-df = df.rename(columns={'Cmp': 'LongPassCmp', 'Att': 'LongPassAtt', 'Cmp%': 'LongPassCmp%', })
-df = df.join(df_passing.iloc[:,22:31])
-df = df.rename(columns={'Ast': 'Assists', 'xAG':'xAG', 'xA': 'xA', 'A-xAG': 'A-xAG', 'KP': 'KeyPasses', '1/3': 'Final1/3Cmp', 'PPA': 'PenAreaCmp', 'CrsPA': 'CrsPenAreaCmp', 'PrgP': 'ProgPasses', })
-
-df = df.join(df_pass_types.iloc[:, 9:23])
-df = df.rename(columns={'Live': 'LivePass', 'Dead': 'DeadPass', 'FK': 'FKPasses', 'TB': 'ThruBalls', 'Sw': 'Switches', 'Crs': 'Crs', 'CK': 'CK', 'In': 'InSwingCK', 'Out': 'OutSwingCK', 'Str': 'StrCK', 'TI': 'ThrowIn', 'Off': 'PassesToOff', 'Blocks':'PassesBlocked', 'Cmp':'Cmpxxx'})
-
-df = df.join(df_gsca.iloc[:, 8:16].rename(columns={'SCA': 'SCA', 'SCA90': 'SCA90', 'PassLive': 'SCAPassLive', 'PassDead': 'SCAPassDead', 'TO': 'SCADrib', 'Sh': 'SCASh', 'Fld': 'SCAFld', 'Def': 'SCADef'}))
-df = df.join(df_gsca.iloc[:, 16:24].rename(columns={'GCA': 'GCA', 'GCA90': 'GCA90', 'PassLive': 'GCAPassLive', 'PassDead': 'GCAPassDead', 'TO': 'GCADrib', 'Sh': 'GCASh', 'Fld': 'GCAFld', 'Def': 'GCADef'}))
-
-df = df.join(df_defense.iloc[:,8:13].rename(columns={'Tkl': 'Tkl', 'TklW': 'TklWinPoss', 'Def 3rd': 'Def3rdTkl', 'Mid 3rd': 'Mid3rdTkl', 'Att 3rd': 'Att3rdTkl'}))
-df = df.join(df_defense.iloc[:,13:24].rename(columns={'Tkl': 'DrbTkl', 'Att': 'DrbPastAtt', 'Tkl%': 'DrbTkl%', 'Lost': 'DrbPast', 'Blocks': 'Blocks', 'Sh': 'ShBlocks', 'Pass': 'PassBlocks', 'Int': 'Int', 'Tkl+Int': 'Tkl+Int', 'Clr': 'Clr', 'Err': 'Err'}))
-
-df = df.join(df_poss.iloc[:,8:30])
-df = df.rename(columns={'Touches': 'Touches', 'Def Pen': 'DefPenTouch', 'Def 3rd': 'Def3rdTouch', 'Mid 3rd': 'Mid3rdTouch', 'Att 3rd': 'Att3rdTouch', 'Att Pen': 'AttPenTouch', 'Live': 'LiveTouch', 'Succ': 'SuccDrb', 'Att': 'AttDrb', 'Succ%': 'DrbSucc%', 'Tkld':'TimesTackled', 'Tkld%':'TimesTackled%', 'Carries':'Carries', 'TotDist':'TotalCarryDistance', 'PrgDist':'ProgCarryDistance', 'PrgC':'ProgCarries', '1/3':'CarriesToFinalThird', 'CPA':'CarriesToPenArea', 'Mis': 'CarryMistakes', 'Dis': 'Disposesed', 'Rec': 'ReceivedPass', 'PrgR':'ProgPassesRec'})
-
-df = df.join(df_misc.iloc[:, 8:14])
-df = df.rename(columns={'CrdY': 'Yellows', 'CrdR': 'Reds', '2CrdY': 'Yellow2', 'Fls': 'Fls', 'Fld': 'Fld', 'Off': 'Off', })
-df = df.join(df_misc.iloc[:,17:24])
-df = df.rename(columns={'PKwon': 'PKwon', 'PKcon': 'PKcon', 'OG': 'OG', 'Recov': 'Recov', 'Won': 'AerialWins', 'Lost': 'AerialLoss', 'Won%': 'AerialWin%', })
-
-# Make sure to drop all blank rows (FBRef's tables have several)
-df.dropna(subset = ["Player"], inplace=True)
-
-# Turn the minutes columns to integers. So from '1,500' to '1500'. Otherwise it can't do calculations with minutes
-for i in range(0,len(df)):
-    df.iloc[i][9] = df.iloc[i][9].replace(',','')
-df.iloc[:,9:] = df.iloc[:,9:].apply(pd.to_numeric)
-
-# Save the file to the root location
-df.to_csv("%s%s.csv" %(root, raw_nongk), index=False)
+categorical_columns = ['Player', 'Squad', 'Comp', 'Nation', 'Pos', 'Main Position', 'Position Group']
+memory_reports = []
 
-##################################################################################
-##################### Final file for outfield data ###############################
-##################################################################################
+@profiled('Compact dtypes')
+def compact_dtypes(df):
+    """
+    Downcasts float columns (percentiles, composites and raw stats) to float32, integer columns
+    to the smallest integer type that fits and repeated strings to categoricals
+    
+    Args:
+    df (DataFrame): Table to compact
+    
+    Returns:
+    Compacted DataFrame
+    """
+    dtypes = {col: 'float32' for col in df.select_dtypes(include='float').columns}
+    dtypes.update({col: 'category' for col in categorical_columns if col in df.columns})
+    df = df.astype(dtypes)
+    for col in df.select_dtypes(include='integer').columns:
+        df[col] = pd.to_numeric(df[col], downcast='integer')
+    return df
 
-df = pd.read_csv("%s%s.csv" %(root, raw_nongk))
-df_90s = pd.read_csv("%s%s.csv" %(root, raw_nongk))
-df_90s['90s'] = df_90s['Min']/90
-for i in range(10,125):
-    df_90s.iloc[:,i] = df_90s.iloc[:,i]/df_90s['90s']
-df_90s = df_90s.iloc[:,10:].add_suffix('Per90')
-df_new = df.join(df_90s)
+def validate_schema(df, stage, extra_float32_columns=()):
+    """
+    Checks a compacted table against the schema and raises listing every violation
+    
+    Args:
+    df (DataFrame): Table to check
+    stage (str): Stage name used in the error message
+    extra_float32_columns (list): Non-_PR columns expected as float32
+    """
+    problems = []
+    for col in [col for col in df.columns if col.endswith('_PR')] + list(extra_float32_columns):
+        if col not in df.columns:
+            problems.append(f"{col}: missing")
+        elif df[col].dtype != np.float32:
+            problems.append(f"{col}: {df[col].dtype} instead of float32")
+        elif ((df[col] < 0) | (df[col] > 100)).any():
+            problems.append(f"{col}: values outside 0-100")
+    for col in categorical_columns:
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype):
+            problems.append(f"{col}: {df[col].dtype} instead of category")
+    if problems:
+        raise ValueError(f"Schema check failed after {stage}:\n" + "\n".join(problems))
 
-for i in range(len(df_new)):
-    df_new['Age'][i] = int(df_new['Age'][i][:2])
+def memory_report(df, stage):
+    """
+    Records and prints the in-memory footprint of a table at a pipeline stage
+    """
+    report = {
+        'Stage': stage,
+        'Rows': len(df),
+        'Columns': df.shape[1],
+        'MB': round(df.memory_usage(deep=True).sum() / 1e6, 1)
+    }
+    memory_reports.append(report)
+    print(f"{stage}: {report['Rows']} rows x {report['Columns']} columns, {report['MB']} MB")
+    return report
 
-df_new.to_csv("%s%s.csv" %(root, final_nongk), index=False)
+# this section gets the raw tables from FBRef.com. Every (competition, season) pair is built
+# as an independent job, so other leagues and historical seasons only need adding to `jobs`.
 
-##################################################################################
-################ Download team data, for possession-adjusting ####################
-##################################################################################
+# FBref competition id and the name used in its URLs
+competitions = {
+    'Big5': ('Big5', 'Big-5-European-Leagues'),
+    'Premier League': ('9', 'Premier-League'),
+    'La Liga': ('12', 'La-Liga'),
+    'Serie A': ('11', 'Serie-A'),
+    'Bundesliga': ('20', 'Bundesliga'),
+    'Ligue 1': ('13', 'Ligue-1'),
+    'Eredivisie': ('23', 'Eredivisie'),
+    'Primeira Liga': ('32', 'Primeira-Liga'),
+    'Championship': ('10', 'Championship'),
+    'MLS': ('22', 'Major-League-Soccer')
+}
 
-standard = "https://fbref.com/en/comps/Big5/stats/squads/Big-5-European-Leagues-Stats"
-poss = "https://fbref.com/en/comps/Big5/possession/squads/Big-5-European-Leagues-Stats"
+# Stat pages scraped for the player tables, with the id of the player table on single-league pages
+player_stat_pages = {
+    'stats': 'stats_standard',
+    'shooting': 'stats_shooting',
+    'passing': 'stats_passing',
+    'passing_types': 'stats_passing_types',
+    'gca': 'stats_gca',
+    'defense': 'stats_defense',
+    'possession': 'stats_possession',
+    'misc': 'stats_misc'
+}
 
-df_standard = get_df(standard)
-df_poss = get_df(poss)
+# Goalkeeping pages, scraped by the keeper build
+keeper_stat_pages = {
+    'keepers': 'stats_keeper',
+    'keepersadv': 'stats_keeper_adv'
+}
 
-df_standard = df_standard.reset_index(drop=True)
-df_poss = df_poss.reset_index(drop=True)
+def fbref_url(stat, competition='Big5', season=current_season, level='players'):
+    """
+    Builds the FBref URL of a stat page. The current season has no season in its URL.
+    
+    Args:
+    stat (str): Stat page, e.g. 'stats', 'passing', 'possession'
+    competition (str): Key in competitions (default: 'Big5')
+    season (str): Season, e.g. '2023-2024' (default: current_season)
+    level (str): 'players' or 'squads'; single-league pages hold both (default: 'players')
+    """
+    comp_id, comp_name = competitions[competition]
+    season_path = '' if season == current_season else f"{season}/"
+    season_prefix = '' if season == current_season else f"{season}-"
+    level_path = f"{level}/" if competition == 'Big5' else ''
+    return f"https://fbref.com/en/comps/{comp_id}/{season_path}{stat}/{level_path}{season_prefix}{comp_name}-Stats"
 
-############################################
+def dataset_name(kind, competition=None, season=current_season):
+    """
+    File name for a stage output, e.g. 'Final FBRef 2024-2025' for the Big-5 and
+    'Final FBRef Eredivisie 2024-2025' for other competitions
+    """
+    if competition in (None, 'Big5'):
+        return f"{kind} FBRef {season}"
+    return f"{kind} FBRef {competition} {season}"
 
-df = df_standard.iloc[:, 0:30]
+# Every scraped table is checkpointed as soon as it has been downloaded and parsed. A scrape
+# restarted within scrape_resume_hours reuses those checkpoints instead of downloading the tables
+# again, and a table that still fails after its retries falls back to its last checkpoint, flagged
+# stale, so one failing page no longer costs the whole run.
+scrape_checkpoint_dir = f"{root}Scrape Checkpoints"
+scrape_resume_hours = 2
 
-# Gets the number of touches a team has per 90
-df['TeamTouches90'] = float(0.0)
-for i in range(len(df)):
-    df.iloc[i,30] = float(df_poss.iloc[i,5]) / float(df_poss.iloc[i,4])
+def _checkpoint_folder(competition, season, kind='Scrape'):
+    # Keeper tables are scraped by their own process, so they keep their own folder and status
+    return os.path.join(scrape_checkpoint_dir, dataset_name(kind, competition, season))
 
-# Take out the comma in minutes like above
-for j in range(0,len(df)):
-    df.at[j,'Min'] = df.at[j,'Min'].replace(',','')
-df.iloc[:,7:] = df.iloc[:,7:].apply(pd.to_numeric)
-df.to_csv("%s%s TEAMS.csv" %(root, final_nongk), index=False)
+def _update_scrape_status(folder, table_name, **fields):
+    # status.json keeps, per table, when it was last saved and whether its last download failed
+    path = os.path.join(folder, 'status.json')
+    status = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            status = json.load(f)
+    status.setdefault(table_name, {}).update(fields)
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(status, f, indent=2)
+    os.replace(f"{path}.tmp", path)
 
+def checkpointed_table(table_name, fetch, competition, season, kind='Scrape'):
+    """
+    Scrapes a table through its checkpoint
+    
+    Args:
+    table_name (str): Name of the table, unique within the competition and season
+    fetch (callable): Downloads and parses the table, e.g. a get_df call
+    competition, season: Job the table belongs to
+    kind (str): 'Scrape' for the outfield and squad tables, 'Keeper Scrape' for the keeper tables
+    
+    Returns:
+    DataFrame. When it is an older checkpoint standing in for a failed download,
+    .attrs['stale_since'] holds the checkpoint's time.
+    """
+    folder = _checkpoint_folder(competition, season, kind)
+    path = os.path.join(folder, f"{table_name}.pkl")
+    saved = os.path.getmtime(path) if os.path.exists(path) else None
+    
+    # Resume: downloaded recently, by this run or by an interrupted one
+    if saved is not None and time.time() - saved < scrape_resume_hours * 3600:
+        return pd.read_pickle(path)
+    
+    now = datetime.now().isoformat(timespec='seconds')
+    try:
+        table = fetch()
+    except Exception as e:
+        if saved is None:
+            raise
+        stale_since = datetime.fromtimestamp(saved).isoformat(timespec='seconds')
+        print(f"{competition} {season} {table_name}: {e}; using its checkpoint from {stale_since}")
+        _update_scrape_status(folder, table_name, failed=now, error=str(e), stale=True)
+        table = pd.read_pickle(path)
+        table.attrs['stale_since'] = stale_since
+        return table
+    
+    os.makedirs(folder, exist_ok=True)
+    table.to_pickle(f"{path}.tmp")
+    os.replace(f"{path}.tmp", path)
+    saved = datetime.fromtimestamp(os.path.getmtime(path)).isoformat(timespec='seconds')
+    _update_scrape_status(folder, table_name, saved=saved, failed=None, error=None, stale=False)
+    return table
 
-##################################################################################
-################ Download opposition data, for possession-adjusting ##############
-##################################################################################
+def scrape_status(competition, season, kind='Scrape'):
+    """
+    When each table of a job was last saved, and which are stale because their last download failed
+    
+    Args:
+    kind (str): 'Scrape' or 'Keeper Scrape', as for checkpointed_table (default: 'Scrape')
+    
+    Returns:
+    DataFrame indexed by table with 'saved', 'failed', 'error' and 'stale'
+    """
+    path = os.path.join(_checkpoint_folder(competition, season, kind), 'status.json')
+    if not os.path.exists(path):
+        return pd.DataFrame(columns=['saved', 'failed', 'error', 'stale'])
+    with open(path) as f:
+        return pd.DataFrame.from_dict(json.load(f), orient='index')
 
-opp_poss = "https://fbref.com/en/comps/Big5/possession/squads/Big-5-European-Leagues-Stats"
+# Example usage:
+# scrape_status('Big5', current_season)
 
-df_opp_poss = get_opp_df(opp_poss)
-df_opp_poss = df_opp_poss.reset_index(drop=True)
+@profiled('Scrape player tables')
+def scrape_player_tables(competition, season, pages=player_stat_pages, kind='Scrape'):
+    """
+    Downloads the player stat tables of a competition and season, each through its checkpoint
+    
+    Args:
+    pages (dict): Stat page -> player table id on single-league pages (default: player_stat_pages)
+    kind (str): Checkpoint kind, as for checkpointed_table (default: 'Scrape')
+    
+    Returns:
+    dict of stat page -> DataFrame, sorted by player and squad
+    """
+    tables = {}
+    for stat, table_id in pages.items():
+        table = checkpointed_table(stat, lambda: get_df(fbref_url(stat, competition, season),
+                                                        table_id=None if competition == 'Big5' else table_id),
+                                   competition, season, kind)
+        
+        # Single-league tables have no Comp column; add it so column positions match the Big-5
+        if 'Comp' not in table.columns:
+            table.insert(4, 'Comp', competition)
+        
+        # Sort then reset the indexes. Without this step, you will run into issues with players
+        # who play minutes for 2 clubs in a season.
+        table.sort_values(['Player', 'Squad'], ascending=[True, True], inplace=True)
+        tables[stat] = table.reset_index(drop=True)
+    return tables
 
-############################################
+@profiled('Merge player tables')
+def merge_player_tables(tables):
+    """
+    Merges the raw player tables into one, renaming columns along the way
+    """
+    df_standard = tables['stats']
+    df_shooting = tables['shooting']
+    df_passing = tables['passing']
+    df_pass_types = tables['passing_types']
+    df_gsca = tables['gca']
+    df_defense = tables['defense']
+    df_poss = tables['possession']
+    df_misc = tables['misc']
 
-df = df_opp_poss.iloc[:, 0:15]
-df = df.rename(columns={'Touches':'Opp Touches'})
-df = df.reset_index()
+    # Now the fun part... merging all raw tables into one.
+    # Change any column name you want to change:
+    # Example --   'Gls': 'Goals'  changes column "Gls" to be named "Goals", etc.
+    ## Note that I inclide all columns but don't always change the names... this is useful to me when I need to update the columns, like when FBRef witched to Opta data haha. I got lucky as this made it easier on me!
 
-#############################################
+    df = df_standard.iloc[:, 0:10]
+    df = df.join(df_standard.iloc[:, 13])
+    df = df.join(df_standard.iloc[:, 26])
+    df = df.rename(columns={'G-PK': 'npGoals', 'Gls':'Glsxx'})
+    df = df.join(df_shooting.iloc[:,8:25])
+    df = df.rename(columns={'Gls': 'Goals', 'Sh': 'Shots', 'SoT': 'SoT', 'SoT%': 'SoT%', 'Sh/90': 'Sh/90', 'SoT/90': 'SoT/90', 'G/Sh': 'G/Sh', 'G/SoT': 'G/SoT', 'Dist': 'AvgShotDistance', 'FK': 'FKShots', 'PK': 'PK', 'PKatt': 'PKsAtt', 'xG': 'xG', 'npxG': 'npxG', 'npxG/Sh': 'npxG/Sh', 'G-xG': 'G-xG', 'np:G-xG': 'npG-xG'})
 
-df1 = pd.read_csv("%s%s TEAMS.csv"%(root, final_nongk))
+    df = df.join(df_passing.iloc[:,8:13])
+    df = df.rename(columns={'Cmp': 'PassesCompleted', 'Att': 'PassesAttempted', 'Cmp%': 'TotCmp%', 'TotDist': 'TotalPassDist', 'PrgDist': 'ProgPassDist', })
+    df = df.join(df_passing.iloc[:,13:16])
+    df = df.rename(columns={'Cmp': 'ShortPassCmp', 'Att': 'ShortPassAtt', 'Cmp%': 'ShortPassCmp%', })
+    df = df.join(df_passing.iloc[:,16:19])
+    df = df.rename(columns={'Cmp': 'MedPassCmp', 'Att': 'MedPassAtt', 'Cmp%': 'MedPassCmp%', })
+    df = df.join(df_passing.iloc[:,19:22])
+    df = df.rename(columns={'Cmp': 'LongPassCmp', 'Att': 'LongPassAtt', 'Cmp%': 'LongPassCmp%', })
+    df = df.join(df_passing.iloc[:,22:31])
+    df = df.rename(columns={'Ast': 'Assists', 'xAG':'xAG', 'xA': 'xA', 'A-xAG': 'A-xAG', 'KP': 'KeyPasses', '1/3': 'Final1/3Cmp', 'PPA': 'PenAreaCmp', 'CrsPA': 'CrsPenAreaCmp', 'PrgP': 'ProgPasses', })
 
-df1['Opp Touches'] = 1
-for i in range(len(df1)):
-    df1['Opp Touches'][i] = df['Opp Touches'][i]
-df1 = df1.rename(columns={'Min':'Team Min'})
-df1.to_csv("%s%s TEAMS.csv" %(root, final_nongk), index=False)
+    df = df.join(df_pass_types.iloc[:, 9:23])
+    df = df.rename(columns={'Live': 'LivePass', 'Dead': 'DeadPass', 'FK': 'FKPasses', 'TB': 'ThruBalls', 'Sw': 'Switches', 'Crs': 'Crs', 'CK': 'CK', 'In': 'InSwingCK', 'Out': 'OutSwingCK', 'Str': 'StrCK', 'TI': 'ThrowIn', 'Off': 'PassesToOff', 'Blocks':'PassesBlocked', 'Cmp':'Cmpxxx'})
 
+    df = df.join(df_gsca.iloc[:, 8:16].rename(columns={'SCA': 'SCA', 'SCA90': 'SCA90', 'PassLive': 'SCAPassLive', 'PassDead': 'SCAPassDead', 'TO': 'SCADrib', 'Sh': 'SCASh', 'Fld': 'SCAFld', 'Def': 'SCADef'}))
+    df = df.join(df_gsca.iloc[:, 16:24].rename(columns={'GCA': 'GCA', 'GCA90': 'GCA90', 'PassLive': 'GCAPassLive', 'PassDead': 'GCAPassDead', 'TO': 'GCADrib', 'Sh': 'GCASh', 'Fld': 'GCAFld', 'Def': 'GCADef'}))
 
-##################################################################################
-################ Make the final, complete, outfield data file ####################
-##################################################################################
+    df = df.join(df_defense.iloc[:,8:13].rename(columns={'Tkl': 'Tkl', 'TklW': 'TklWinPoss', 'Def 3rd': 'Def3rdTkl', 'Mid 3rd': 'Mid3rdTkl', 'Att 3rd': 'Att3rdTkl'}))
+    df = df.join(df_defense.iloc[:,13:24].rename(columns={'Tkl': 'DrbTkl', 'Att': 'DrbPastAtt', 'Tkl%': 'DrbTkl%', 'Lost': 'DrbPast', 'Blocks': 'Blocks', 'Sh': 'ShBlocks', 'Pass': 'PassBlocks', 'Int': 'Int', 'Tkl+Int': 'Tkl+Int', 'Clr': 'Clr', 'Err': 'Err'}))
 
-df = pd.read_csv("%s%s.csv" %(root, final_nongk))
-teams = pd.read_csv("%s%s TEAMS.csv" %(root, final_nongk))
-
-df['AvgTeamPoss'] = float(0.0)
-df['OppTouches'] = int(1)
-df['TeamMins'] = int(1)
-df['TeamTouches90'] = float(0.0)
-
-player_list = list(df['Player'])
-
-for i in range(len(player_list)):
-    team_name = df[df['Player']==player_list[i]]['Squad'].values[0]
-    team_poss = teams[teams['Squad']==team_name]['Poss'].values[0]
-    opp_touch = teams[teams['Squad']==team_name]['Opp Touches'].values[0]
-    team_mins = teams[teams['Squad']==team_name]['Team Min'].values[0]
-    team_touches = teams[teams['Squad']==team_name]['TeamTouches90'].values[0]
-    df.at[i, 'AvgTeamPoss'] = team_poss
-    df.at[i, 'OppTouches'] = opp_touch
-    df.at[i, 'TeamMins'] = team_mins
-    df.at[i, 'TeamTouches90'] = team_touches
-
-# All of these are the possession-adjusted columns. A couple touch-adjusted ones at the bottom
-df['pAdjTkl+IntPer90'] = (df['Tkl+IntPer90']/(100-df['AvgTeamPoss']))*50
-df['pAdjClrPer90'] = (df['ClrPer90']/(100-df['AvgTeamPoss']))*50
-df['pAdjShBlocksPer90'] = (df['ShBlocksPer90']/(100-df['AvgTeamPoss']))*50
-df['pAdjPassBlocksPer90'] = (df['PassBlocksPer90']/(100-df['AvgTeamPoss']))*50
-df['pAdjIntPer90'] = (df['IntPer90']/(100-df['AvgTeamPoss']))*50
-df['pAdjDrbTklPer90'] = (df['DrbTklPer90']/(100-df['AvgTeamPoss']))*50
-df['pAdjTklWinPossPer90'] = (df['DrbTklPer90']/(100-df['AvgTeamPoss']))*50
-df['pAdjDrbPastPer90'] = (df['DrbPastPer90']/(100-df['AvgTeamPoss']))*50
-df['pAdjAerialWinsPer90'] = (df['AerialWinsPer90']/(100-df['AvgTeamPoss']))*50
-df['pAdjAerialLossPer90'] = (df['AerialLossPer90']/(100-df['AvgTeamPoss']))*50
-df['pAdjDrbPastAttPer90'] = (df['DrbPastAttPer90']/(100-df['AvgTeamPoss']))*50
-df['TouchCentrality'] = (df['TouchesPer90']/df['TeamTouches90'])*100
-# df['pAdj#OPAPer90'] =(df['#OPAPer90']/(100-df['AvgTeamPoss']))*50
-df['Tkl+IntPer600OppTouch'] = df['Tkl+Int'] /(df['OppTouches']*(df['Min']/df['TeamMins']))*600
-df['pAdjTouchesPer90'] = (df['TouchesPer90']/(df['AvgTeamPoss']))*50
-df['CarriesPer50Touches'] = df['Carries'] / df['Touches'] * 50
-df['ProgCarriesPer50Touches'] = df['ProgCarries'] / df['Touches'] * 50
-df['ProgPassesPer50CmpPasses'] = df['ProgPasses'] / df['PassesCompleted'] * 50
-df['ProgDistancePerCarry'] = (df['ProgCarriesPer90'] / df['ProgCarryDistancePer90']) * 100
-df['ProgCarryEfficiency'] = ((df['CarriesToFinalThirdPer90'] * df['CarriesToPenAreaPer90']) / df['CarriesPer90']) * 100
-# Convert player for transferMakrt merge
-df['PlayerFBref'] = df['Player']
-# What % of pass types does a player make
-df['ShortPass%'] = (df['ShortPassAttPer90'] / df['PassesAttemptedPer90']) * 100
-df['MediumPass%'] = (df['MedPassAttPer90'] / df['PassesAttemptedPer90']) * 100
-df['LongPass%'] = (df['LongPassAttPer90'] / df['PassesAttemptedPer90']) * 100
-df['ProgPass%'] = (df['ProgPassesPer90'] / df['PassesAttemptedPer90']) * 100
-df['Switch%'] = (df['SwitchesPer90'] / df['PassesAttemptedPer90']) * 100
-df['KeyPass%'] = (df['KeyPassesPer90'] / df['PassesAttemptedPer90']) * 100
-df['Final3rdPass%'] = (df['Final1/3CmpPer90'] / df['PassesAttemptedPer90']) * 100
-df['ThroughPass%'] = (df['ThruBallsPer90'] / df['PassesAttemptedPer90']) * 100
-# Where does a player touch the ball
-df['Def3rdTouch%'] = (df['Def3rdTouchPer90'] / df['LiveTouchPer90']) * 100
-df['Mid3rdTouch%'] = (df['Mid3rdTouchPer90'] / df['LiveTouchPer90']) * 100
-df['Att3rdTouch%'] = (df['Att3rdTouchPer90'] / df['LiveTouchPer90']) * 100
-df['AttPenTouch%'] = (df['AttPenTouchPer90'] / df['LiveTouchPer90']) * 100
-df['ActionsPerTouch'] = ((df['PassesAttemptedPer90'] + df['ShotsPer90']) / df['LiveTouchPer90']) * 100
-# Where does a player attempt tackles
-df['Def3rdTkl%'] = (df['Def3rdTklPer90'] / df['TklPer90']) * 100
-df['Mid3rdTkl%'] = (df['Mid3rdTklPer90'] / df['TklPer90']) * 100
-df['Att3rdTkl%'] = (df['Att3rdTklPer90'] / df['TklPer90']) * 100
-
-#All of these are aggregated metrics
-
-
-# Now we'll add the players' actual positions, from @jaseziv, into the file
-#tm_pos = pd.read_csv('https://github.com/griffisben/Soccer-Analyses/blob/main/TransfermarktPositions-Jase_Ziv83.csv?raw=true')
-tm_pos = pd.read_csv('https://github.com/JaseZiv/worldfootballR_data/raw/master/raw-data/fbref-tm-player-mapping/output/fbref_to_tm_mapping.csv')
-df = pd.merge(df, tm_pos, on ='PlayerFBref', how ='left')
-
-for i in range(len(df)):
-    if df.Pos[i] == 'GK':
-        df['PlayerFBref'][i] = 'Goalkeeper'
-df.to_csv("%s%s.csv" %(root, final_nongk), index=False, encoding='utf-8-sig')
-
-df.head()
-
-# Method 1: Convert to string first
-unique_values = df['Main Position'].astype(str).unique()
-print("Method 1:", unique_values)
+    df = df.join(df_poss.iloc[:,8:30])
+    df = df.rename(columns={'Touches': 'Touches', 'Def Pen': 'DefPenTouch', 'Def 3rd': 'Def3rdTouch', 'Mid 3rd': 'Mid3rdTouch', 'Att 3rd': 'Att3rdTouch', 'Att Pen': 'AttPenTouch', 'Live': 'LiveTouch', 'Succ': 'SuccDrb', 'Att': 'AttDrb', 'Succ%': 'DrbSucc%', 'Tkld':'TimesTackled', 'Tkld%':'TimesTackled%', 'Carries':'Carries', 'TotDist':'TotalCarryDistance', 'PrgDist':'ProgCarryDistance', 'PrgC':'ProgCarries', '1/3':'CarriesToFinalThird', 'CPA':'CarriesToPenArea', 'Mis': 'CarryMistakes', 'Dis': 'Disposesed', 'Rec': 'ReceivedPass', 'PrgR':'ProgPassesRec'})
 
-# Create datasets for each position
+    df = df.join(df_misc.iloc[:, 8:14])
+    df = df.rename(columns={'CrdY': 'Yellows', 'CrdR': 'Reds', '2CrdY': 'Yellow2', 'Fls': 'Fls', 'Fld': 'Fld', 'Off': 'Off', })
+    df = df.join(df_misc.iloc[:,17:24])
+    df = df.rename(columns={'PKwon': 'PKwon', 'PKcon': 'PKcon', 'OG': 'OG', 'Recov': 'Recov', 'Won': 'AerialWins', 'Lost': 'AerialLoss', 'Won%': 'AerialWin%', })
 
-# Filter for Full Backs
-df_players_fb = df[
-                    (df['Min'] / df['TeamMins'] >= 0.20) & 
-                    (df['Main Position'].isin(['Left-Back', 'Right-Back']))
-                  ].drop_duplicates()
-
-# Filter for Centre Backs
-df_players_cb = df[
-                    (df['Min'] / df['TeamMins'] >= 0.20) & 
-                    (df['Main Position'].isin(['Centre-Back']))
-                  ].drop_duplicates()
-
-# Filter for Defensive Mids
-df_players_dm = df[
-                    (df['Min'] / df['TeamMins'] >= 0.20) & 
-                    (df['Main Position'].isin(['Defensive Midfield']))
-                  ].drop_duplicates()
-
-# Filter for Centre Mids
-df_players_cm = df[
-                    (df['Min'] / df['TeamMins'] >= 0.20) & 
-                    (df['Main Position'].isin(['Central Midfield']))
-                  ].drop_duplicates()
-
-# Filter for Attacking Mids
-df_players_am = df[
-                    (df['Min'] / df['TeamMins'] >= 0.20) & 
-                    (df['Main Position'].isin(['Attacking Midfield', 'Second Striker']))
-                  ].drop_duplicates()
-
-# Filter for Wingers
-df_players_wi = df[
-                    (df['Min'] / df['TeamMins'] >= 0.20) & 
-                    (df['Main Position'].isin(['Left Winger', 'Left Midfield', 'Right Winger', 'Right Midfield']))
-                  ].drop_duplicates()
-
-# Filter for Strikers
-df_players_st = df[
-                    (df['Min'] / df['TeamMins'] >= 0.20) & 
-                    (df['Main Position'].isin(['Centre-Forward']))
-                  ].drop_duplicates()
-
-def create_percentile_rankings(position_df, metrics_to_rank):
-    """
-    Creates percentile rankings for specified metrics within a position group
+    # Make sure to drop all blank rows (FBRef's tables have several)
+    df.dropna(subset = ["Player"], inplace=True)
+
+    # Turn the minutes columns to integers. So from '1,500' to '1500'. Otherwise it can't do calculations with minutes
+    df['Min'] = df['Min'].astype(str).str.replace(',', '')
+    df.iloc[:,9:] = df.iloc[:,9:].apply(pd.to_numeric)
     
-    Args:
-    position_df: DataFrame containing only players of a specific position
-    metrics_to_rank: List of column names to create percentiles for
+    if 'PlayerID' in df_standard.columns:
+        df['PlayerID'] = df_standard['PlayerID']
+    return df
+
+# Percentages, averages and per-shot or per-90 rates in the raw table. They are ranked as they are,
+# so add_per90 makes no per-90 copy of them
+per90_rate_columns = ['SoT%', 'Sh/90', 'SoT/90', 'G/Sh', 'G/SoT', 'AvgShotDistance', 'npxG/Sh',
+                      'TotCmp%', 'ShortPassCmp%', 'MedPassCmp%', 'LongPassCmp%', 'SCA90', 'GCA90',
+                      'DrbTkl%', 'DrbSucc%', 'TimesTackled%', 'AerialWin%']
+
+@profiled('Per 90')
+def add_per90(raw_path):
+    """
+    Adds a per-90 copy of every counting stat to the raw table saved at raw_path
+    """
+    df = pd.read_csv(raw_path, dtype={'PlayerID': str})
+    df_90s = pd.read_csv(raw_path, dtype={'PlayerID': str})
+    df_90s['90s'] = df_90s['Min']/90
+    for i in range(10,125):
+        if df_90s.columns[i] not in per90_rate_columns:
+            df_90s.iloc[:,i] = df_90s.iloc[:,i]/df_90s['90s']
+    df_90s = df_90s.iloc[:,10:].drop(columns=['PlayerID', 'Fingerprint'] + per90_rate_columns, errors='ignore').add_suffix('Per90')
+    df_new = df.join(df_90s)
+
+    df_new['Age'] = df_new['Age'].astype(str).str[:2].astype(int)
+    return df_new
+
+@profiled('Scrape team table')
+def scrape_team_table(competition, season):
+    """
+    Downloads team and opposition data, for possession-adjusting
     
     Returns:
-    DataFrame with new percentile columns
+    DataFrame with one row per squad, including 'TeamTouches90', 'Team Min' and 'Opp Touches'
     """
-    percentile_df = position_df.copy()
-    
-    for metric in metrics_to_rank:
-        # Create the percentile column name
-        percentile_col = f'{metric}_PR'
-        
-        # Calculate percentile rank
-        percentile_df[percentile_col] = percentile_df[metric].rank(pct=True) * 100
-        
-        # Round to 1 decimal place
-        percentile_df[percentile_col] = percentile_df[percentile_col].round(1)
-    
-    return percentile_df
+    df_standard = checkpointed_table('squads stats', lambda: get_df(fbref_url('stats', competition, season, level='squads')),
+                                     competition, season)
+    df_poss = checkpointed_table('squads possession', lambda: get_df(fbref_url('possession', competition, season, level='squads')),
+                                 competition, season)
+    df_opp_poss = checkpointed_table('squads opponent possession',
+                                     lambda: get_opp_df(fbref_url('possession', competition, season, level='squads')),
+                                     competition, season)
+    return build_team_table(df_standard, df_poss, df_opp_poss, competition)
 
-# Example usage for fullbacks
-# List the metrics you want to create percentiles for
-metrics_to_rank = [
-    'Min', 'G+A', 'Glsxx', 'Goals', 'Shots', 'SoT', 'SoT%', 'Sh/90', 'SoT/90', 'G/Sh', 'G/SoT', 'AvgShotDistance', 'FKShots', 'PK', 'PKsAtt', 'xG', 'npxG', 'npxG/Sh', 'G-xG', 'npG-xG', 'PassesCompleted', 'PassesAttempted', 'TotCmp%', 'TotalPassDist', 'ProgPassDist', 'ShortPassCmp', 'ShortPassAtt', 'ShortPassCmp%', 'MedPassCmp', 'MedPassAtt', 'MedPassCmp%', 'LongPassCmp', 'LongPassAtt', 'LongPassCmp%', 'Assists', 'xAG', 'xA', 'A-xAG', 'KeyPasses', 'Final1/3Cmp', 'PenAreaCmp', 'CrsPenAreaCmp', 'ProgPasses', 'LivePass', 'DeadPass', 'FKPasses', 'ThruBalls', 'Switches', 'Crs', 'ThrowIn', 'CK', 'InSwingCK', 'OutSwingCK', 'StrCK', 'Cmpxxx', 'PassesToOff', 'PassesBlocked', 'SCA', 'SCA90', 'SCAPassLive', 'SCAPassDead', 'SCADrib', 'SCASh', 'SCAFld', 'SCADef', 'GCA', 'GCA90', 'GCAPassLive', 'GCAPassDead', 'GCADrib', 'GCASh', 'GCAFld', 'GCADef', 'Tkl', 'TklWinPoss', 'Def3rdTkl', 'Mid3rdTkl', 'Att3rdTkl', 'DrbTkl', 'DrbPastAtt', 'DrbTkl%', 'DrbPast', 'Blocks', 'ShBlocks', 'PassBlocks', 'Int', 'Tkl+Int', 'Clr', 'Err', 'Touches', 'DefPenTouch', 'Def3rdTouch', 'Mid3rdTouch', 'Att3rdTouch', 'AttPenTouch', 'LiveTouch', 'AttDrb', 'SuccDrb', 'DrbSucc%', 'TimesTackled', 'TimesTackled%', 'Carries', 'TotalCarryDistance', 'ProgCarryDistance', 'ProgCarries', 'CarriesToFinalThird', 'CarriesToPenArea', 'CarryMistakes', 'Disposesed', 'ReceivedPass', 'ProgPassesRec', 'Yellows', 'Reds', 'Yellow2', 'Fls', 'Fld', 'Off', 'PKwon', 'PKcon', 'OG', 'Recov', 'AerialWins', 'AerialLoss', 'AerialWin%', 'G+APer90', 'GlsxxPer90', 'GoalsPer90', 'ShotsPer90', 'SoTPer90', 'SoT%Per90', 'Sh/90Per90', 'SoT/90Per90', 'G/ShPer90', 'G/SoTPer90', 'AvgShotDistancePer90', 'FKShotsPer90', 'PKPer90', 'PKsAttPer90', 'xGPer90', 'npxGPer90', 'npxG/ShPer90', 'G-xGPer90', 'npG-xGPer90', 'PassesCompletedPer90', 'PassesAttemptedPer90', 'TotCmp%Per90', 'TotalPassDistPer90', 'ProgPassDistPer90', 'ShortPassCmpPer90', 'ShortPassAttPer90', 'ShortPassCmp%Per90', 'MedPassCmpPer90', 'MedPassAttPer90', 'MedPassCmp%Per90', 'LongPassCmpPer90', 'LongPassAttPer90', 'LongPassCmp%Per90', 'AssistsPer90', 'xAGPer90', 'xAPer90', 'A-xAGPer90', 'KeyPassesPer90', 'Final1/3CmpPer90', 'PenAreaCmpPer90', 'CrsPenAreaCmpPer90', 'ProgPassesPer90', 'LivePassPer90', 'DeadPassPer90', 'FKPassesPer90', 'ThruBallsPer90', 'SwitchesPer90', 'CrsPer90', 'ThrowInPer90', 'CKPer90', 'InSwingCKPer90', 'OutSwingCKPer90', 'StrCKPer90', 'CmpxxxPer90', 'PassesToOffPer90', 'PassesBlockedPer90', 'SCAPer90', 'SCA90Per90', 'SCAPassLivePer90', 'SCAPassDeadPer90', 'SCADribPer90', 'SCAShPer90', 'SCAFldPer90', 'SCADefPer90', 'GCAPer90', 'GCA90Per90', 'GCAPassLivePer90', 'GCAPassDeadPer90', 'GCADribPer90', 'GCAShPer90', 'GCAFldPer90', 'GCADefPer90', 'TklPer90', 'TklWinPossPer90', 'Def3rdTklPer90', 'Mid3rdTklPer90', 'Att3rdTklPer90', 'DrbTklPer90', 'DrbPastAttPer90', 'DrbTkl%Per90', 'DrbPastPer90', 'BlocksPer90', 'ShBlocksPer90', 'PassBlocksPer90', 'IntPer90', 'Tkl+IntPer90', 'ClrPer90', 'ErrPer90', 'TouchesPer90', 'DefPenTouchPer90', 'Def3rdTouchPer90', 'Mid3rdTouchPer90', 'Att3rdTouchPer90', 'AttPenTouchPer90', 'LiveTouchPer90', 'AttDrbPer90', 'SuccDrbPer90', 'DrbSucc%Per90', 'TimesTackledPer90', 'TimesTackled%Per90', 'CarriesPer90', 'TotalCarryDistancePer90', 'ProgCarryDistancePer90', 'ProgCarriesPer90', 'CarriesToFinalThirdPer90', 'CarriesToPenAreaPer90', 'CarryMistakesPer90', 'DisposesedPer90', 'ReceivedPassPer90', 'ProgPassesRecPer90', 'YellowsPer90', 'RedsPer90', 'Yellow2Per90', 'FlsPer90', 'FldPer90', 'OffPer90', 'PKwonPer90', 'PKconPer90', 'OGPer90', 'RecovPer90', 'AerialWinsPer90', 'AerialLossPer90', 'AerialWin%Per90', '90sPer90', 'AvgTeamPoss', 'OppTouches', 'TeamMins', 'TeamTouches90', 'pAdjTkl+IntPer90', 'pAdjClrPer90', 'pAdjShBlocksPer90', 'pAdjPassBlocksPer90', 'pAdjIntPer90', 'pAdjDrbTklPer90', 'pAdjTklWinPossPer90', 'pAdjDrbPastPer90', 'pAdjAerialWinsPer90', 'pAdjAerialLossPer90', 'pAdjDrbPastAttPer90', 'TouchCentrality', 'Tkl+IntPer600OppTouch', 'pAdjTouchesPer90', 'CarriesPer50Touches', 'ProgCarriesPer50Touches', 'ProgPassesPer50CmpPasses'
-    # Add more metrics as needed
-]
+def build_team_table(df_standard, df_poss, df_opp_poss, competition):
+    """
+    Builds the team table from the raw squad standard, possession and opposition possession tables
+    """
+    # Single-league squad tables have no Comp column; add it so column positions match the Big-5
+    for table in (df_standard, df_poss, df_opp_poss):
+        if 'Comp' not in table.columns:
+            table.insert(1, 'Comp', competition)
 
-# Create percentile rankings for fullbacks
-df_players_fb = create_percentile_rankings(df_players_fb, metrics_to_rank)
-
-# Repeat for other position groups
-df_players_cb = create_percentile_rankings(df_players_cb, metrics_to_rank)
-df_players_dm = create_percentile_rankings(df_players_dm, metrics_to_rank)
-df_players_cm = create_percentile_rankings(df_players_cm, metrics_to_rank)
-df_players_am = create_percentile_rankings(df_players_am, metrics_to_rank)
-df_players_wi = create_percentile_rankings(df_players_wi, metrics_to_rank)
-df_players_st = create_percentile_rankings(df_players_st, metrics_to_rank)
-
-# Example to view results for a specific player
-#player_name = "Trent Alexander-Arnold"  # Replace with any player name
-#if player_name in df_players_fb['Player'].values:
-#    player_percentiles = df_players_fb[df_players_fb['Player'] == player_name]
-#    print(f"\nPercentile rankings for {player_name}:")
-#    for metric in metrics_to_rank:
-#        percentile = player_percentiles[f'{metric}_percentile'].values[0]
-#        print(f"{metric}: {percentile:.1f}th percentile")
-
-df_players_fb.head()
-
-# First, concatenate all position DataFrames vertically
-df_combined = pd.concat([
-    df_players_fb,
-    df_players_cb,
-    df_players_dm,
-    df_players_cm,
-    df_players_am,
-    df_players_wi,
-    df_players_st
-], axis=0)
-
-# Reset the index of the combined DataFrame
-df_combined = df_combined.reset_index(drop=True)
-
-# Save the combined DataFrame if needed
-df_combined.to_csv(f"{root}Combined_Players_With_Percentiles.csv", index=False)
-
-# Verify the merge worked correctly
-print("Total players in combined DataFrame:", len(df_combined))
-print("Players by position:")
-print(df_combined['Main Position'].value_counts())
-
-# First, let's see what columns are actually in the DataFrame
-print("Available columns in df_players_fb:")
-print(df_players_fb.columns.tolist())
-
-# All of these are aggregated columns
-df_combined['Aerial Ability']= (df_combined['AerialWin%Per90_PR']+df_combined['pAdjAerialWinsPer90_PR'])/2
-df_combined['Box Defending']= (df_combined['ShBlocksPer90_PR']+df_combined['ClrPer90_PR']+df_combined['pAdjClrPer90_PR']+df_combined['pAdjShBlocksPer90_PR'])/4
-df_combined['1v1 Defending']= (df_combined['TklWinPossPer90_PR']+df_combined['DrbTkl%Per90_PR'])/2
-df_combined['Defensive Awareness']= (df_combined['IntPer90_PR']+df_combined['PassBlocksPer90_PR']+df_combined['pAdjPassBlocksPer90_PR']+df_combined['pAdjIntPer90_PR'])/4
-df_combined['Pass Progression'] = (df_combined['ProgPassesPer90_PR']+df_combined['ProgPassesPer50CmpPasses_PR']+df_combined['ProgPassDistPer90_PR'])/3
-df_combined['Pass Retention'] = (df_combined['TotCmp%Per90_PR']+df_combined['ShortPassCmp%Per90_PR']+df_combined['MedPassCmp%Per90_PR']+df_combined['LongPassCmp%Per90_PR'])/4
-df_combined['Ball Carrying'] = (df_combined['ProgCarryDistancePer90_PR']+df_combined['ProgCarriesPer90_PR']+df_combined['ProgCarriesPer50Touches_PR'])/3
-df_combined['Volume of Take-ons'] = (df_combined['AttDrbPer90_PR'])
-df_combined['Retention from Take-ons'] = (df_combined['SuccDrbPer90_PR']+df_combined['DrbSucc%Per90_PR'])/2
-df_combined['Chance Creation'] = (df_combined['xAGPer90_PR']+df_combined['xAPer90_PR']+df_combined['KeyPassesPer90_PR']+df_combined['SCAPassLivePer90_PR'])/4
-df_combined['Impact in and around box'] = (df_combined['Final1/3CmpPer90_PR']+df_combined['PenAreaCmpPer90_PR']+df_combined['CrsPenAreaCmpPer90_PR']+df_combined['ThruBallsPer90_PR']+df_combined['Att3rdTouchPer90_PR']+df_combined['AttPenTouchPer90_PR'])/6
-df_combined['Shot Volume'] = (df_combined['ShotsPer90_PR'])
-df_combined['Shot Quality'] = (df_combined['AvgShotDistancePer90_PR']+df_combined['npxG/ShPer90_PR'])/2
-df_combined['Self-created Shots'] = (df_combined['SCADribPer90_PR'])
-
-df_combined.head()
-
-# Create a new column 'Position Group' based on Main Position
-def map_position_group(position):
-    if position in ['Left-Back', 'Right-Back']:
-        return 'FB'
-    elif position == 'Centre-Back':
-        return 'CB'
-    elif position == 'Defensive Midfield':
-        return 'DM'
-    elif position == 'Central Midfield':
-        return 'CM'
-    elif position in ['Attacking Midfield', 'Second Striker']:
-        return 'AM'
-    elif position in ['Left Winger', 'Left Midfield', 'Right Winger', 'Right Midfield']:
-        return 'W'
-    elif position == 'Centre-Forward':
-        return 'ST'
-    else:
-        return 'Other'
+    df_standard = df_standard.reset_index(drop=True)
+    df_poss = df_poss.reset_index(drop=True)
+    df_opp_poss = df_opp_poss.reset_index(drop=True)
 
-# Apply the mapping to create new column
-df_combined['Position Group'] = df_combined['Main Position'].apply(map_position_group)
+    df = df_standard.iloc[:, 0:30]
 
-# Verify the results
-print("Position Group counts:")
-print(df_combined['Position Group'].value_counts())
+    # Gets the number of touches a team has per 90
+    df['TeamTouches90'] = df_poss.iloc[:, 5].astype(float) / df_poss.iloc[:, 4].astype(float)
 
-df_combined = df_combined.sort_values('Min', ascending=False).drop_duplicates(subset=['Player', 'Position Group'], keep='first')
+    # Take out the comma in minutes like above
+    df['Min'] = df['Min'].astype(str).str.replace(',', '')
+    df.iloc[:,7:] = df.iloc[:,7:].apply(pd.to_numeric)
 
-dupe_check = df_combined.query('Player == "Chiquinho"')
-dupe_check.head()
+    # The opposition table lists squads in the same order
+    df['Opp Touches'] = pd.to_numeric(df_opp_poss['Touches']).values
+    df = df.rename(columns={'Min':'Team Min'})
+    return df
 
-from urllib.request import urlopen
+# FBref to Transfermarkt player mapping, with each player's main position
+tm_mapping_url = 'https://github.com/JaseZiv/worldfootballR_data/raw/master/raw-data/fbref-tm-player-mapping/output/fbref_to_tm_mapping.csv'
 
-import matplotlib.pyplot as plt
-from PIL import Image
+# This section defines the possession-adjusted and ratio metrics as a table, so a new one is a
+# single row. Each metric is numerator / denominator * scale, where the numerator and denominator
+# are columns or one of the derived_bases below. All of them are evaluated together: numerators and
+# denominators are stacked into two matrices and divided in one pass, and wherever the denominator
+# is zero or missing (no touches, no passes, 100% possession) or the numerator is missing, the
+# metric is 0 rather than inf/NaN, so it can't end up at the top of, or drop out of, the
+# percentile rankings.
 
-from mplsoccer import PyPizza, add_image, FontManager
+# Denominators and numerators that aren't a single column
+derived_bases = {
+    'OppPoss': lambda col: 100 - col('AvgTeamPoss'),
+    'OppTouchesFaced': lambda col: col('OppTouches') * (col('Min') / col('TeamMins')),
+    'ActionsPer90': lambda col: col('PassesAttemptedPer90') + col('ShotsPer90'),
+    'FinalThirdXPenAreaCarries': lambda col: col('CarriesToFinalThirdPer90') * col('CarriesToPenAreaPer90'),
+}
 
-font_normal = FontManager('https://raw.githubusercontent.com/googlefonts/roboto/main/'
-                          'src/hinted/Roboto-Regular.ttf')
-font_italic = FontManager('https://raw.githubusercontent.com/googlefonts/roboto/main/'
-                          'src/hinted/Roboto-Italic.ttf')
-font_bold = FontManager('https://raw.githubusercontent.com/google/fonts/main/apache/robotoslab/'
-                        'RobotoSlab[wght].ttf')
+# (column, numerator, denominator, scale)
+derived_metrics = [
+    # Possession-adjusted: per 50% of possession the opponent has
+    ('pAdjTkl+IntPer90', 'Tkl+IntPer90', 'OppPoss', 50),
+    ('pAdjClrPer90', 'ClrPer90', 'OppPoss', 50),
+    ('pAdjShBlocksPer90', 'ShBlocksPer90', 'OppPoss', 50),
+    ('pAdjPassBlocksPer90', 'PassBlocksPer90', 'OppPoss', 50),
+    ('pAdjIntPer90', 'IntPer90', 'OppPoss', 50),
+    ('pAdjDrbTklPer90', 'DrbTklPer90', 'OppPoss', 50),
+    # Computed from the dribblers tackled, like pAdjDrbTklPer90, as the dashboard always has
+    ('pAdjTklWinPossPer90', 'DrbTklPer90', 'OppPoss', 50),
+    ('pAdjDrbPastPer90', 'DrbPastPer90', 'OppPoss', 50),
+    ('pAdjAerialWinsPer90', 'AerialWinsPer90', 'OppPoss', 50),
+    ('pAdjAerialLossPer90', 'AerialLossPer90', 'OppPoss', 50),
+    ('pAdjDrbPastAttPer90', 'DrbPastAttPer90', 'OppPoss', 50),
+    # ('pAdj#OPAPer90', '#OPAPer90', 'OppPoss', 50),
+    # Touch-adjusted
+    ('TouchCentrality', 'TouchesPer90', 'TeamTouches90', 100),
+    ('Tkl+IntPer600OppTouch', 'Tkl+Int', 'OppTouchesFaced', 600),
+    ('pAdjTouchesPer90', 'TouchesPer90', 'AvgTeamPoss', 50),
+    ('CarriesPer50Touches', 'Carries', 'Touches', 50),
+    ('ProgCarriesPer50Touches', 'ProgCarries', 'Touches', 50),
+    ('ProgPassesPer50CmpPasses', 'ProgPasses', 'PassesCompleted', 50),
+    ('ProgDistancePerCarry', 'ProgCarriesPer90', 'ProgCarryDistancePer90', 100),
+    ('ProgCarryEfficiency', 'FinalThirdXPenAreaCarries', 'CarriesPer90', 100),
+    # What % of pass types does a player make
+    ('ShortPass%', 'ShortPassAttPer90', 'PassesAttemptedPer90', 100),
+    ('MediumPass%', 'MedPassAttPer90', 'PassesAttemptedPer90', 100),
+    ('LongPass%', 'LongPassAttPer90', 'PassesAttemptedPer90', 100),
+    ('ProgPass%', 'ProgPassesPer90', 'PassesAttemptedPer90', 100),
+    ('Switch%', 'SwitchesPer90', 'PassesAttemptedPer90', 100),
+    ('KeyPass%', 'KeyPassesPer90', 'PassesAttemptedPer90', 100),
+    ('Final3rdPass%', 'Final1/3CmpPer90', 'PassesAttemptedPer90', 100),
+    ('ThroughPass%', 'ThruBallsPer90', 'PassesAttemptedPer90', 100),
+    # Where does a player touch the ball
+    ('Def3rdTouch%', 'Def3rdTouchPer90', 'LiveTouchPer90', 100),
+    ('Mid3rdTouch%', 'Mid3rdTouchPer90', 'LiveTouchPer90', 100),
+    ('Att3rdTouch%', 'Att3rdTouchPer90', 'LiveTouchPer90', 100),
+    ('AttPenTouch%', 'AttPenTouchPer90', 'LiveTouchPer90', 100),
+    ('ActionsPerTouch', 'ActionsPer90', 'LiveTouchPer90', 100),
+    # Where does a player attempt tackles
+    ('Def3rdTkl%', 'Def3rdTklPer90', 'TklPer90', 100),
+    ('Mid3rdTkl%', 'Mid3rdTklPer90', 'TklPer90', 100),
+    ('Att3rdTkl%', 'Att3rdTklPer90', 'TklPer90', 100),
+]
 
-def create_player_pizza(player_name, df=df_combined, save_fig=False):
+def add_derived_metrics(df, metrics=derived_metrics, bases=derived_bases):
     """
-    Creates a pizza chart for a specified player based on their position group
+    Adds the derived metrics to a table with the per-90 and team context columns
     
     Args:
-    player_name (str): Name of the player
-    df (DataFrame): DataFrame containing player data (default: df_combined)
-    save_fig (bool): Whether to save the figure (default: False)
-    """
-    
-    # Get player's data and position group
-    player_data = df[df['Player'] == player_name].iloc[0]
-    position_group = player_data['Position Group']
-    squad = player_data['Squad']
-    
-    # Define metrics for each position group (same as radar chart)
-    metrics_by_position = {
-        'FB': [
-            'Defensive Awareness', 'Box Defending', '1v1 Defending',
-            'Pass Progression', 'Pass Retention', 'Ball Carrying',
-            'Volume of Take-ons', 'Chance Creation', 'Impact in and around box'
-        ],
-        'CB': [
-            'Aerial Ability', 'Box Defending', '1v1 Defending',
-            'Defensive Awareness', 'Pass Retention', 'Pass Progression',
-            'Ball Carrying', 'Impact in and around box', 'TouchCentrality'
-        ],
-        'DM': [
-            'Defensive Awareness', '1v1 Defending', 'Pass Retention',
-            'Pass Progression', 'Ball Carrying', 'TouchCentrality',
-            'Impact in and around box', 'Chance Creation', 'Shot Volume'
-        ],
-        'CM': [
-            'Pass Retention', 'Pass Progression', 'Ball Carrying',
-            'TouchCentrality', 'Chance Creation', 'Impact in and around box',
-            'Shot Volume', 'Shot Quality', 'Defensive Awareness'
-        ],
-        'AM': [
-            'Pass Progression', 'Ball Carrying', 'Volume of Take-ons',
-            'Retention from Take-ons', 'Chance Creation', 'Impact in and around box',
-            'Shot Volume', 'Shot Quality', 'Self-created Shots'
-        ],
-        'W': [
-            'Volume of Take-ons', 'Retention from Take-ons', 'Ball Carrying',
-            'Pass Progression', 'Chance Creation', 'Impact in and around box',
-            'Shot Volume', 'Shot Quality', 'Self-created Shots'
-        ],
-        'ST': [
-            'Shot Volume', 'Shot Quality', 'Self-created Shots',
-            'Impact in and around box', 'Aerial Ability', 'Ball Carrying',
-            'Volume of Take-ons', 'Chance Creation', 'Pass Retention'
-        ]
-    }
+    df (DataFrame): Per-90 player table with AvgTeamPoss, OppTouches, TeamMins and TeamTouches90
+    metrics (list): (column, numerator, denominator, scale) rows (default: derived_metrics)
+    bases (dict): Name to function of a column getter, for operands that aren't a column
+    (default: derived_bases)
     
-    # Get metrics for player's position
-    metrics = metrics_by_position[position_group]
-    values = [round(player_data[metric]) for metric in metrics]
+    Returns:
+    DataFrame: df with one column per metric, 0 wherever the denominator is zero or missing or
+    the numerator is missing
+    """
+    # Each column and base is read as a float array once, however many metrics use it
+    arrays = {}
+    def operand(name):
+        if name not in arrays:
+            arrays[name] = bases[name](operand) if name in bases else df[name].to_numpy(dtype=float)
+        return arrays[name]
+    columns, numerators, denominators, scales = zip(*metrics)
+    num = np.column_stack([operand(name) for name in numerators])
+    den = np.column_stack([operand(name) for name in denominators])
+    derived = np.zeros(num.shape)
+    np.divide(num, den, out=derived, where=np.isfinite(num) & (den != 0) & np.isfinite(den))
+    derived *= np.array(scales, dtype=float)
+    derived = pd.DataFrame(derived, index=df.index, columns=list(columns))
+    return pd.concat([df.drop(columns=derived.columns, errors='ignore'), derived], axis=1)
+
+# Example usage:
+# df = add_derived_metrics(df)
+
+@profiled('Team enrichment')
+def enrich_with_team_data(df, teams, tm_pos=None):
+    """
+    Makes the final, complete, outfield data: team context, possession-adjusted and ratio metrics,
+    and the players' positions
     
-    # color for the slices and text
-    slice_colors = ["#1A78CF"] * 9
-    text_colors = ["#000000"] * 9
+    Args:
+    df (DataFrame): Per-90 player table
+    teams (DataFrame): Team table from scrape_team_table
+    tm_pos (DataFrame): FBref to Transfermarkt mapping with 'PlayerFBref' and 'Main Position'
+    (default: None, downloads tm_mapping_url)
+    """
+    # Each row takes its own squad's team context, looked up once per squad
+    team_context = teams.drop_duplicates('Squad').set_index('Squad')
+    df['AvgTeamPoss'] = df['Squad'].map(team_context['Poss']).astype(float)
+    df['OppTouches'] = df['Squad'].map(team_context['Opp Touches'])
+    df['TeamMins'] = df['Squad'].map(team_context['Team Min'])
+    df['TeamTouches90'] = df['Squad'].map(team_context['TeamTouches90']).astype(float)
 
-    # instantiate PyPizza class
-    baker = PyPizza(
-        params=metrics,                  # list of parameters
-        background_color="#EBEBE9",     # background color
-        straight_line_color="#EBEBE9",  # color for straight lines
-        straight_line_lw=1,             # linewidth for straight lines
-        last_circle_lw=0,               # linewidth of last circle
-        other_circle_lw=0,              # linewidth for other circles
-        inner_circle_size=20            # size of inner circle
-    )
+    df = add_derived_metrics(df)
+    # Convert player for transferMakrt merge
+    df['PlayerFBref'] = df['Player']
 
-    # plot pizza
-    fig, ax = baker.make_pizza(
-        values,                          # list of values
-        figsize=(8, 8.5),                # adjust figsize according to your need
-        color_blank_space="same",        # use same color to fill blank space
-        slice_colors=slice_colors,       # color for individual slices
-        value_colors=text_colors,        # color for the value-text
-        value_bck_colors=slice_colors,   # color for the blank spaces
-        blank_alpha=0.4,                 # alpha for blank-space colors
-        kwargs_slices=dict(
-            edgecolor="#F2F2F2", zorder=2, linewidth=1
-        ),                               # values to be used when plotting slices
-        kwargs_params=dict(
-            color="#000000", fontsize=11,
-            fontproperties=font_normal.prop, va="center"
-        ),                               # values to be used when adding parameter
-        kwargs_values=dict(
-            color="#000000", fontsize=11,
-            fontproperties=font_normal.prop, zorder=3,
-            bbox=dict(
-                edgecolor="#000000", facecolor="cornflowerblue",
-                boxstyle="round,pad=0.2", lw=1
-            )
-        )                                # values to be used when adding parameter-values
-    )
+    # Now we'll add the players' actual positions, from @jaseziv, into the file
+    #tm_pos = pd.read_csv('https://github.com/griffisben/Soccer-Analyses/blob/main/TransfermarktPositions-Jase_Ziv83.csv?raw=true')
+    if tm_pos is None:
+        tm_pos = pd.read_csv(io.BytesIO(fetch_page(tm_mapping_url, delay=0)))
+    df = pd.merge(df, tm_pos, on ='PlayerFBref', how ='left')
 
-    # add title
-    fig.text(
-        0.515, 0.975, f"{player_name} - {squad} | {position_group} Template | 24/25 Season", size=16,
-        ha="center", fontproperties=font_bold.prop, color="#000000"
-    )
+    df.loc[df['Pos'] == 'GK', 'PlayerFBref'] = 'Goalkeeper'
+    return df
 
-    # add subtitle
-    fig.text(
-        0.515, 0.953,
-        f"Percentile Rank vs Top-Five League {position_group}'s",
-        size=13,
-        ha="center", fontproperties=font_bold.prop, color="#000000"
-    )
+# This section generates synthetic raw tables, for load and scaling tests well beyond what can be
+# scraped. The player and keeper tables have the columns get_df returns for each stat page, the
+# squad tables those of the squad pages, and the position mapping the columns enrichment reads. Values come
+# from per-position rates: each stat has a per-90 rate and a category, each position scales the
+# categories (centre-backs win more aerials, strikers shoot more) and each player gets a talent
+# factor per category. Successes are drawn from their attempts, and totals, percentages and per-90
+# columns are derived, so the tables stay consistent with each other.
 
-    # add credits
-    CREDIT_1 = "data: opta viz fbref | using mplsoccer"
-    CREDIT_2 = "inspired by: @Worville, @FootballSlices, @somazerofc & @Soumyaj15209314"
+# Share of players per Transfermarkt main position
+synthetic_positions = {
+    'Goalkeeper': 0.09, 'Centre-Back': 0.18, 'Left-Back': 0.08, 'Right-Back': 0.08,
+    'Defensive Midfield': 0.08, 'Central Midfield': 0.12, 'Attacking Midfield': 0.06,
+    'Second Striker': 0.01, 'Left Winger': 0.06, 'Right Winger': 0.06, 'Left Midfield': 0.02,
+    'Right Midfield': 0.02, 'Centre-Forward': 0.14
+}
 
-    fig.text(
-        0.99, 0.02, f"{CREDIT_1}\n{CREDIT_2}", size=9,
-        fontproperties=font_italic.prop, color="#000000",
-        ha="right"
-    )
+# FBref position and rate profile of each main position
+synthetic_fbref_positions = {
+    'Goalkeeper': ('GK', 'GK'), 'Centre-Back': ('DF', 'CB'), 'Left-Back': ('DF', 'FB'),
+    'Right-Back': ('DF', 'FB'), 'Defensive Midfield': ('MF', 'DM'), 'Central Midfield': ('MF', 'CM'),
+    'Attacking Midfield': ('MF,FW', 'AM'), 'Second Striker': ('FW,MF', 'AM'), 'Left Winger': ('FW,MF', 'W'),
+    'Right Winger': ('FW,MF', 'W'), 'Left Midfield': ('MF,FW', 'W'), 'Right Midfield': ('MF,FW', 'W'),
+    'Centre-Forward': ('FW', 'ST')
+}
 
-    plt.show()
+# How much each position does of each category of stat, relative to an average outfielder
+synthetic_profiles = pd.DataFrame({
+    #          shoot create pass  prog  carry dribble defend aerial box   card  cross setpiece
+    'GK':     [0.02, 0.10, 0.80, 0.30, 0.30, 0.02,   0.10,  0.30,  0.50, 0.30, 0.02, 0.10],
+    'CB':     [0.30, 0.20, 1.30, 1.00, 0.80, 0.20,   1.20,  2.00,  2.50, 1.00, 0.10, 0.30],
+    'FB':     [0.40, 0.90, 1.00, 1.10, 1.20, 0.80,   1.30,  0.80,  1.00, 1.10, 2.00, 0.80],
+    'DM':     [0.50, 0.60, 1.40, 1.40, 1.00, 0.50,   1.50,  1.00,  0.90, 1.40, 0.30, 0.60],
+    'CM':     [0.80, 1.00, 1.30, 1.30, 1.10, 0.80,   1.10,  0.70,  0.50, 1.10, 0.70, 1.00],
+    'AM':     [1.40, 1.80, 1.00, 1.00, 1.20, 1.50,   0.60,  0.40,  0.20, 0.80, 1.00, 1.50],
+    'W':      [1.50, 1.50, 0.80, 0.80, 1.50, 2.00,   0.60,  0.40,  0.20, 0.70, 1.80, 1.00],
+    'ST':     [2.50, 0.90, 0.50, 0.40, 0.80, 1.00,   0.40,  1.50,  0.30, 0.80, 0.40, 0.30]
+}, index=['shoot', 'create', 'pass', 'prog', 'carry', 'dribble', 'defend', 'aerial', 'box', 'card', 'cross', 'setpiece'])
 
-from sklearn import preprocessing
-from sklearn.decomposition import PCA
-from sklearn.cluster import KMeans
-    
-def find_similar_players(player_name, df=df_combined, n_clusters=20, top_n=5):
-    """
+# How each stat is drawn or derived:
+#   ('count', category, per-90 rate)   Poisson count over the player's minutes
+#   ('float', category, per-90 rate)   continuous total, e.g. expected goals
+#   ('binom', attempts, p)             successes out of another count
+#   ('sum', a, b, ...), ('lin', [(key, coefficient), ...]) totals, floored at 0
+#   ('diff', a, b)                     a - b, may be negative
+#   ('pct', part, whole), ('ratio', part, whole), ('per90', key)
+#   ('normal', mean, sd, low, high)    e.g. average shot distance
+synthetic_rules = {
+    'G-PK': ('count', 'shoot', 0.11), 'PKatt': ('count', 'setpiece', 0.012), 'PK': ('binom', 'PKatt', 0.78),
+    'Gls': ('sum', 'G-PK', 'PK'), 'Ast': ('count', 'create', 0.09), 'G+A': ('sum', 'Gls', 'Ast'),
+    'G+A-PK': ('sum', 'G-PK', 'Ast'), 'CrdY': ('count', 'card', 0.18), 'CrdR': ('count', 'card', 0.008),
+    '2CrdY': ('count', 'card', 0.005), 'npxG': ('float', 'shoot', 0.10),
+    'xG': ('lin', [('npxG', 1), ('PKatt', 0.76)]), 'xAG': ('float', 'create', 0.08),
+    'npxG+xAG': ('sum', 'npxG', 'xAG'), 'xG+xAG': ('sum', 'xG', 'xAG'), 'PrgC': ('count', 'carry', 1.6),
+    'PrgP': ('count', 'prog', 2.6), 'PrgR': ('count', 'create', 2.4),
+    'Sh': ('count', 'shoot', 1.3), 'SoT': ('binom', 'Sh', 0.34), 'SoT%': ('pct', 'SoT', 'Sh'),
+    'G/Sh': ('ratio', 'Gls', 'Sh'), 'G/SoT': ('ratio', 'Gls', 'SoT'), 'Dist': ('normal', 17, 3, 5, 35),
+    'FKSh': ('count', 'setpiece', 0.03), 'npxG/Sh': ('ratio', 'npxG', 'Sh'), 'G-xG': ('diff', 'Gls', 'xG'),
+    'npG-xG': ('diff', 'G-PK', 'npxG'),
+    'ShortAtt': ('count', 'pass', 18), 'MedAtt': ('count', 'pass', 17), 'LongAtt': ('count', 'prog', 5),
+    'ShortCmp': ('binom', 'ShortAtt', 0.88), 'MedCmp': ('binom', 'MedAtt', 0.80),
+    'LongCmp': ('binom', 'LongAtt', 0.55), 'PassAtt': ('sum', 'ShortAtt', 'MedAtt', 'LongAtt'),
+    'PassCmp': ('sum', 'ShortCmp', 'MedCmp', 'LongCmp'), 'PassCmp%': ('pct', 'PassCmp', 'PassAtt'),
+    'ShortCmp%': ('pct', 'ShortCmp', 'ShortAtt'), 'MedCmp%': ('pct', 'MedCmp', 'MedAtt'),
+    'LongCmp%': ('pct', 'LongCmp', 'LongAtt'),
+    'PassTotDist': ('lin', [('ShortCmp', 10), ('MedCmp', 20), ('LongCmp', 38)]),
+    'PassPrgDist': ('lin', [('MedCmp', 5), ('LongCmp', 20)]), 'xA': ('float', 'create', 0.08),
+    'A-xAG': ('diff', 'Ast', 'xAG'), 'KP': ('count', 'create', 1.0), 'Final1/3': ('count', 'prog', 3.5),
+    'PPA': ('count', 'create', 0.6), 'CrsPA': ('count', 'cross', 0.12),
+    'FKPass': ('count', 'setpiece', 0.25), 'TB': ('count', 'create', 0.1), 'Sw': ('count', 'prog', 0.4),
+    'Crs': ('count', 'cross', 1.2), 'TI': ('count', 'cross', 0.9), 'CK': ('count', 'setpiece', 0.3),
+    'InCK': ('binom', 'CK', 0.4), 'OutCK': ('binom', 'CK', 0.4), 'StrCK': ('binom', 'CK', 0.05),
+    'Dead': ('sum', 'FKPass', 'CK', 'TI'), 'Live': ('lin', [('PassAtt', 1), ('Dead', -1)]),
+    'PassOff': ('count', 'pass', 0.03), 'PassBlocked': ('count', 'pass', 0.35),
+    'SCA': ('count', 'create', 2.2), 'SCA90': ('per90', 'SCA'), 'SCAPassLive': ('binom', 'SCA', 0.7),
+    'SCAPassDead': ('binom', 'SCA', 0.1), 'SCATO': ('binom', 'SCA', 0.06), 'SCASh': ('binom', 'SCA', 0.07),
+    'SCAFld': ('binom', 'SCA', 0.05), 'SCADef': ('binom', 'SCA', 0.02),
+    'GCA': ('count', 'create', 0.2), 'GCA90': ('per90', 'GCA'), 'GCAPassLive': ('binom', 'GCA', 0.7),
+    'GCAPassDead': ('binom', 'GCA', 0.1), 'GCATO': ('binom', 'GCA', 0.05), 'GCASh': ('binom', 'GCA', 0.08),
+    'GCAFld': ('binom', 'GCA', 0.05), 'GCADef': ('binom', 'GCA', 0.02),
+    'Tkl': ('count', 'defend', 1.6), 'TklW': ('binom', 'Tkl', 0.6), 'Def3rdTkl': ('binom', 'Tkl', 0.45),
+    'Mid3rdTkl': ('binom', 'Tkl', 0.4), 'Att3rdTkl': ('binom', 'Tkl', 0.15),
+    'DrbTkl': ('count', 'defend', 0.7), 'DrbPast': ('count', 'defend', 0.8),
+    'DrbAtt': ('sum', 'DrbTkl', 'DrbPast'), 'DrbTkl%': ('pct', 'DrbTkl', 'DrbAtt'),
+    'ShBlocks': ('count', 'box', 0.25), 'PassBlocks': ('count', 'defend', 0.9),
+    'Blocks': ('sum', 'ShBlocks', 'PassBlocks'), 'Int': ('count', 'defend', 1.0), 'Tkl+Int': ('sum', 'Tkl', 'Int'),
+    'Clr': ('count', 'box', 1.8), 'Err': ('count', 'card', 0.02),
+    'DefPenTouch': ('count', 'box', 3), 'Def3rdTouch': ('count', 'defend', 14),
+    'Mid3rdTouch': ('count', 'pass', 22), 'Att3rdTouch': ('count', 'create', 14),
+    'AttPenTouch': ('count', 'shoot', 2.5),
+    'Touches': ('sum', 'Def3rdTouch', 'Mid3rdTouch', 'Att3rdTouch'),
+    'LiveTouch': ('lin', [('Touches', 1), ('Dead', -1)]), 'TakeOnAtt': ('count', 'dribble', 1.6),
+    'TakeOnSucc': ('binom', 'TakeOnAtt', 0.45), 'TakeOnSucc%': ('pct', 'TakeOnSucc', 'TakeOnAtt'),
+    'Tkld': ('binom', 'TakeOnAtt', 0.45), 'Tkld%': ('pct', 'Tkld', 'TakeOnAtt'),
+    'Carries': ('count', 'carry', 28), 'CarryTotDist': ('lin', [('Carries', 6)]),
+    'CarryPrgDist': ('lin', [('PrgC', 18)]), 'Carries1/3': ('count', 'carry', 0.9),
+    'CPA': ('count', 'dribble', 0.35), 'Mis': ('count', 'dribble', 1.2), 'Dis': ('count', 'dribble', 0.9),
+    'Rec': ('count', 'pass', 30),
+    'Fls': ('count', 'card', 1.0), 'Fld': ('count', 'dribble', 1.0), 'Off': ('count', 'shoot', 0.15),
+    'PKwon': ('count', 'dribble', 0.01), 'PKcon': ('count', 'defend', 0.01), 'OG': ('count', 'box', 0.005),
+    'Recov': ('count', 'defend', 5.5), 'AerialWon': ('count', 'aerial', 1.2),
+    'AerialLost': ('count', 'aerial', 1.2), 'AerialAtt': ('sum', 'AerialWon', 'AerialLost'),
+    'AerialWon%': ('pct', 'AerialWon', 'AerialAtt')
+}
+for key in ['Gls', 'Ast', 'G+A', 'G-PK', 'G+A-PK', 'xG', 'xAG', 'xG+xAG', 'npxG', 'npxG+xAG', 'Sh', 'SoT']:
+    synthetic_rules[f'{key}/90'] = ('per90', key)
+
+# Columns after the identity columns of each player stat page: (heading, stat key)
+_per90_headings = [('Gls', 'Gls/90'), ('Ast', 'Ast/90'), ('G+A', 'G+A/90'), ('G-PK', 'G-PK/90'),
+                   ('G+A-PK', 'G+A-PK/90'), ('xG', 'xG/90'), ('xAG', 'xAG/90'), ('xG+xAG', 'xG+xAG/90'),
+                   ('npxG', 'npxG/90'), ('npxG+xAG', 'npxG+xAG/90')]
+synthetic_layouts = {
+    'stats': [('MP', 'MP'), ('Starts', 'Starts'), ('Min', 'Min'), ('90s', '90s')]
+             + [(key, key) for key in ['Gls', 'Ast', 'G+A', 'G-PK', 'PK', 'PKatt', 'CrdY', 'CrdR', 'xG', 'npxG',
+                                       'xAG', 'npxG+xAG', 'PrgC', 'PrgP', 'PrgR']] + _per90_headings,
+    'shooting': [('90s', '90s'), ('Gls', 'Gls'), ('Sh', 'Sh'), ('SoT', 'SoT'), ('SoT%', 'SoT%'),
+                 ('Sh/90', 'Sh/90'), ('SoT/90', 'SoT/90'), ('G/Sh', 'G/Sh'), ('G/SoT', 'G/SoT'),
+                 ('Dist', 'Dist'), ('FK', 'FKSh'), ('PK', 'PK'), ('PKatt', 'PKatt'), ('xG', 'xG'),
+                 ('npxG', 'npxG'), ('npxG/Sh', 'npxG/Sh'), ('G-xG', 'G-xG'), ('np:G-xG', 'npG-xG')],
+    'passing': [('90s', '90s'), ('Cmp', 'PassCmp'), ('Att', 'PassAtt'), ('Cmp%', 'PassCmp%'),
+                ('TotDist', 'PassTotDist'), ('PrgDist', 'PassPrgDist'), ('Cmp', 'ShortCmp'),
+                ('Att', 'ShortAtt'), ('Cmp%', 'ShortCmp%'), ('Cmp', 'MedCmp'), ('Att', 'MedAtt'),
+                ('Cmp%', 'MedCmp%'), ('Cmp', 'LongCmp'), ('Att', 'LongAtt'), ('Cmp%', 'LongCmp%'),
+                ('Ast', 'Ast'), ('xAG', 'xAG'), ('xA', 'xA'), ('A-xAG', 'A-xAG'), ('KP', 'KP'),
+                ('1/3', 'Final1/3'), ('PPA', 'PPA'), ('CrsPA', 'CrsPA'), ('PrgP', 'PrgP')],
+    'passing_types': [('90s', '90s'), ('Att', 'PassAtt'), ('Live', 'Live'), ('Dead', 'Dead'),
+                      ('FK', 'FKPass'), ('TB', 'TB'), ('Sw', 'Sw'), ('Crs', 'Crs'), ('TI', 'TI'),
+                      ('CK', 'CK'), ('In', 'InCK'), ('Out', 'OutCK'), ('Str', 'StrCK'), ('Cmp', 'PassCmp'),
+                      ('Off', 'PassOff'), ('Blocks', 'PassBlocked')],
+    'gca': [('90s', '90s'), ('SCA', 'SCA'), ('SCA90', 'SCA90'), ('PassLive', 'SCAPassLive'),
+            ('PassDead', 'SCAPassDead'), ('TO', 'SCATO'), ('Sh', 'SCASh'), ('Fld', 'SCAFld'),
+            ('Def', 'SCADef'), ('GCA', 'GCA'), ('GCA90', 'GCA90'), ('PassLive', 'GCAPassLive'),
+            ('PassDead', 'GCAPassDead'), ('TO', 'GCATO'), ('Sh', 'GCASh'), ('Fld', 'GCAFld'), ('Def', 'GCADef')],
+    'defense': [('90s', '90s'), ('Tkl', 'Tkl'), ('TklW', 'TklW'), ('Def 3rd', 'Def3rdTkl'),
+                ('Mid 3rd', 'Mid3rdTkl'), ('Att 3rd', 'Att3rdTkl'), ('Tkl', 'DrbTkl'), ('Att', 'DrbAtt'),
+                ('Tkl%', 'DrbTkl%'), ('Lost', 'DrbPast'), ('Blocks', 'Blocks'), ('Sh', 'ShBlocks'),
+                ('Pass', 'PassBlocks'), ('Int', 'Int'), ('Tkl+Int', 'Tkl+Int'), ('Clr', 'Clr'), ('Err', 'Err')],
+    'possession': [('90s', '90s'), ('Touches', 'Touches'), ('Def Pen', 'DefPenTouch'),
+                   ('Def 3rd', 'Def3rdTouch'), ('Mid 3rd', 'Mid3rdTouch'), ('Att 3rd', 'Att3rdTouch'),
+                   ('Att Pen', 'AttPenTouch'), ('Live', 'LiveTouch'), ('Att', 'TakeOnAtt'),
+                   ('Succ', 'TakeOnSucc'), ('Succ%', 'TakeOnSucc%'), ('Tkld', 'Tkld'), ('Tkld%', 'Tkld%'),
+                   ('Carries', 'Carries'), ('TotDist', 'CarryTotDist'), ('PrgDist', 'CarryPrgDist'),
+                   ('PrgC', 'PrgC'), ('1/3', 'Carries1/3'), ('CPA', 'CPA'), ('Mis', 'Mis'), ('Dis', 'Dis'),
+                   ('Rec', 'Rec'), ('PrgR', 'PrgR')],
+    'misc': [('90s', '90s'), ('CrdY', 'CrdY'), ('CrdR', 'CrdR'), ('2CrdY', '2CrdY'), ('Fls', 'Fls'),
+             ('Fld', 'Fld'), ('Off', 'Off'), ('Crs', 'Crs'), ('Int', 'Int'), ('TklW', 'TklW'),
+             ('PKwon', 'PKwon'), ('PKcon', 'PKcon'), ('OG', 'OG'), ('Recov', 'Recov'),
+             ('Won', 'AerialWon'), ('Lost', 'AerialLost'), ('Won%', 'AerialWon%')]
+}
+
+# Squad pages: totals of the players' stats, or their mean for percentages
+synthetic_squad_layouts = {
+    'stats': [('# Pl', None), ('Age', None), ('Poss', None), ('MP', None), ('Starts', None),
+              ('Min', None), ('90s', None)]
+             + [(key, key) for key in ['Gls', 'Ast', 'G+A', 'G-PK', 'PK', 'PKatt', 'CrdY', 'CrdR', 'xG',
+                                       'npxG', 'xAG', 'npxG+xAG', 'PrgC', 'PrgP']] + _per90_headings,
+    'possession': [('# Pl', None), ('Poss', None)] + synthetic_layouts['possession']
+}
+
+# Keepers draw from their own categories: shots and crosses faced, distribution and sweeping
+synthetic_keeper_profiles = pd.DataFrame({'GK': [1.0, 1.0, 1.0, 1.0]},
+                                         index=['faced', 'result', 'distribute', 'sweep'])
+
+# Keeper stats, drawn with the rules of synthetic_rules
+synthetic_keeper_rules = {
+    'SoTA': ('count', 'faced', 4.2), 'Saves': ('binom', 'SoTA', 0.7), 'Save%': ('pct', 'Saves', 'SoTA'),
+    'GAexOG': ('lin', [('SoTA', 1), ('Saves', -1)]), 'OG': ('count', 'faced', 0.03),
+    'GA': ('sum', 'GAexOG', 'OG'), 'GA90': ('per90', 'GA'),
+    'W': ('count', 'result', 0.4), 'D': ('count', 'result', 0.25), 'L': ('count', 'result', 0.35),
+    'CS': ('count', 'result', 0.28), 'CS%': ('pct', 'CS', '90s'),
+    'PKatt': ('count', 'faced', 0.12), 'PKsv': ('binom', 'PKatt', 0.15), 'PKm': ('binom', 'PKatt', 0.07),
+    'PKA': ('lin', [('PKatt', 1), ('PKsv', -1), ('PKm', -1)]), 'PKSave%': ('pct', 'PKsv', 'PKatt'),
+    'FK': ('binom', 'GAexOG', 0.04), 'CK': ('binom', 'GAexOG', 0.15),
+    'PSxG': ('float', 'faced', 1.25), 'PSxG/SoT': ('ratio', 'PSxG', 'SoTA'),
+    'PSxG+/-': ('diff', 'PSxG', 'GAexOG'), 'PSxG+/-/90': ('per90', 'PSxG+/-'),
+    'LaunchAtt': ('count', 'distribute', 7), 'LaunchCmp': ('binom', 'LaunchAtt', 0.4),
+    'LaunchCmp%': ('pct', 'LaunchCmp', 'LaunchAtt'), 'PassAtt': ('count', 'distribute', 30),
+    'Throws': ('count', 'distribute', 5), 'PassLaunch%': ('normal', 35, 10, 5, 90),
+    'PassAvgLen': ('normal', 32, 6, 15, 60), 'GoalKicks': ('count', 'distribute', 6.5),
+    'GoalKickLaunch%': ('normal', 50, 20, 0, 100), 'GoalKickAvgLen': ('normal', 40, 8, 15, 70),
+    'CrossesFaced': ('count', 'sweep', 11), 'CrossesStopped': ('binom', 'CrossesFaced', 0.07),
+    'CrossStop%': ('pct', 'CrossesStopped', 'CrossesFaced'), 'OPA': ('count', 'sweep', 0.9),
+    'OPA/90': ('per90', 'OPA'), 'AvgOPADist': ('normal', 14, 2, 5, 25)
+}
+
+# Columns after the identity columns of each keeper page: (heading, stat key)
+synthetic_keeper_layouts = {
+    'keepers': [(key, key) for key in ['MP', 'Starts', 'Min', '90s', 'GA', 'GA90', 'SoTA', 'Saves', 'Save%',
+                                       'W', 'D', 'L', 'CS', 'CS%', 'PKatt', 'PKA', 'PKsv', 'PKm']]
+               + [('Save%', 'PKSave%')],
+    'keepersadv': [('90s', '90s'), ('GA', 'GA'), ('PKA', 'PKA'), ('FK', 'FK'), ('CK', 'CK'), ('OG', 'OG'),
+                   ('PSxG', 'PSxG'), ('PSxG/SoT', 'PSxG/SoT'), ('PSxG+/-', 'PSxG+/-'), ('/90', 'PSxG+/-/90'),
+                   ('Cmp', 'LaunchCmp'), ('Att', 'LaunchAtt'), ('Cmp%', 'LaunchCmp%'), ('Att (GK)', 'PassAtt'),
+                   ('Thr', 'Throws'), ('Launch%', 'PassLaunch%'), ('AvgLen', 'PassAvgLen'), ('Att', 'GoalKicks'),
+                   ('Launch%', 'GoalKickLaunch%'), ('AvgLen', 'GoalKickAvgLen'), ('Opp', 'CrossesFaced'),
+                   ('Stp', 'CrossesStopped'), ('Stp%', 'CrossStop%'), ('#OPA', 'OPA'), ('#OPA/90', 'OPA/90'),
+                   ('AvgDist', 'AvgOPADist')]
+}
+
+def _synthetic_stats(positions, minutes, rng, rules=synthetic_rules, profiles=synthetic_profiles):
+    # Draws every stat key of `rules` for the given main positions and minutes, then the
+    # appearance columns
+    nineties = minutes / 90
+    position_profiles = profiles[[synthetic_fbref_positions[position][1] for position in positions]].to_numpy()
+    talent = rng.lognormal(0, 0.3, position_profiles.shape)
+    scale = dict(zip(profiles.index, position_profiles * talent))
+    
+    stats = {'90s': np.round(nineties, 1)}
+    pending = dict(rules)
+    while pending:
+        for key, rule in list(pending.items()):
+            kind, args = rule[0], rule[1:]
+            needed = [arg for arg in args if isinstance(arg, str) and arg in rules]
+            needed += [part for part, _ in args[0]] if kind == 'lin' else []
+            if kind in ('count', 'float'):
+                needed = []
+            if any(name not in stats for name in needed):
+                continue
+            if kind == 'count':
+                values = rng.poisson(args[1] * scale[args[0]] * nineties).astype(np.int32)
+            elif kind == 'float':
+                values = np.round(args[1] * scale[args[0]] * nineties * rng.lognormal(0, 0.25, len(minutes)), 1)
+            elif kind == 'binom':
+                values = rng.binomial(stats[args[0]], args[1]).astype(np.int32)
+            elif kind == 'sum':
+                values = sum(stats[arg] for arg in args)
+            elif kind == 'lin':
+                values = np.maximum(sum(stats[part] * coefficient for part, coefficient in args[0]), 0)
+            elif kind == 'diff':
+                values = np.round(stats[args[0]] - stats[args[1]], 1)
+            elif kind == 'pct':
+                values = np.round(100 * np.divide(stats[args[0]], stats[args[1]], out=np.zeros(len(minutes)),
+                                                  where=stats[args[1]] > 0), 1)
+            elif kind == 'ratio':
+                values = np.round(np.divide(stats[args[0]], stats[args[1]], out=np.zeros(len(minutes)),
+                                            where=stats[args[1]] > 0), 2)
+            elif kind == 'per90':
+                values = np.round(np.divide(stats[args[0]], nineties, out=np.zeros(len(minutes)),
+                                            where=nineties > 0), 2)
+            elif kind == 'normal':
+                values = np.round(np.clip(rng.normal(args[0], args[1], len(minutes)), args[2], args[3]), 1)
+            stats[key] = values
+            del pending[key]
+    
+    stats['MP'] = np.maximum(np.ceil(minutes / 80), 1).astype(int)
+    stats['Starts'] = np.minimum(stats['MP'], np.floor(minutes / 85)).astype(int)
+    stats['Min'] = pd.Series(minutes).map('{:,}'.format).to_numpy()
+    return stats
+
+def _synthetic_players(n_players, competition, season, seed):
+    # The competition's squads and player identities. Returns the random generator, which the
+    # outfield stats go on drawing from, the squads and each player's squad, the leagues, the
+    # identity columns, player ids, main positions and minutes
+    rng = np.random.default_rng([seed, *map(ord, competition + season)])
+    leagues = ['eng Premier League', 'es La Liga', 'it Serie A', 'de Bundesliga', 'fr Ligue 1'] if competition == 'Big5' else [competition]
+    n_squads = max(2, n_players // 28)
+    squads = np.array([f"{competition} Club {i + 1}" for i in range(n_squads)])
+    
+    squad_of = rng.integers(0, n_squads, n_players)
+    positions = rng.choice(list(synthetic_positions), n_players, p=np.array(list(synthetic_positions.values())))
+    minutes = np.round(rng.beta(1.3, 1.2, n_players) * 3420).astype(int) + 1
+    ages = rng.integers(17, 37, n_players)
+    start_year = int(season[:4])
+    
+    identity = pd.DataFrame({
+        'Player': [f"Synthetic Player {i + 1:07d}" for i in range(n_players)],
+        'Nation': 'eng ENG',
+        'Pos': [synthetic_fbref_positions[position][0] for position in positions],
+        'Squad': squads[squad_of],
+        'Comp': np.array(leagues)[squad_of % len(leagues)],
+        'Age': pd.Series(ages).astype(str) + '-' + pd.Series(rng.integers(0, 365, n_players)).astype(str).str.zfill(3),
+        'Born': start_year - ages
+    })
+    player_ids = np.array([f"{i:08x}" for i in range(n_players)])
+    return rng, squads, squad_of, leagues, identity, player_ids, positions, minutes
+
+def _synthetic_tables(identity, player_ids, stats, layouts):
+    # One player table per stat page of `layouts`, as scrape_player_tables returns them
+    tables = {}
+    for stat, layout in layouts.items():
+        columns = pd.DataFrame({position: stats[key] for position, (_, key) in enumerate(layout)})
+        columns.columns = [heading for heading, _ in layout]
+        table = pd.concat([identity, columns], axis=1)
+        table['Matches'] = 'Matches'
+        table['PlayerID'] = player_ids
+        table.sort_values(['Player', 'Squad'], ascending=[True, True], inplace=True)
+        tables[stat] = table.reset_index(drop=True)
+    return tables
+
+def generate_synthetic_competition(n_players, competition='Big5', season=current_season, seed=0):
+    """
+    Generates a competition's raw tables for n_players player-seasons
+    
+    Args:
+    n_players (int): Number of player rows
+    competition (str): Key in competitions. The Big-5 is spread over five leagues; other
+    competitions get single-league squad pages, without a 'Comp' column (default: 'Big5')
+    season (str): Season (default: current_season)
+    seed (int): Random seed (default: 0)
+    
+    Returns:
+    (player tables dict as from scrape_player_tables, (squad standard, squad possession,
+    opponent possession) tables as from get_df, position mapping with 'PlayerFBref' and
+    'Main Position')
+    """
+    # Each competition and season gets its own draws; player i is the same player in all of them
+    rng, squads, squad_of, leagues, identity, player_ids, positions, minutes = _synthetic_players(n_players, competition, season, seed)
+    big5 = competition == 'Big5'
+    n_squads = len(squads)
+    
+    stats = _synthetic_stats(positions, minutes, rng)
+    tables = _synthetic_tables(identity, player_ids, stats, synthetic_layouts)
+    
+    # Squad pages: every squad played 38 full matches; possession is drawn per squad and the
+    # opposition's touches follow from it
+    squad_sizes = np.bincount(squad_of, minlength=n_squads)
+    totals = lambda key: np.bincount(squad_of, weights=stats[key], minlength=n_squads)
+    possession = np.round(rng.uniform(35, 65, n_squads), 1)
+    squad_values = {'# Pl': squad_sizes, 'Age': np.round(rng.uniform(24, 29, n_squads), 1),
+                    'Poss': possession, 'MP': 38, 'Starts': 418, 'Min': '3,420', '90s': 38.0}
+    
+    squad_tables = []
+    for page in ['stats', 'possession', 'possession']:
+        table = pd.DataFrame({'Squad': squads})
+        if big5:
+            table['Comp'] = np.array(leagues)[np.arange(n_squads) % len(leagues)]
+        for heading, key in synthetic_squad_layouts[page]:
+            if key is None:
+                values = squad_values[heading]
+            elif key == '90s':
+                values = 38.0
+            elif key.endswith('/90'):
+                values = np.round(totals(key[:-3]) / 38, 2)
+            elif synthetic_rules[key][0] in ('pct', 'ratio', 'normal'):
+                values = np.round(totals(key) / np.maximum(squad_sizes, 1), 1)
+            else:
+                values = totals(key).astype(int)
+            table.insert(len(table.columns), heading, values, allow_duplicates=True)
+        squad_tables.append(table)
+    
+    # The opposition table: the same squads' opponents, whose touches follow from possession
+    opponents = squad_tables[2]
+    opponents['Squad'] = 'vs ' + opponents['Squad']
+    opponents['Poss'] = np.round(100 - possession, 1)
+    opponents['Touches'] = np.round(totals('Touches') * (100 - possession) / possession).astype(int)
+    
+    tm_pos = pd.DataFrame({'PlayerFBref': identity['Player'], 'UrlFBref': '', 'UrlTmarkt': '',
+                           'Main Position': positions})
+    return tables, tuple(squad_tables), tm_pos
+
+# Example usage: 100k player-seasons, then through the same stages as a scrape
+# tables, squad_tables, tm_pos = generate_synthetic_competition(100_000)
+# raw = merge_player_tables(tables)
+
+def generate_synthetic_keepers(n_players, competition='Big5', season=current_season, seed=0):
+    """
+    Generates the keepers and keepersadv tables of the goalkeepers among
+    generate_synthetic_competition's players, with the same names, ids, squads and minutes
+    
+    Args:
+    n_players (int): Number of player rows, as given to generate_synthetic_competition
+    competition (str): Key in competitions (default: 'Big5')
+    season (str): Season (default: current_season)
+    seed (int): Random seed (default: 0)
+    
+    Returns:
+    dict of keeper stat page -> DataFrame, as from scrape_player_tables with keeper_stat_pages
+    """
+    _, _, _, _, identity, player_ids, positions, minutes = _synthetic_players(n_players, competition, season, seed)
+    keepers = positions == 'Goalkeeper'
+    rng = np.random.default_rng([seed, *map(ord, 'keepers ' + competition + season)])
+    stats = _synthetic_stats(positions[keepers], minutes[keepers], rng, synthetic_keeper_rules, synthetic_keeper_profiles)
+    return _synthetic_tables(identity[keepers].reset_index(drop=True), player_ids[keepers], stats, synthetic_keeper_layouts)
+
+# Example usage:
+# merge_keeper_tables(generate_synthetic_keepers(100_000))
+
+
+@profiled('Fingerprint rows')
+def fingerprint_rows(tables, teams):
+    """
+    Hashes every player row of every stat table together with the player's team row, so a
+    player's fingerprint changes whenever anything their final row is built from changes
+    
+    Args:
+    tables (dict): Player stat tables from scrape_player_tables, row-aligned by player and squad
+    teams (DataFrame): Team table from scrape_team_table
+    
+    Returns:
+    int64 array with one fingerprint per player row
+    """
+    hashes = pd.DataFrame({stat: pd.util.hash_pandas_object(table, index=False).values
+                           for stat, table in tables.items()})
+    team_hashes = pd.Series(pd.util.hash_pandas_object(teams, index=False).values, index=teams['Squad'])
+    team_hashes = team_hashes[~team_hashes.index.duplicated()]
+    hashes['Team'] = tables['stats']['Squad'].map(team_hashes).fillna(0).astype('uint64').values
+    return pd.util.hash_pandas_object(hashes, index=False).values.view('int64')
+
+def _previous_final(final_name):
+    # Last run's final table, if it was written with fingerprints
+    path = "%s%s.csv" %(root, final_name)
+    if not os.path.exists(path):
+        return None
+    previous = pd.read_csv(path, encoding='utf-8-sig', dtype={'PlayerID': str})
+    return previous if 'Fingerprint' in previous.columns else None
+
+def build_competition_season(competition, season, incremental=incremental_refresh):
+    """
+    Runs the whole outfield build for one competition and season and saves each stage. With
+    incremental refresh, only rows whose fingerprint is not in the previous final table go
+    through the per-90 and team stages; the rest are reused from that table.
+    
+    Returns:
+    Final player table with 'Competition', 'Season' and 'Fingerprint' columns
+    """
+    raw_name = dataset_name('Raw', competition, season)
+    final_name = dataset_name('Final', competition, season)
+
+    if synthetic_players:
+        tables, squad_tables, tm_pos = generate_synthetic_competition(synthetic_players, competition, season)
+        teams = build_team_table(*squad_tables, competition)
+    else:
+        tables = scrape_player_tables(competition, season)
+        teams = scrape_team_table(competition, season)
+        tm_pos = None
+
+    # Save the file to the root location
+    df = merge_player_tables(tables)
+    df['Fingerprint'] = fingerprint_rows(tables, teams)[df.index]
+    with profile_stage('Write CSV', file=raw_name):
+        df.to_csv("%s%s.csv" %(root, raw_name), index=False)
+    memory_report(df, f'Raw merge {competition} {season}')
+
+    previous = _previous_final(final_name) if incremental else None
+    stage_name = final_name
+    if previous is not None:
+        reused = previous[previous['Fingerprint'].isin(df['Fingerprint'])]
+        df = df[~df['Fingerprint'].isin(previous['Fingerprint'])]
+        print(f"{competition} {season}: {len(df)} new or changed rows, {len(reused)} reused")
+        if df.empty:
+            reused.to_csv("%s%s.csv" %(root, final_name), index=False, encoding='utf-8-sig')
+            return reused
+        
+        # Only the changed rows are taken through the stages below
+        stage_name = f"{final_name} DELTA"
+        df.to_csv("%s%s.csv" %(root, stage_name), index=False)
+
+    df = add_per90("%s%s.csv" %(root, raw_name if previous is None else stage_name))
+    df.to_csv("%s%s.csv" %(root, stage_name), index=False)
+    memory_report(df, f'Per 90 {competition} {season}')
+
+    teams.to_csv("%s%s TEAMS.csv" %(root, final_name), index=False)
+
+    df = pd.read_csv("%s%s.csv" %(root, stage_name), dtype={'PlayerID': str})
+    teams = pd.read_csv("%s%s TEAMS.csv" %(root, final_name))
+    df = enrich_with_team_data(df, teams, tm_pos)
+    df['Competition'] = competition
+    df['Season'] = season
+
+    if previous is not None:
+        os.remove("%s%s.csv" %(root, stage_name))
+        df = pd.concat([reused, df], ignore_index=True)
+        df = df.sort_values(['Player', 'Squad']).reset_index(drop=True)
+    with profile_stage('Write CSV', file=final_name):
+        df.to_csv("%s%s.csv" %(root, final_name), index=False, encoding='utf-8-sig')
+    memory_report(df, f'Team enrichment {competition} {season}')
+    return df
+
+# Final tables of every job land here, partitioned by competition and season
+final_store = f"{root}Final FBRef Store"
+
+def _build_job(competition, season):
+    # Builds one job and hands back the stage timings it recorded
+    start = len(stage_profiles)
+    with profile_stage('Build', competition=competition, season=season) as record:
+        df = build_competition_season(competition, season)
+        record['Rows'] = len(df)
+    profiles = stage_profiles[start:]
+    del stage_profiles[start:]
+    return df, profiles
+
+def build_all(jobs, max_workers=max_workers, path=final_store):
+    """
+    Builds every (competition, season) job, and with keeper_pipeline its keepers, in a process
+    pool when there is more than one build, and writes the outfield final tables to a partitioned
+    Parquet store
+    
+    Args:
+    jobs (list): (competition, season) pairs
+    max_workers (int): Process pool size, shared by the outfield and keeper builds. Every build
+    still sleeps between its own requests, so keep this small to stay within FBref's rate limits
+    (default: max_workers)
+    path (str): Store directory (default: final_store)
+    
+    Returns:
+    (all outfield final tables concatenated, keeper table from join_keepers)
+    """
+    builds = [(_build_job, competition, season) for competition, season in jobs]
+    if keeper_pipeline:
+        builds += [(_build_keeper_job, competition, season) for competition, season in jobs]
+    if len(builds) == 1 or max_workers == 1:
+        results = [build(competition, season) for build, competition, season in builds]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            futures = [pool.submit(build, competition, season) for build, competition, season in builds]
+            results = [future.result() for future in futures]
+
+    # Stage timings recorded in the worker processes are collected here
+    for _, profiles in results:
+        stage_profiles.extend(profiles)
+    df = pd.concat([result for result, _ in results[:len(jobs)]], ignore_index=True)
+    with profile_stage('Write final store') as record:
+        df.to_parquet(path, engine='pyarrow', index=False, partition_cols=['Competition', 'Season'],
+                      existing_data_behavior='delete_matching')
+        record['Rows'] = len(df)
+    return df, join_keepers(df, [result for result, _ in results[len(jobs):]])
+
+##################################################################################
+################################# Goalkeepers ####################################
+##################################################################################
+
+# The outfield tables say little about goalkeeping, so keepers are built from FBref's keepers and
+# keepersadv pages instead, through the same fetch, checkpoint and parsing code. Each job's keeper
+# build goes to build_all's process pool next to the outfield builds, so max_workers still bounds
+# how many builds fetch from FBref at once. Its rows join the combined table as the 'GK' group.
+
+# Counting stats of the merged keeper table that get a per-90 copy
+keeper_counting_columns = [
+    'GA', 'SoTA', 'Saves', 'CS', 'PKatt', 'PKA', 'PKsv', 'FKGA', 'CKGA', 'OGA', 'PSxG', 'PSxG+/-',
+    'LaunchCmp', 'LaunchAtt', 'PassAtt', 'Throws', 'GoalKicks', 'CrossesFaced', 'CrossesStopped', 'OPA'
+]
+
+# Keeper ratio metrics, as for derived_metrics: (column, numerator, denominator, scale)
+keeper_derived_metrics = [
+    # Goals prevented per 100 shots on target faced
+    ('PSxG+/-PerSoTA', 'PSxG+/-', 'SoTA', 100),
+    # Share of passes thrown
+    ('Throw%', 'Throws', 'PassAtt', 100),
+]
+
+# Column blocks taken from each keeper table, in table order: (FBref headers, new names or None to
+# keep them). FBref repeats some headers (Save%, Att, Launch%, AvgLen), so a block is a run of
+# consecutive headers, looked for after the previous block
+keeper_table_blocks = {
+    'keepers': [
+        (['Player', 'Nation', 'Pos', 'Squad'], None),
+        (['Age', 'Born', 'MP', 'Starts', 'Min', '90s', 'GA'], None),
+        (['SoTA', 'Saves', 'Save%'], None),
+        (['CS', 'CS%'], None),
+        # The penalty block has its own Save% column
+        (['PKatt', 'PKA', 'PKsv', 'PKm', 'Save%'], ['PKatt', 'PKA', 'PKsv', 'PKMissed', 'PKSave%'])
+    ],
+    'keepersadv': [
+        (['Player'], None),
+        (['Squad'], None),
+        (['FK', 'CK', 'OG', 'PSxG', 'PSxG/SoT', 'PSxG+/-'], ['FKGA', 'CKGA', 'OGA', 'PSxG', 'PSxG/SoT', 'PSxG+/-']),
+        (['Cmp', 'Att', 'Cmp%'], ['LaunchCmp', 'LaunchAtt', 'LaunchCmp%']),
+        (['Att (GK)', 'Thr', 'Launch%', 'AvgLen'], ['PassAtt', 'Throws', 'PassLaunch%', 'PassAvgLen']),
+        (['Att', 'Launch%', 'AvgLen'], ['GoalKicks', 'GoalKickLaunch%', 'GoalKickAvgLen']),
+        (['Opp', 'Stp', 'Stp%'], ['CrossesFaced', 'CrossesStopped', 'CrossStop%']),
+        (['#OPA'], ['OPA']),
+        (['AvgDist'], ['AvgOPADist'])
+    ]
+}
+
+def _keeper_columns(table, table_name, blocks=None):
+    """
+    Picks a raw keeper table's column blocks by header, renamed
+    
+    Args:
+    table (DataFrame): Raw keepers or keepersadv table
+    table_name (str): 'keepers' or 'keepersadv'
+    blocks (list): (headers, new names) pairs (default: keeper_table_blocks[table_name])
+    
+    Returns:
+    DataFrame of the blocks' columns
+    
+    Raises:
+    ValueError: if a block's headers aren't found in order, i.e. FBref changed the table's layout
+    """
+    headers = list(table.columns)
+    positions, names, start = [], [], 0
+    for block, renamed in blocks or keeper_table_blocks[table_name]:
+        for i in range(start, len(headers) - len(block) + 1):
+            if headers[i:i + len(block)] == block:
+                break
+        else:
+            raise ValueError(f"No {block} columns in the {table_name} table after column {start}; "
+                             f"its layout has changed: {headers}")
+        positions += range(i, i + len(block))
+        names += renamed or block
+        start = i + len(block)
+    return table.iloc[:, positions].set_axis(names, axis=1)
+
+@profiled('Merge keeper tables')
+def merge_keeper_tables(tables):
+    """
+    Merges the raw keepers and keepersadv tables into one, renaming columns along the way
+    """
+    df_keepers = tables['keepers']
+    df_adv = tables['keepersadv']
+
+    # Player to 90s, then goals against, shots on target against, saves, clean sheets and penalties
+    df = _keeper_columns(df_keepers, 'keepers')
+    # scrape_player_tables gives every table a 'Comp' column
+    df.insert(df.columns.get_loc('Squad') + 1, 'Comp', df_keepers['Comp'])
+    if 'PlayerID' in df_keepers.columns:
+        df['PlayerID'] = df_keepers['PlayerID']
+
+    # The advanced table has the same players
+    adv = _keeper_columns(df_adv, 'keepersadv')
+    df = df.merge(adv, on=['Player', 'Squad'], how='left')
+
+    # Make sure to drop all blank rows (FBRef's tables have several)
+    df = df.dropna(subset = ["Player"])
+
+    # Minutes from '1,500' to '1500', then everything from Born on to numbers, as the outfield
+    # table's CSV round trip does
+    df['Min'] = df['Min'].astype(str).str.replace(',', '')
+    numeric = df.columns[df.columns.get_loc('Born'):].drop('PlayerID', errors='ignore')
+    df[numeric] = df[numeric].apply(pd.to_numeric, errors='coerce')
+    return df.reset_index(drop=True)
+
+@profiled('Keeper per 90')
+def add_keeper_per90(df):
+    """
+    Adds a per-90 copy of every keeper counting stat, then the keeper ratio metrics
+    """
+    nineties = df['Min'].to_numpy(dtype=float)[:, None] / 90
+    counts = df[keeper_counting_columns].to_numpy(dtype=float)
+    per90 = np.divide(counts, nineties, out=np.zeros(counts.shape), where=nineties > 0)
+    df = pd.concat([df, pd.DataFrame(per90, index=df.index, columns=[f'{col}Per90' for col in keeper_counting_columns])], axis=1)
+    df['Age'] = df['Age'].astype(str).str[:2].astype(int)
+    return add_derived_metrics(df, keeper_derived_metrics, bases={})
+
+def build_keeper_competition_season(competition, season):
+    """
+    Runs the keeper build for one competition and season and saves the raw and final tables
+    
+    Returns:
+    Final keeper table with 'Main Position', 'Competition', 'Season' and 'Fingerprint' columns
+    """
+    raw_name = dataset_name('Raw Keepers', competition, season)
+    final_name = dataset_name('Final Keepers', competition, season)
+
+    if synthetic_players:
+        tables = generate_synthetic_keepers(synthetic_players, competition, season)
+    else:
+        tables = scrape_player_tables(competition, season, keeper_stat_pages, 'Keeper Scrape')
+    df = merge_keeper_tables(tables)
+    df['Fingerprint'] = pd.util.hash_pandas_object(df, index=False).values.view('int64')
+    with profile_stage('Write CSV', file=raw_name):
+        df.to_csv("%s%s.csv" %(root, raw_name), index=False)
+
+    df = add_keeper_per90(df)
+    df['Main Position'] = 'Goalkeeper'
+    df['Competition'] = competition
+    df['Season'] = season
+    with profile_stage('Write CSV', file=final_name):
+        df.to_csv("%s%s.csv" %(root, final_name), index=False, encoding='utf-8-sig')
+    return df
+
+def _build_keeper_job(competition, season):
+    # As _build_job, for the job's keepers. A failure is handed back instead of raised, so it can't
+    # stop the outfield builds sharing the pool
+    start = len(stage_profiles)
+    try:
+        with profile_stage('Build keepers', competition=competition, season=season) as record:
+            df = build_keeper_competition_season(competition, season)
+            record['Rows'] = len(df)
+    except Exception as e:
+        df = e
+    profiles = stage_profiles[start:]
+    del stage_profiles[start:]
+    return df, profiles
+
+def join_keepers(df, keepers):
+    """
+    Concatenates the keeper builds and adds each keeper's team minutes from the outfield table. A
+    failed keeper build leaves the dashboard without goalkeepers rather than stopping the run.
+    
+    Args:
+    df (DataFrame): Outfield final table
+    keepers (list): Each job's keeper table, or the exception its build raised
+    
+    Returns:
+    Keeper table, or None when there are no keeper builds or one failed
+    """
+    failed = [result for result in keepers if isinstance(result, Exception)]
+    if failed:
+        print(f"Keeper build failed: {failed[0]}; continuing without goalkeepers")
+        return None
+    if not keepers:
+        return None
+    team_minutes = df[['Competition', 'Season', 'Squad', 'TeamMins']].drop_duplicates(['Competition', 'Season', 'Squad'])
+    return pd.concat(keepers, ignore_index=True).merge(team_minutes, on=['Competition', 'Season', 'Squad'], how='left')
+
+# Example usage:
+# df, df_keepers = build_all(jobs)
+
+if pipeline_run:
+    df, df_keepers = build_all(jobs)
+
+    df.head()
+
+    # Method 1: Convert to string first
+    unique_values = df['Main Position'].astype(str).unique()
+    print("Method 1:", unique_values)
+
+# Create datasets for each position
+
+# Position group of each Transfermarkt main position, in the order the groups are built
+position_groups = {
+    'Left-Back': 'FB', 'Right-Back': 'FB',
+    'Centre-Back': 'CB',
+    'Defensive Midfield': 'DM',
+    'Central Midfield': 'CM',
+    'Attacking Midfield': 'AM', 'Second Striker': 'AM',
+    'Left Winger': 'W', 'Left Midfield': 'W', 'Right Winger': 'W', 'Right Midfield': 'W',
+    'Centre-Forward': 'ST'
+}
+position_group_order = ['FB', 'CB', 'DM', 'CM', 'AM', 'W', 'ST']
+
+# Minimum share of the team's minutes to be in a cohort
+cohort_min_share = 0.20
+
+# A row repeated by the position merge has the same fingerprint and main position
+cohort_key_columns = ['Competition', 'Season', 'Fingerprint', 'Main Position']
+
+def position_group_codes(positions, groups=position_groups):
+    """
+    Maps main positions to position groups, looking each distinct position up once
+    
+    Args:
+    positions (Series): Transfermarkt main positions
+    groups (dict): Main position -> position group (default: position_groups)
+    
+    Returns:
+    Array of position groups, 'Other' for positions without one
+    """
+    codes, uniques = pd.factorize(positions)
+    lookup = np.array([groups.get(position, 'Other') for position in uniques] + ['Other'], dtype=object)
+    # Missing positions have code -1, the trailing 'Other'
+    return lookup[codes]
+
+@profiled('Position cohorts')
+def build_position_cohorts(df, min_share=cohort_min_share, key_columns=cohort_key_columns,
+                           groups=position_groups, order=position_group_order):
+    """
+    Splits the final table into the position group cohorts in one pass
+    
+    Args:
+    df (DataFrame): Final player table with 'Min', 'TeamMins' and 'Main Position'
+    min_share (float): Minimum share of the team's minutes (default: cohort_min_share)
+    key_columns (list): Columns a repeated row is identified by (default: cohort_key_columns)
+    groups (dict): Main position -> position group (default: position_groups)
+    order (list): Position groups to build, in order (default: position_group_order)
+    
+    Returns:
+    dict of position group -> DataFrame, in order. Each cohort is a slice of one
+    frame sorted by group, with a 'Position Group' column
+    """
+    share = df['Min'].to_numpy(dtype=float) / df['TeamMins'].to_numpy(dtype=float)
+    codes = position_group_codes(df['Main Position'], groups)
+    keep = (share >= min_share) & (codes != 'Other')
+    cohorts = df[keep].assign(**{'Position Group': codes[keep]})
+    cohorts = cohorts.drop_duplicates(subset=[column for column in key_columns if column in cohorts.columns])
+    # One row per player, group, competition and season, the one with the most minutes. Dropped
+    # before ranking, so the stored percentiles rank the same rows that are stored and served
+    cohorts = cohorts.sort_values('Min', ascending=False, kind='stable').drop_duplicates(
+        subset=[column for column in ['Player', 'Position Group', 'Competition', 'Season'] if column in cohorts.columns])
+    ranks = pd.Categorical(cohorts['Position Group'], categories=order).codes
+    cohorts = cohorts.iloc[np.argsort(ranks, kind='stable')]
+    bounds = np.searchsorted(np.sort(ranks), np.arange(len(order) + 1))
+    return {group: cohorts.iloc[bounds[i]:bounds[i + 1]] for i, group in enumerate(order)}
+
+# Example usage:
+# cohorts = build_position_cohorts(df)
+# df_players_fb = cohorts['FB']
+
+if pipeline_run:
+    position_cohorts = build_position_cohorts(df)
+
+# Goalkeepers come from the keeper build, as their own 'GK' cohort after the outfield groups
+keeper_position_groups = {'Goalkeeper': 'GK'}
+keeper_group_order = ['GK']
+
+if pipeline_run and df_keepers is not None:
+    position_cohorts.update(build_position_cohorts(df_keepers, groups=keeper_position_groups, order=keeper_group_order))
+
+##################################################################################
+##################### Metrics the charts and similarity read #####################
+##################################################################################
+
+# The pizza, bar and similarity views only read composites and percentile columns, so their
+# configurations decide what gets ranked. A composite is the mean of its percentile columns and a
+# percentile column 'X_PR' is the raw column 'X' ranked. metric_dependencies walks the three
+# configurations down to those raw columns: only they are ranked, and a reference that can't be
+# built stops the run here, before any ranking is done.
+
+# Composites and percentiles in each position group's pizza (same as radar chart)
+metrics_by_position = {
+    'FB': [
+        'Defensive Awareness', 'Box Defending', '1v1 Defending',
+        'Pass Progression', 'Pass Retention', 'Ball Carrying',
+        'Volume of Take-ons', 'Chance Creation', 'Impact in and around box'
+    ],
+    'CB': [
+        'Aerial Ability', 'Box Defending', '1v1 Defending',
+        'Defensive Awareness', 'Pass Retention', 'Pass Progression',
+        'Ball Carrying', 'Impact in and around box', 'TouchCentrality_PR'
+    ],
+    'DM': [
+        'Defensive Awareness', '1v1 Defending', 'Pass Retention',
+        'Pass Progression', 'Ball Carrying', 'TouchCentrality_PR',
+        'Impact in and around box', 'Chance Creation', 'Shot Volume'
+    ],
+    'CM': [
+        'Pass Retention', 'Pass Progression', 'Ball Carrying',
+        'TouchCentrality_PR', 'Chance Creation', 'Impact in and around box',
+        'Shot Volume', 'Shot Quality', 'Defensive Awareness'
+    ],
+    'AM': [
+        'Pass Progression', 'Ball Carrying', 'Volume of Take-ons',
+        'Retention from Take-ons', 'Chance Creation', 'Impact in and around box',
+        'Shot Volume', 'Shot Quality', 'Self-created Shots'
+    ],
+    'W': [
+        'Volume of Take-ons', 'Retention from Take-ons', 'Ball Carrying',
+        'Pass Progression', 'Chance Creation', 'Impact in and around box',
+        'Shot Volume', 'Shot Quality', 'Self-created Shots'
+    ],
+    'ST': [
+        'Shot Volume', 'Shot Quality', 'Self-created Shots',
+        'Impact in and around box', 'Aerial Ability', 'Ball Carrying',
+        'Volume of Take-ons', 'Chance Creation', 'Pass Retention'
+    ],
+    'GK': [
+        'Shot Stopping', 'Penalty Saving', 'Cross Claiming',
+        'Sweeping', 'Distribution Range', 'Launch Accuracy',
+        'Distribution Volume', 'Clean Sheets', 'SavesPer90_PR'
+    ]
+}
+
+# Composites and percentiles the similar players search compares, per position group
+similarity_metrics_by_position = {
+    'FB': [
+        'Aerial Ability', 'Defensive Awareness', '1v1 Defending', 
+        'Pass Progression', 'Pass Retention', 'Ball Carrying',
+        'Volume of Take-ons', 'Chance Creation', 'Impact in and around box'
+    ],
+    'CB': [
+        'Aerial Ability', 'Box Defending', 'Defensive Awareness', '1v1 Defending',
+        'Pass Progression', 'Pass Retention',
+        'Ball Carrying', 'Shot Volume'
+    ],
+    'DM': [
+        'Aerial Ability', 'Defensive Awareness', '1v1 Defending',
+        'Pass Progression', 'Pass Retention', 'Volume of Take-ons',
+        'Retention from Take-ons', 'Shot Volume'
+    ],
+    'CM': [
+        'Defensive Awareness', 'Pass Progression', 'Pass Retention',
+        'Ball Carrying', 'Volume of Take-ons', 'Retention from Take-ons',
+        'Chance Creation', 'Impact in and around box', 'Shot Volume'
+    ],
+    'AM': [
+        'Pass Progression', 'Pass Retention',
+        'Volume of Take-ons', 'Retention from Take-ons', 'Chance Creation', 'Impact in and around box',
+        'Shot Volume', 'Shot Quality', 'Self-created Shots'
+    ],
+    'W': [
+        'Pass Retention',
+        'Ball Carrying', 'Volume of Take-ons', 'Retention from Take-ons',
+        'Chance Creation', 'Impact in and around box',
+        'Shot Volume', 'Shot Quality', 'Self-created Shots'
+    ],
+    'ST': [
+        'Aerial Ability', 'Pass Retention', 'Ball Carrying', 'Volume of Take-ons',
+        'Chance Creation', 'Impact in and around box',
+        'Shot Volume', 'Shot Quality', 'Self-created Shots'
+    ],
+    'GK': [
+        'Shot Stopping', 'Cross Claiming', 'Sweeping',
+        'Distribution Range', 'Launch Accuracy', 'Distribution Volume'
+    ]
+}
+
+# Percentiles in each of a position group's bar charts
+chart_metrics_by_position = {
+    'FB': {
+        'Pass Types': [
+            'ShortPass%_PR',
+            'MediumPass%_PR',
+            'LongPass%_PR',
+            'ProgPass%_PR',
+            'Switch%_PR',
+            'KeyPass%_PR',
+            'Final3rdPass%_PR',
+            'ThroughPass%_PR'
+        ],
+        'Touch Areas': [
+            'TouchesPer90_PR',
+            'TouchCentrality_PR',
+            'Def3rdTouch%_PR',
+            'Mid3rdTouch%_PR',
+            'Att3rdTouch%_PR',
+            'AttPenTouch%_PR'
+        ],
+        'Tackle Areas': [
+            'Def3rdTkl%_PR',
+            'Mid3rdTkl%_PR',
+            'Att3rdTkl%_PR'
+        ],
+        'Defensive Play': [
+            'TklPer90_PR',
+            'DrbTkl%_PR',
+            'FlsPer90_PR',
+            'PassBlocksPer90_PR',
+            'IntPer90_PR',
+            'RecovPer90_PR',
+            'pAdjClrPer90_PR',
+            'pAdjShBlocksPer90_PR',
+            'AerialWinsPer90_PR',
+            'AerialWin%_PR'
+        ],
+        'Ball Progression and Retention': [
+            'PassesCompletedPer90_PR',
+            'TotCmp%_PR',
+            'Final1/3CmpPer90_PR',
+            'ProgPassesPer90_PR',
+            'SwitchesPer90_PR',
+            'ReceivedPassPer90_PR',
+            'ProgPassesRecPer90_PR'
+        ],
+        'Ball Carrying and Dribbling': [
+            'AttDrbPer90_PR',
+            'DrbSucc%_PR',
+            'CarriesPer90_PR',
+            'CarriesToFinalThirdPer90_PR',
+            'CarriesToPenAreaPer90_PR',
+            'ProgCarriesPer50Touches_PR',
+            'ProgDistancePerCarry_PR',
+            'FldPer90_PR'
+        ],
+        'Creativity and Attacking Play': [
+            'AssistsPer90_PR',
+            'xAPer90_PR',
+            'KeyPassesPer90_PR',
+            'PenAreaCmpPer90_PR',
+            'ThruBallsPer90_PR',
+            'CrsPer90_PR'
+        ],
+        'Goal Threat': [
+            'GoalsPer90_PR',
+            'ShotsPer90_PR',
+            'npxGPer90_PR',
+            'SCAPer90_PR'
+        ]
+    },
+    'CB': {
+        'Pass Types': [
+            'ShortPass%_PR',
+            'MediumPass%_PR',
+            'LongPass%_PR',
+            'ProgPass%_PR',
+            'Switch%_PR',
+            'Final3rdPass%_PR'
+        ],
+        'Tackle Areas': [
+            'Def3rdTkl%_PR',
+            'Mid3rdTkl%_PR',
+            'Att3rdTkl%_PR'
+        ],
+        'Defensive Play': [
+            'TklPer90_PR',
+            'DrbTkl%_PR',
+            'FlsPer90_PR',
+            'PKconPer90_PR',
+            'OGPer90_PR',
+            'PassBlocksPer90_PR',
+            'IntPer90_PR',
+            'RecovPer90_PR',
+            'pAdjClrPer90_PR',
+            'pAdjShBlocksPer90_PR',
+            'AerialWinsPer90_PR',
+            'AerialWin%_PR'
+        ],
+        'Ball Progression and Retention': [
+            'PassesCompletedPer90_PR',
+            'TotCmp%_PR',
+            'Final1/3CmpPer90_PR',
+            'ProgPassesPer90_PR',
+            'SwitchesPer90_PR'
+        ],
+        'Ball Carrying and Dribbling': [
+            'CarriesPer90_PR',
+            'CarriesToFinalThirdPer90_PR',
+            'ProgCarriesPer50Touches_PR',
+            'ProgDistancePerCarry_PR'
+        ],
+        'Goal Threat': [
+            'GoalsPer90_PR',
+            'ShotsPer90_PR',
+            'npxGPer90_PR'
+        ]
+    },
+    'DM': {
+        'Pass Types': [
+            'ShortPass%_PR',
+            'MediumPass%_PR',
+            'LongPass%_PR',
+            'ProgPass%_PR',
+            'Switch%_PR',
+            'KeyPass%_PR',
+            'Final3rdPass%_PR',
+            'ThroughPass%_PR'
+        ],
+        'Touch Areas': [
+            'TouchesPer90_PR',
+            'TouchCentrality_PR',
+            'Def3rdTouch%_PR',
+            'Mid3rdTouch%_PR',
+            'Att3rdTouch%_PR'
+        ],
+        'Tackle Areas': [
+            'Def3rdTkl%_PR',
+            'Mid3rdTkl%_PR',
+            'Att3rdTkl%_PR'
+        ],
+        'Defensive Play': [
+            'TklPer90_PR',
+            'DrbTkl%_PR',
+            'FlsPer90_PR',
+            'PassBlocksPer90_PR',
+            'IntPer90_PR',
+            'RecovPer90_PR',
+            'pAdjClrPer90_PR',
+            'pAdjShBlocksPer90_PR',
+            'AerialWinsPer90_PR',
+            'AerialWin%_PR'
+        ],
+        'Ball Progression and Retention': [
+            'PassesCompletedPer90_PR',
+            'TotCmp%_PR',
+            'Final1/3CmpPer90_PR',
+            'ProgPassesPer90_PR',
+            'SwitchesPer90_PR',
+            'ReceivedPassPer90_PR',
+            'ProgPassesRecPer90_PR'
+        ],
+        'Ball Carrying and Dribbling': [
+            'AttDrbPer90_PR',
+            'DrbSucc%_PR',
+            'CarriesPer90_PR',
+            'CarriesToFinalThirdPer90_PR',
+            'ProgCarriesPer50Touches_PR',
+            'ProgDistancePerCarry_PR',
+            'FldPer90_PR'
+        ],
+        'Creativity and Attacking Play': [
+            'AssistsPer90_PR',
+            'xAPer90_PR',
+            'KeyPassesPer90_PR',
+            'ThruBallsPer90_PR'
+        ],
+        'Goal Threat': [
+            'GoalsPer90_PR',
+            'ShotsPer90_PR',
+            'npxGPer90_PR'
+        ]
+    },
+    'CM': {
+        'Pass Types': [
+            'ShortPass%_PR',
+            'MediumPass%_PR',
+            'LongPass%_PR',
+            'ProgPass%_PR',
+            'Switch%_PR',
+            'KeyPass%_PR',
+            'Final3rdPass%_PR',
+            'ThroughPass%_PR'
+        ],
+        'Touch Areas': [
+            'TouchesPer90_PR',
+            'TouchCentrality_PR',
+            'Def3rdTouch%_PR',
+            'Mid3rdTouch%_PR',
+            'Att3rdTouch%_PR',
+            'AttPenTouch%_PR'
+        ],
+        'Tackle Areas': [
+            'Def3rdTkl%_PR',
+            'Mid3rdTkl%_PR',
+            'Att3rdTkl%_PR'
+        ],
+        'Defensive Play': [
+            'TklPer90_PR',
+            'DrbTkl%_PR',
+            'FlsPer90_PR',
+            'PassBlocksPer90_PR',
+            'IntPer90_PR',
+            'RecovPer90_PR',
+            'AerialWinsPer90_PR',
+            'AerialWin%_PR'
+        ],
+        'Ball Progression and Retention': [
+            'PassesCompletedPer90_PR',
+            'TotCmp%_PR',
+            'Final1/3CmpPer90_PR',
+            'ProgPassesPer90_PR',
+            'SwitchesPer90_PR',
+            'ReceivedPassPer90_PR',
+            'ProgPassesRecPer90_PR'
+        ],
+        'Ball Carrying and Dribbling': [
+            'AttDrbPer90_PR',
+            'DrbSucc%_PR',
+            'CarriesPer90_PR',
+            'CarriesToFinalThirdPer90_PR',
+            'CarriesToPenAreaPer90_PR',
+            'ProgCarriesPer50Touches_PR',
+            'ProgDistancePerCarry_PR',
+            'FldPer90_PR'
+        ],
+        'Creativity and Attacking Play': [
+            'AssistsPer90_PR',
+            'xAPer90_PR',
+            'KeyPassesPer90_PR',
+            'PenAreaCmpPer90_PR',
+            'CrsPenAreaCmpPer90_PR',
+            'ThruBallsPer90_PR',
+            'CrsPer90_PR'
+        ],
+        'Goal Threat': [
+            'GoalsPer90_PR',
+            'ShotsPer90_PR',
+            'npxGPer90_PR',
+            'npxG/Sh_PR',
+            'SCAPer90_PR',
+            'SCADribPer90_PR'
+        ]
+    },
+    'AM': {
+        'Pass Types': [
+            'ShortPass%_PR',
+            'MediumPass%_PR',
+            'LongPass%_PR',
+            'ProgPass%_PR',
+            'Switch%_PR',
+            'KeyPass%_PR',
+            'Final3rdPass%_PR',
+            'ThroughPass%_PR'
+        ],
+        'Touch Areas': [
+            'TouchesPer90_PR',
+            'TouchCentrality_PR',
+            'Def3rdTouch%_PR',
+            'Mid3rdTouch%_PR',
+            'Att3rdTouch%_PR',
+            'AttPenTouch%_PR'
+        ],
+        'Tackle Areas': [
+            'Def3rdTkl%_PR',
+            'Mid3rdTkl%_PR',
+            'Att3rdTkl%_PR'
+        ],
+        'Defensive Play': [
+            'TklPer90_PR',
+            'FlsPer90_PR',
+            'PassBlocksPer90_PR',
+            'IntPer90_PR',
+            'AerialWinsPer90_PR',
+            'AerialWin%_PR'
+        ],
+        'Ball Progression and Retention': [
+            'PassesCompletedPer90_PR',
+            'TotCmp%_PR',
+            'Final1/3CmpPer90_PR',
+            'ProgPassesPer90_PR',
+            'SwitchesPer90_PR',
+            'ReceivedPassPer90_PR',
+            'ProgPassesRecPer90_PR'
+        ],
+        'Ball Carrying and Dribbling': [
+            'AttDrbPer90_PR',
+            'DrbSucc%_PR',
+            'CarriesPer90_PR',
+            'CarriesToFinalThirdPer90_PR',
+            'CarriesToPenAreaPer90_PR',
+            'ProgCarriesPer50Touches_PR',
+            'ProgDistancePerCarry_PR',
+            'ProgCarryEfficiency_PR',
+            'FldPer90_PR'
+        ],
+        'Creativity and Attacking Play': [
+            'AssistsPer90_PR',
+            'xAPer90_PR',
+            'KeyPassesPer90_PR',
+            'PenAreaCmpPer90_PR',
+            'CrsPenAreaCmpPer90_PR',
+            'ThruBallsPer90_PR',
+            'CrsPer90_PR'
+        ],
+        'Goal Threat': [
+            'GoalsPer90_PR',
+            'ShotsPer90_PR',
+            'SoT%_PR',
+            'npxGPer90_PR',
+            'npxG/Sh_PR',
+            'SCAPer90_PR',
+            'SCADribPer90_PR'
+        ]
+    },
+    'W': {
+        'Pass Types': [
+            'ShortPass%_PR',
+            'MediumPass%_PR',
+            'LongPass%_PR',
+            'ProgPass%_PR',
+            'Switch%_PR',
+            'KeyPass%_PR',
+            'Final3rdPass%_PR',
+            'ThroughPass%_PR'
+        ],
+        'Touch Areas': [
+            'TouchesPer90_PR',
+            'TouchCentrality_PR',
+            'Def3rdTouch%_PR',
+            'Mid3rdTouch%_PR',
+            'Att3rdTouch%_PR',
+            'AttPenTouch%_PR'
+        ],
+        'Tackle Areas': [
+            'Def3rdTkl%_PR',
+            'Mid3rdTkl%_PR',
+            'Att3rdTkl%_PR'
+        ],
+        'Defensive Play': [
+            'TklPer90_PR',
+            'FlsPer90_PR',
+            'PassBlocksPer90_PR',
+            'IntPer90_PR',
+            'AerialWinsPer90_PR',
+            'AerialWin%_PR'
+        ],
+        'Ball Progression and Retention': [
+            'PassesCompletedPer90_PR',
+            'TotCmp%_PR',
+            'Final1/3CmpPer90_PR',
+            'ProgPassesPer90_PR',
+            'SwitchesPer90_PR',
+            'ReceivedPassPer90_PR',
+            'ProgPassesRecPer90_PR'
+        ],
+        'Ball Carrying and Dribbling': [
+            'AttDrbPer90_PR',
+            'DrbSucc%_PR',
+            'CarriesPer90_PR',
+            'CarriesToFinalThirdPer90_PR',
+            'CarriesToPenAreaPer90_PR',
+            'ProgCarriesPer50Touches_PR',
+            'ProgDistancePerCarry_PR',
+            'ProgCarryEfficiency_PR',
+            'FldPer90_PR'
+        ],
+        'Creativity and Attacking Play': [
+            'AssistsPer90_PR',
+            'xAPer90_PR',
+            'KeyPassesPer90_PR',
+            'PenAreaCmpPer90_PR',
+            'CrsPenAreaCmpPer90_PR',
+            'ThruBallsPer90_PR',
+            'CrsPer90_PR'
+        ],
+        'Goal Threat': [
+            'GoalsPer90_PR',
+            'ShotsPer90_PR',
+            'SoT%_PR',
+            'npxGPer90_PR',
+            'npxG/Sh_PR',
+            'SCAPer90_PR',
+            'SCADribPer90_PR'
+        ]
+    },
+    'ST': {
+        'Pass Types': [
+            'ShortPass%_PR',
+            'MediumPass%_PR',
+            'LongPass%_PR',
+            'ProgPass%_PR',
+            'Switch%_PR',
+            'KeyPass%_PR',
+            'Final3rdPass%_PR',
+            'ThroughPass%_PR'
+        ],
+        'Touch Areas': [
+            'TouchesPer90_PR',
+            'TouchCentrality_PR',
+            'Def3rdTouch%_PR',
+            'Mid3rdTouch%_PR',
+            'Att3rdTouch%_PR',
+            'AttPenTouch%_PR'
+        ],
+        'Defensive Play': [
+            'TklPer90_PR',
+            'FlsPer90_PR',
+            'PassBlocksPer90_PR',
+            'IntPer90_PR',
+            'AerialWinsPer90_PR',
+            'AerialWin%_PR'
+        ],
+        'Ball Progression and Retention': [
+            'PassesCompletedPer90_PR',
+            'TotCmp%_PR',
+            'Final1/3CmpPer90_PR',
+            'ProgPassesPer90_PR',
+            'SwitchesPer90_PR',
+            'ReceivedPassPer90_PR',
+            'ProgPassesRecPer90_PR'
+        ],
+        'Ball Carrying and Dribbling': [
+            'AttDrbPer90_PR',
+            'DrbSucc%_PR',
+            'CarriesPer90_PR',
+            'CarriesToFinalThirdPer90_PR',
+            'CarriesToPenAreaPer90_PR',
+            'ProgCarriesPer50Touches_PR',
+            'ProgDistancePerCarry_PR',
+            'ProgCarryEfficiency_PR',
+            'FldPer90_PR'
+        ],
+        'Creativity and Attacking Play': [
+            'AssistsPer90_PR',
+            'xAPer90_PR',
+            'KeyPassesPer90_PR',
+            'PenAreaCmpPer90_PR',
+            'CrsPenAreaCmpPer90_PR',
+            'ThruBallsPer90_PR',
+            'CrsPer90_PR'
+        ],
+        'Goal Threat': [
+            'GoalsPer90_PR',
+            'ShotsPer90_PR',
+            'SoT%_PR',
+            'npxGPer90_PR',
+            'npxG/Sh_PR',
+            'AvgShotDistance_PR',
+            'SCAPer90_PR',
+            'SCADribPer90_PR'
+        ]
+    },
+    'GK': {
+        'Shot Stopping': [
+            'SavesPer90_PR',
+            'Save%_PR',
+            'PSxG+/-Per90_PR',
+            'PSxG+/-PerSoTA_PR',
+            'PSxG/SoT_PR',
+            'GAPer90_PR'
+        ],
+        'Distribution': [
+            'PassAttPer90_PR',
+            'LaunchCmp%_PR',
+            'PassLaunch%_PR',
+            'PassAvgLen_PR',
+            'Throw%_PR',
+            'GoalKickLaunch%_PR',
+            'GoalKickAvgLen_PR'
+        ],
+        'Box Command': [
+            'CrossesFacedPer90_PR',
+            'CrossStop%_PR',
+            'OPAPer90_PR',
+            'AvgOPADist_PR'
+        ],
+        'Set Pieces': [
+            'PKSave%_PR',
+            'PKattPer90_PR',
+            'FKGAPer90_PR',
+            'CKGAPer90_PR'
+        ]
+    }
+}
+
+# All of these are aggregated columns: the mean of their percentile columns
+composite_metrics = {
+    'Aerial Ability': ['AerialWin%_PR', 'pAdjAerialWinsPer90_PR'],
+    'Box Defending': ['ShBlocksPer90_PR', 'ClrPer90_PR', 'pAdjClrPer90_PR', 'pAdjShBlocksPer90_PR'],
+    '1v1 Defending': ['TklWinPossPer90_PR', 'DrbTkl%_PR'],
+    'Defensive Awareness': ['IntPer90_PR', 'PassBlocksPer90_PR', 'pAdjPassBlocksPer90_PR', 'pAdjIntPer90_PR'],
+    'Pass Progression': ['ProgPassesPer90_PR', 'ProgPassesPer50CmpPasses_PR', 'ProgPassDistPer90_PR'],
+    'Pass Retention': ['TotCmp%_PR', 'ShortPassCmp%_PR', 'MedPassCmp%_PR', 'LongPassCmp%_PR'],
+    'Ball Carrying': ['ProgCarryDistancePer90_PR', 'ProgCarriesPer90_PR', 'ProgCarriesPer50Touches_PR'],
+    'Volume of Take-ons': ['AttDrbPer90_PR'],
+    'Retention from Take-ons': ['SuccDrbPer90_PR', 'DrbSucc%_PR'],
+    'Chance Creation': ['xAGPer90_PR', 'xAPer90_PR', 'KeyPassesPer90_PR', 'SCAPassLivePer90_PR'],
+    'Impact in and around box': ['Final1/3CmpPer90_PR', 'PenAreaCmpPer90_PR', 'CrsPenAreaCmpPer90_PR', 'ThruBallsPer90_PR', 'Att3rdTouchPer90_PR', 'AttPenTouchPer90_PR'],
+    'Shot Volume': ['ShotsPer90_PR'],
+    'Shot Quality': ['AvgShotDistance_PR', 'npxG/Sh_PR'],
+    'Self-created Shots': ['SCADribPer90_PR'],
+    # Goalkeepers
+    'Shot Stopping': ['PSxG+/-Per90_PR', 'PSxG+/-PerSoTA_PR', 'Save%_PR'],
+    'Penalty Saving': ['PKSave%_PR'],
+    'Cross Claiming': ['CrossStop%_PR', 'CrossesStoppedPer90_PR'],
+    'Sweeping': ['OPAPer90_PR', 'AvgOPADist_PR'],
+    'Distribution Range': ['PassLaunch%_PR', 'PassAvgLen_PR', 'GoalKickAvgLen_PR'],
+    'Launch Accuracy': ['LaunchCmp%_PR'],
+    'Distribution Volume': ['PassAttPer90_PR', 'ThrowsPer90_PR'],
+    'Clean Sheets': ['CS%_PR'],
+}
+
+def metric_dependencies(views=None, composites=composite_metrics, groups=None):
+    """
+    Derives the percentile columns the views read and the raw columns they are ranked from
+    
+    Args:
+    views (dict): View name -> {position group: composites and percentile columns}
+    (default: the pizza, bar and similarity configurations)
+    composites (dict): Composite -> its percentile columns (default: composite_metrics)
+    groups (list): Only walk these position groups, all if None (default: None)
+    
+    Returns:
+    dict with the sorted 'percentiles', the 'metrics' to rank for them, and 'problems', one line
+    per reference that is neither a composite nor a percentile column
+    """
+    if views is None:
+        views = {
+            'pizza': metrics_by_position,
+            'bars': {group: [metric for metrics in charts.values() for metric in metrics]
+                     for group, charts in chart_metrics_by_position.items()},
+            'similarity': similarity_metrics_by_position
+        }
+    percentiles, problems = set(), []
+    for view, view_groups in views.items():
+        for group, metrics in view_groups.items():
+            if groups is not None and group not in groups:
+                continue
+            for metric in metrics:
+                if metric in composites:
+                    percentiles.update(composites[metric])
+                elif metric.endswith('_PR'):
+                    percentiles.add(metric)
+                else:
+                    problems.append(f"{view} {group}: {metric} is neither a composite nor a percentile column")
+    percentiles = sorted(percentiles)
+    return {'percentiles': percentiles, 'metrics': [col[:-3] for col in percentiles], 'problems': problems}
+
+def check_metric_dependencies(df, dependencies):
+    """
+    Raises listing every reference in the views that can't be built from df
+    
+    Args:
+    df (DataFrame): Final player table, before ranking
+    dependencies (dict): Output of metric_dependencies
+    """
+    problems = dependencies['problems'] + [f"{metric}: missing, needed for {metric}_PR"
+                                           for metric in dependencies['metrics'] if metric not in df.columns]
+    if problems:
+        raise ValueError("Metric dependency check failed:\n" + "\n".join(problems))
+
+percentile_dependencies = metric_dependencies(groups=position_group_order)
+if pipeline_run:
+    check_metric_dependencies(df, percentile_dependencies)
+
+# Goalkeepers are ranked on their own columns, from the keeper table
+keeper_dependencies = metric_dependencies(groups=keeper_group_order)
+if pipeline_run and df_keepers is not None:
+    check_metric_dependencies(df_keepers, keeper_dependencies)
+
+# Everything the views read, as the columns of one feature matrix: composites, then percentiles
+feature_columns = list(composite_metrics) + sorted(set(percentile_dependencies['percentiles'])
+                                                   | set(keeper_dependencies['percentiles']))
+
+def compile_metric_registry(columns=feature_columns):
+    """
+    Compiles the view configurations into integer offsets into a feature matrix, so a render or a
+    similarity fit gathers a player's row instead of looking each metric up by name
+    
+    Args:
+    columns (list): Columns of the feature matrix (default: feature_columns)
+    
+    Returns:
+    Read-only mapping of 'columns', 'composites' ((offset, offsets of its percentile columns) per
+    composite) and, per position group, a read-only mapping of 'pizza' and 'similarity' offsets and 'bars'
+    (chart type -> offsets). Similarity metrics missing from columns are left out, like
+    find_similar_players does; a group whose pizza and bar metrics aren't all there (goalkeepers
+    without a keeper build) is left out.
+    """
+    offsets = {col: i for i, col in enumerate(columns)}
+    def compile_metrics(metrics, required=True):
+        compiled = np.array([offsets[metric] for metric in metrics if required or metric in offsets], dtype=np.intp)
+        compiled.setflags(write=False)
+        return compiled
+    
+    registry = {
+        'columns': tuple(columns),
+        'composites': tuple((offsets[composite], compile_metrics(components))
+                            for composite, components in composite_metrics.items()
+                            if composite in offsets and set(components) <= set(offsets))
+    }
+    for group in metrics_by_position:
+        charted = metrics_by_position[group] + [metric for metrics in chart_metrics_by_position[group].values()
+                                                for metric in metrics]
+        if not set(charted) <= set(offsets):
+            continue
+        registry[group] = MappingProxyType({
+            'pizza': compile_metrics(metrics_by_position[group]),
+            'bars': MappingProxyType({chart: compile_metrics(metrics)
+                                      for chart, metrics in chart_metrics_by_position[group].items()}),
+            'similarity': compile_metrics(similarity_metrics_by_position[group], required=False)
+        })
+    return MappingProxyType(registry)
+
+# Example usage: one player's pizza values
+# registry = compile_metric_registry()
+# features = df_combined[feature_columns].to_numpy(dtype=np.float32)
+# features[row, registry['CB']['pizza']]
+
+# Columns that define a percentile pool for each percentile_pool setting
+percentile_pool_columns = {
+    'competition': ['Competition', 'Season'],
+    'league': ['Comp', 'Season'],
+    'pooled': ['Season']
+}
+
+# Metrics where less is better (goals conceded). They are ranked in reverse, so a high percentile
+# is always the good end of a chart.
+lower_is_better_metrics = ['GAPer90', 'FKGAPer90', 'CKGAPer90']
+
+@profiled('Percentile rankings')
+def create_percentile_rankings(position_df, metrics_to_rank, pool=percentile_pool):
+    """
+    Creates percentile rankings for specified metrics within a position group
+    
+    Args:
+    position_df: DataFrame containing only players of a specific position
+    metrics_to_rank: List of column names to create percentiles for
+    pool: Key in percentile_pool_columns; players are only ranked against their own pool
+    
+    Every pool is re-ranked on every run, incremental refresh included: one new or changed row
+    moves the percentile of every other row in its pool, so there is nothing safe to reuse.
+    
+    Returns:
+    DataFrame with new percentile columns
+    """
+    percentile_df = position_df.copy()
+    pool_columns = percentile_pool_columns[pool]
+    percentile_cols = [f'{metric}_PR' for metric in metrics_to_rank]
+    percentiles = pd.DataFrame(np.nan, index=percentile_df.index, columns=percentile_cols)
+    pools = percentile_df.groupby(pool_columns, sort=False)
+    
+    for metric in metrics_to_rank:
+        # Create the percentile column name
+        percentile_col = f'{metric}_PR'
+        
+        # Calculate percentile rank
+        percentiles[percentile_col] = pools[metric].rank(pct=True, ascending=metric not in lower_is_better_metrics) * 100
+        
+        # Round to 1 decimal place
+        percentiles[percentile_col] = percentiles[percentile_col].round(1)
+    
+    return percentile_df.join(percentiles)
+
+# Only the columns the views read are ranked
+metrics_to_rank = percentile_dependencies['metrics']
+keeper_metrics_to_rank = keeper_dependencies['metrics']
+
+if pipeline_run:
+    # Create percentile rankings for each position group
+    for group, cohort in position_cohorts.items():
+        group_metrics = keeper_metrics_to_rank if group in keeper_group_order else metrics_to_rank
+        position_cohorts[group] = create_percentile_rankings(cohort, group_metrics)
+    df_players_fb, df_players_cb, df_players_dm, df_players_cm, df_players_am, df_players_wi, df_players_st = (
+        position_cohorts[group] for group in position_group_order)
+
+    # Example to view results for a specific player
+    #player_name = "Trent Alexander-Arnold"  # Replace with any player name
+    #if player_name in df_players_fb['Player'].values:
+    #    player_percentiles = df_players_fb[df_players_fb['Player'] == player_name]
+    #    print(f"\nPercentile rankings for {player_name}:")
+    #    for metric in metrics_to_rank:
+    #        percentile = player_percentiles[f'{metric}_percentile'].values[0]
+    #        print(f"{metric}: {percentile:.1f}th percentile")
+
+    df_players_fb.head()
+
+    # First, concatenate all position DataFrames vertically, goalkeepers last
+    df_combined = pd.concat(list(position_cohorts.values()), axis=0)
+
+    # Reset the index of the combined DataFrame
+    df_combined = df_combined.reset_index(drop=True)
+
+    # Save the combined DataFrame if needed
+    with profile_stage('Write CSV', file='Combined_Players_With_Percentiles'):
+        df_combined.to_csv(f"{root}Combined_Players_With_Percentiles.csv", index=False)
+
+    # Verify the merge worked correctly
+    print("Total players in combined DataFrame:", len(df_combined))
+    print("Players by position:")
+    print(df_combined['Main Position'].value_counts())
+
+    # First, let's see what columns are actually in the DataFrame
+    print("Available columns in df_players_fb:")
+    print(df_players_fb.columns.tolist())
+
+
+    # All of these are aggregated columns: the mean of their percentile columns. Goalkeeper composites
+    # are skipped without a keeper build, and are NaN for outfield players
+    for composite, components in composite_metrics.items():
+        if set(components) <= set(df_combined.columns):
+            df_combined[composite] = df_combined[components].to_numpy(dtype=float).mean(axis=1)
+
+    composite_columns = [composite for composite in composite_metrics if composite in df_combined.columns]
+
+    df_combined.head()
+
+    # Verify the results
+    print("Position Group counts:")
+    print(df_combined['Position Group'].value_counts())
+
+    df_combined = df_combined.sort_values('Min', ascending=False)
+
+    dupe_check = df_combined.query('Player == "Chiquinho"')
+    dupe_check.head()
+
+    # Shrink the combined table before it is stored and served
+    memory_report(df_combined, 'Combined (before compacting)')
+    df_combined = compact_dtypes(df_combined)
+    validate_schema(df_combined, 'Combined', composite_columns)
+    memory_report(df_combined, 'Combined')
+    print(pd.DataFrame(memory_reports))
+else:
+    # The views below default to df_combined; serve and streamlit runs pass the table they load
+    # from the snapshots instead, and export reads the combined store
+    df_combined = None
+    composite_columns = list(composite_metrics)
+
+##################################################################################
+################ Columnar store for the combined player table ####################
+##################################################################################
+
+# The combined table has ~700 columns, so reading it back from CSV means parsing everything.
+# Parquet partitioned by season, competition and position group lets a view read only its
+# columns and rows.
+
+import pyarrow.parquet as pq
+
+combined_store = f"{root}Combined Players Store"
+
+@profiled('Write combined store')
+def write_combined_store(df, path=combined_store):
+    """
+    Writes the combined table to a Parquet dataset partitioned by season, competition and
+    position group
+    
+    Args:
+    df (DataFrame): Combined player table
+    path (str): Dataset directory (default: combined_store)
+    """
+    df.to_parquet(
+        path, engine='pyarrow', index=False,
+        partition_cols=['Season', 'Competition', 'Position Group'],
+        existing_data_behavior='delete_matching'
+    )
+
+def load_combined_store(columns=None, filters=None, path=combined_store):
+    """
+    Reads the projected columns and filtered rows of the combined store. Partition filters
+    skip whole files and other filters are pushed down to the Parquet row groups.
+    
+    Args:
+    columns (list): Columns to read, all if None (default: None)
+    filters (list): pyarrow filters, e.g. [('Position Group', '==', 'AM')] (default: None)
+    path (str): Dataset directory (default: combined_store)
+    
+    Returns:
+    DataFrame
+    """
+    df = pd.read_parquet(path, engine='pyarrow', columns=columns, filters=filters)
+    
+    # Partition keys come back as categoricals; keep them as plain strings like the CSV
+    for col in ['Season', 'Competition', 'Position Group']:
+        if col in df.columns:
+            df[col] = df[col].astype(str)
+    return df
+
+if pipeline_run:
+    write_combined_store(df_combined)
+
+# Example usage: one position group's composites
+# load_combined_store(['Player', 'Squad', 'Chance Creation', 'Ball Carrying'],
+#                     [('Season', '==', season), ('Position Group', '==', 'AM')])
+
+##################################################################################
+################ Memory-mapped percentile matrix for app workers #################
+##################################################################################
+
+# Every dashboard worker process otherwise holds its own float64 copy of the percentile block.
+# Exported once as a float32 .npy with a small JSON header, all workers map the same file
+# read-only and share its pages through the OS page cache.
+#
+#   Combined Percentiles/<version>/matrix.npy   the matrix
+#   Combined Percentiles/<version>/header.json  column names and row keys
+#   Combined Percentiles/CURRENT                 the version workers load
+#
+# A new export goes into a fresh version directory and CURRENT is swapped last, in one
+# os.replace, so a worker always sees a matrix and header from the same export.
+
+import shutil
+
+percentile_matrix_path = f"{root}Combined Percentiles"
+
+def player_keys(df):
+    """
+    Row keys of the combined table: player id (the name when FBref gave none), position group,
+    competition and season
+    """
+    player = df['PlayerID'].astype(object).where(df['PlayerID'].notna(), df['Player'].astype(str))
+    return (player.astype(str) + '|' + df['Position Group'].astype(str) + '|'
+            + df['Competition'].astype(str) + '|' + df['Season'].astype(str))
+
+@profiled('Export percentile matrix')
+def export_percentile_matrix(df, path=percentile_matrix_path, keep=2):
+    """
+    Writes the percentile and composite columns as a float32 .npy matrix plus a JSON header
+    mapping column names and row keys (player_keys) to offsets, into a new version directory,
+    then points CURRENT at it
+    
+    Args:
+    df (DataFrame): Combined player table
+    path (str): Directory holding the versions (default: percentile_matrix_path)
+    keep (int): Versions kept, so workers still mapping the previous one aren't cut off (default: 2)
+    
+    Raises:
+    ValueError: if two rows share a key
+    """
+    keys = player_keys(df)
+    duplicated = keys[keys.duplicated()]
+    if not duplicated.empty:
+        raise ValueError(f"Duplicate percentile matrix rows: {sorted(set(duplicated))[:5]}")
+    
+    columns = [col for col in df.columns if col.endswith('_PR')] + composite_columns
+    header = {
+        'columns': columns,
+        'players': keys.tolist(),
+        'names': (df['Player'].astype(str) + ' (' + df['Squad'].astype(str) + ')').tolist(),
+        'position_groups': df['Position Group'].astype(str).tolist()
+    }
+    
+    version = datetime.now().strftime('%Y%m%dT%H%M%S%f')
+    os.makedirs(f"{path}/{version}")
+    matrix = np.lib.format.open_memmap(f"{path}/{version}/matrix.npy", mode='w+', dtype=np.float32,
+                                       shape=(len(df), len(columns)))
+    matrix[:] = df[columns].to_numpy(dtype=np.float32)
+    matrix.flush()
+    del matrix
+    with open(f"{path}/{version}/header.json", 'w') as f:
+        json.dump(header, f)
+    
+    with open(f"{path}/CURRENT.tmp", 'w') as f:
+        f.write(version)
+    os.replace(f"{path}/CURRENT.tmp", f"{path}/CURRENT")
+    
+    versions = sorted(entry for entry in os.listdir(path) if os.path.isdir(f"{path}/{entry}"))
+    for old in versions[:-keep]:
+        shutil.rmtree(f"{path}/{old}", ignore_errors=True)
+
+def load_percentile_matrix(path=percentile_matrix_path):
+    """
+    Maps the current exported matrix read-only, without copying it into the process
+    
+    Returns:
+    (matrix, header) where header also holds 'version', 'column_index' and 'player_index' lookups
+    """
+    with open(f"{path}/CURRENT") as f:
+        version = f.read().strip()
+    with open(f"{path}/{version}/header.json") as f:
+        header = json.load(f)
+    header['version'] = version
+    header['column_index'] = {col: i for i, col in enumerate(header['columns'])}
+    header['player_index'] = {key: i for i, key in enumerate(header['players'])}
+    matrix = np.load(f"{path}/{version}/matrix.npy", mmap_mode='r')
+    return matrix, header
+
+def percentile_frame(matrix, header):
+    """
+    Wraps the mapped matrix in a DataFrame without copying it
+    """
+    return pd.DataFrame(matrix, index=header['players'], columns=header['columns'], copy=False)
+
+def player_percentiles(matrix, header, player_key, columns):
+    """
+    Gathers one player's values for the given columns straight from the mapped pages
+    
+    Args:
+    player_key (str): Row key, as from player_keys
+    columns (list): Percentile or composite column names
+    """
+    row = header['player_index'][player_key]
+    return matrix[row, [header['column_index'][col] for col in columns]]
+
+if pipeline_run:
+    export_percentile_matrix(df_combined)
+
+# Example usage, in each worker process:
+# percentile_matrix, percentile_header = load_percentile_matrix()
+# player_percentiles(percentile_matrix, percentile_header, player_keys(df_combined).iloc[0], ['Chance Creation'])
+
+##################################################################################
+######################## Versioned snapshots of the dataset ######################
+##################################################################################
+
+# Every run overwrites the CSVs and stores above, so past percentiles are lost. Each run also
+# appends a snapshot of the combined table here. Rows are content-addressed: a row unchanged
+# since an earlier snapshot is not stored again, and a snapshot is just a manifest of row keys
+# pointing at the chunk files that hold them.
+#
+#   Snapshots/chunks/<snapshot id>.parquet   rows first seen in that snapshot, with 'RowHash'
+#   Snapshots/manifests/<snapshot id>.json   {row key: [row hash, chunk]} plus a summary
+#   Snapshots/index.json                     every snapshot's summary, the chunk of each row hash
+#                                            and each player's [snapshot, row key, row hash, chunk]
+#
+# The index is updated on every write, so checking for stored rows and reading a player's
+# history never open the manifests.
+
+snapshot_store = f"{root}Snapshots"
+
+# Snapshot rows are keyed like the percentile matrix
+snapshot_keys = player_keys
+
+snapshot_summary_columns = ['Snapshot', 'Created', 'Rows', 'New Rows']
+
+def _load_manifest(snapshot_id, store=snapshot_store):
+    with open(os.path.join(store, 'manifests', f"{snapshot_id}.json")) as f:
+        return json.load(f)
+
+def _index_manifest(index, manifest):
+    # Adds one snapshot to the index; write_snapshot never reuses an id
+    snapshot_id = manifest['Snapshot']
+    index['snapshots'][snapshot_id] = [manifest[key] for key in snapshot_summary_columns]
+    for key, (row_hash, chunk) in manifest['rows'].items():
+        index['hashes'].setdefault(row_hash, chunk)
+        index['players'].setdefault(key.split('|', 1)[0], []).append([snapshot_id, key, row_hash, chunk])
+
+def _save_snapshot_index(index, store=snapshot_store):
+    path = os.path.join(store, 'index.json')
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(index, f)
+    os.replace(f"{path}.tmp", path)
+
+def load_snapshot_index(store=snapshot_store):
+    """
+    Loads the snapshot index. Manifests it doesn't cover yet (a store written before the index,
+    or a run stopped between its manifest and index writes) are added and the index saved.
+    
+    Returns:
+    dict with 'snapshots' (id -> summary), 'hashes' (row hash -> chunk) and 'players'
+    (player id -> [snapshot, row key, row hash, chunk] points)
+    """
+    index = {'snapshots': {}, 'hashes': {}, 'players': {}}
+    path = os.path.join(store, 'index.json')
+    if os.path.exists(path):
+        with open(path) as f:
+            index = json.load(f)
+    manifest_dir = os.path.join(store, 'manifests')
+    names = sorted(os.listdir(manifest_dir)) if os.path.exists(manifest_dir) else []
+    missing = [name[:-len('.json')] for name in names
+               if name.endswith('.json') and name[:-len('.json')] not in index['snapshots']]
+    for snapshot_id in missing:
+        _index_manifest(index, _load_manifest(snapshot_id, store))
+    if missing:
+        _save_snapshot_index(index, store)
+    return index
+
+def list_snapshots(store=snapshot_store):
+    """
+    Summary of every snapshot, oldest first
+    
+    Returns:
+    DataFrame with 'Snapshot', 'Created', 'Rows' and 'New Rows'
+    """
+    summaries = load_snapshot_index(store)['snapshots']
+    return pd.DataFrame([summaries[snapshot_id] for snapshot_id in sorted(summaries)],
+                        columns=snapshot_summary_columns)
+
+@profiled('Write snapshot')
+def write_snapshot(df, store=snapshot_store, snapshot_id=None):
+    """
+    Appends a snapshot of the combined table, storing only rows not already in the store
+    
+    Args:
+    df (DataFrame): Combined player table
+    store (str): Snapshot directory (default: snapshot_store)
+    snapshot_id (str): Snapshot name, sortable by time (default: current time to the microsecond,
+    YYYYMMDDTHHMMSSffffff)
+    
+    Returns:
+    The snapshot id
+    
+    Raises:
+    ValueError: if a snapshot with that id already exists
+    """
+    snapshot_id = snapshot_id or datetime.now().strftime('%Y%m%dT%H%M%S%f')
+    # Rewriting a snapshot would replace the chunk that later snapshots' rows point to
+    if (os.path.exists(os.path.join(store, 'manifests', f"{snapshot_id}.json"))
+            or os.path.exists(os.path.join(store, 'chunks', f"{snapshot_id}.parquet"))):
+        raise ValueError(f"Snapshot {snapshot_id} already exists")
+    os.makedirs(os.path.join(store, 'chunks'), exist_ok=True)
+    os.makedirs(os.path.join(store, 'manifests'), exist_ok=True)
+    
+    # Where every row hash seen so far is stored
+    index = load_snapshot_index(store)
+    stored = index['hashes']
+    
+    df = df.reset_index(drop=True)
+    keys = snapshot_keys(df)
+    hashes = pd.Series(pd.util.hash_pandas_object(df, index=False).values).map('{:016x}'.format)
+    new_rows = ~hashes.isin(stored)
+    
+    chunk = f"{snapshot_id}.parquet"
+    if new_rows.any():
+        df[new_rows.values].assign(RowHash=hashes[new_rows].values).to_parquet(
+            os.path.join(store, 'chunks', chunk), engine='pyarrow', index=False)
+    
+    manifest = {
+        'Snapshot': snapshot_id,
+        'Created': datetime.now().isoformat(timespec='seconds'),
+        'Rows': len(df),
+        'New Rows': int(new_rows.sum()),
+        'rows': {key: [row_hash, chunk if new else stored[row_hash]]
+                 for key, row_hash, new in zip(keys, hashes, new_rows)}
+    }
+    
+    # The manifest is swapped in after its chunk, so a snapshot is either complete or absent;
+    # the index follows, and load_snapshot_index catches up if the run stops in between
+    path = os.path.join(store, 'manifests', f"{snapshot_id}.json")
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(manifest, f)
+    os.replace(f"{path}.tmp", path)
+    _index_manifest(index, manifest)
+    _save_snapshot_index(index, store)
+    return snapshot_id
+
+def _read_rows(row_hashes_by_chunk, columns=None, store=snapshot_store):
+    # Reads the given row hashes from their chunk files, touching no other chunk
+    frames = []
+    for chunk, row_hashes in row_hashes_by_chunk.items():
+        frames.append(pd.read_parquet(
+            os.path.join(store, 'chunks', chunk), engine='pyarrow',
+            columns=None if columns is None else list(dict.fromkeys(list(columns) + ['RowHash'])),
+            filters=[('RowHash', 'in', list(row_hashes))]))
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True)
+
+def load_snapshot(snapshot_id=None, columns=None, store=snapshot_store):
+    """
+    Loads the combined table as it was at a snapshot
+    
+    Args:
+    snapshot_id (str): Snapshot to load (default: the latest)
+    columns (list): Columns to read, all if None (default: None)
+    store (str): Snapshot directory (default: snapshot_store)
+    
+    Returns:
+    DataFrame
+    """
+    if snapshot_id is None:
+        snapshot_id = list_snapshots(store)['Snapshot'].iloc[-1]
+    by_chunk = defaultdict(set)
+    for row_hash, chunk in _load_manifest(snapshot_id, store)['rows'].values():
+        by_chunk[chunk].add(row_hash)
+    return _read_rows(by_chunk, columns, store).drop(columns='RowHash')
+
+def player_history(player_id, columns=None, store=snapshot_store):
+    """
+    One player's rows across every snapshot, reading only the chunks that hold them
+    
+    Args:
+    player_id (str): FBref player id (or name, for rows scraped without one)
+    columns (list): Columns to read, all if None (default: None)
+    store (str): Snapshot directory (default: snapshot_store)
+    
+    Returns:
+    DataFrame with one row per snapshot and position group, with a 'Snapshot' column
+    """
+    snapshot_rows = []
+    by_chunk = defaultdict(set)
+    for snapshot_id, _, row_hash, chunk in sorted(load_snapshot_index(store)['players'].get(player_id, [])):
+        snapshot_rows.append((snapshot_id, row_hash))
+        by_chunk[chunk].add(row_hash)
+    
+    rows = _read_rows(by_chunk, columns, store).drop_duplicates('RowHash').set_index('RowHash')
+    history = rows.loc[[row_hash for _, row_hash in snapshot_rows]].reset_index(drop=True)
+    history.insert(0, 'Snapshot', [snapshot_id for snapshot_id, _ in snapshot_rows])
+    return history
+
+if pipeline_run:
+    write_snapshot(df_combined)
+
+# Example usage:
+# list_snapshots()
+# load_snapshot(columns=['Player', 'Squad', 'Chance Creation'])
+# player_history(df_combined['PlayerID'].iloc[0], ['Player', 'Squad', 'Chance Creation'])
+
+from urllib.request import urlopen
+
+import matplotlib.pyplot as plt
+from PIL import Image
+
+from mplsoccer import PyPizza, add_image, FontManager
+from matplotlib.figure import Figure
+from IPython.display import display
+from io import BytesIO
+
+from matplotlib.font_manager import FontProperties
+
+# Chart fonts, loaded the first time a chart needs them. A copy in chart_font_dir is used before
+# downloading, so offline runs can drop the files there; without either, charts fall back to
+# matplotlib's default font.
+chart_font_urls = {
+    'normal': 'https://raw.githubusercontent.com/googlefonts/roboto/main/src/hinted/Roboto-Regular.ttf',
+    'italic': 'https://raw.githubusercontent.com/googlefonts/roboto/main/src/hinted/Roboto-Italic.ttf',
+    'bold': 'https://raw.githubusercontent.com/google/fonts/main/apache/robotoslab/RobotoSlab[wght].ttf'
+}
+chart_font_dir = f"{root}Fonts"
+_chart_fonts = process_cache('chart fonts')
+
+def chart_font(style):
+    """
+    FontProperties of a chart font, loaded once per process
+    
+    Args:
+    style (str): Key in chart_font_urls
+    """
+    if style not in _chart_fonts:
+        local = os.path.join(chart_font_dir, chart_font_urls[style].rsplit('/', 1)[-1])
+        if os.path.exists(local):
+            _chart_fonts[style] = FontProperties(fname=local)
+        else:
+            try:
+                _chart_fonts[style] = FontManager(chart_font_urls[style]).prop
+            except OSError as e:
+                print(f"Could not load the {style} chart font ({e}); using matplotlib's default")
+                _chart_fonts[style] = FontProperties()
+    return _chart_fonts[style]
+
+# One pizza per position group is laid out once. Rendering a player only changes the slice
+# radii, the value labels and the title.
+_pizza_templates = process_cache('pizza templates')
+
+# Templates are shared by everything rendering in the process. A render holds its template's lock
+# from the update until the figure has been serialized, so concurrent sessions never interleave.
+_template_locks = process_cache('template locks', lambda: defaultdict(threading.Lock))
+_template_locks_guard = process_cache('template locks guard', threading.Lock)
+
+def _template_lock(kind, position_group):
+    with _template_locks_guard:
+        return _template_locks[(kind, position_group)]
+
+def _build_pizza_template(position_group):
+    """
+    Lays out the pizza chart for a position group with placeholder values
+    
+    Args:
+    position_group (str): Position group key in metrics_by_position
+    
+    Returns:
+    dict with the figure, the slice patches, the value texts and the title text
+    """
+    metrics = metrics_by_position[position_group]
+    
+    # color for the slices and text
+    slice_colors = ["#1A78CF"] * 9
+    text_colors = ["#000000"] * 9
+
+    # Built with the object-oriented API so pyplot never holds a reference to the figure
+    fig = Figure(figsize=(8, 8.5), facecolor="#EBEBE9")
+    ax = fig.add_subplot(projection='polar')
+    ax.set_facecolor("#EBEBE9")
+
+    # instantiate PyPizza class
+    baker = PyPizza(
+        params=metrics,                  # list of parameters
+        background_color="#EBEBE9",     # background color
+        straight_line_color="#EBEBE9",  # color for straight lines
+        straight_line_lw=1,             # linewidth for straight lines
+        last_circle_lw=0,               # linewidth of last circle
+        other_circle_lw=0,              # linewidth for other circles
+        inner_circle_size=20            # size of inner circle
+    )
+
+    # plot pizza
+    baker.make_pizza(
+        [50] * len(metrics),             # placeholder values, replaced per player
+        ax=ax,                           # draw into the template axes
+        color_blank_space="same",        # use same color to fill blank space
+        slice_colors=slice_colors,       # color for individual slices
+        value_colors=text_colors,        # color for the value-text
+        value_bck_colors=slice_colors,   # color for the blank spaces
+        blank_alpha=0.4,                 # alpha for blank-space colors
+        kwargs_slices=dict(
+            edgecolor="#F2F2F2", zorder=2, linewidth=1
+        ),                               # values to be used when plotting slices
+        kwargs_params=dict(
+            color="#000000", fontsize=11,
+            fontproperties=chart_font('normal'), va="center"
+        ),                               # values to be used when adding parameter
+        kwargs_values=dict(
+            color="#000000", fontsize=11,
+            fontproperties=chart_font('normal'), zorder=3,
+            bbox=dict(
+                edgecolor="#000000", facecolor="cornflowerblue",
+                boxstyle="round,pad=0.2", lw=1
+            )
+        )                                # values to be used when adding parameter-values
+    )
+
+    # add title
+    title = fig.text(
+        0.515, 0.975, "", size=16,
+        ha="center", fontproperties=chart_font('bold'), color="#000000"
+    )
+
+    # add subtitle
+    fig.text(
+        0.515, 0.953,
+        f"Percentile Rank vs Top-Five League {position_group}'s",
+        size=13,
+        ha="center", fontproperties=chart_font('bold'), color="#000000"
+    )
+
+    # add credits
+    CREDIT_1 = "data: opta viz fbref | using mplsoccer"
+    CREDIT_2 = "inspired by: @Worville, @FootballSlices, @somazerofc & @Soumyaj15209314"
+
+    fig.text(
+        0.99, 0.02, f"{CREDIT_1}\n{CREDIT_2}", size=9,
+        fontproperties=chart_font('italic'), color="#000000",
+        ha="right"
+    )
+
+    # The first bar container on the axes holds the value slices
+    return {
+        'fig': fig,
+        'metrics': metrics,
+        'theta': baker.get_theta(),
+        'slices': ax.containers[0],
+        'values': baker.get_value_texts(),
+        'title': title
+    }
+
+def _get_pizza_template(position_group):
+    template = _pizza_templates.get(position_group)
+    if template is None:
+        template = _pizza_templates[position_group] = _build_pizza_template(position_group)
+    return template
+
+def _chart_values(values):
+    # Rounded percentiles as drawn; a missing value is drawn as 0
+    return np.rint(np.nan_to_num(np.asarray(values, dtype=float))).astype(int).tolist()
+
+def season_label(season):
+    # '2024-2025' -> '24/25', as the chart titles show it
+    start, _, end = str(season).partition('-')
+    return f"{start[-2:]}/{end[-2:]}" if end else str(season)
+
+def _update_pizza_template(template, values, player_name, squad, position_group, season=season):
+    """
+    Writes a player's values and title into a pizza template
+    
+    Args:
+    values (array): The player's values of template['metrics'], in order
+    season (str): The row's season, for the title (default: season)
+    """
+    values = _chart_values(values)
+    for slice_, text, theta, value in zip(template['slices'], template['values'], template['theta'], values):
+        slice_.set_height(value)
+        text.set_position((theta, value))
+        text.set_text(str(value))
+    template['title'].set_text(
+        f"{player_name} - {squad} | {position_group} Template | {season_label(season)} Season"
+    )
+    return template['fig']
+
+def release_pizza_templates():
+    """
+    Clears and drops every cached pizza chart figure
+    """
+    for template in _pizza_templates.values():
+        template['fig'].clear()
+    _pizza_templates.clear()
+
+def player_row(df, player_name, squad=None):
+    """
+    A player's row, matched on the squad too when one is given so namesakes at other clubs
+    aren't mixed up
+    """
+    rows = df['Player'] == player_name
+    if squad is not None:
+        rows &= df['Squad'] == squad
+    return df[rows].iloc[0]
+
+def create_player_pizza(player_name, df=df_combined, save_fig=False, squad=None, show=display):
+    """
+    Creates a pizza chart for a specified player based on their position group
+    
+    Args:
+    player_name (str): Name of the player
+    df (DataFrame): DataFrame containing player data (default: df_combined)
+    save_fig (bool): Whether to save the figure (default: False)
+    squad (str): The player's squad, to tell namesakes apart (default: None)
+    show (callable): Called with the finished figure (default: IPython's display)
+    """
+    
+    # Get player's data and position group
+    player_data = player_row(df, player_name, squad)
+    
+    with _template_lock('pizza', player_data['Position Group']):
+        template = _get_pizza_template(player_data['Position Group'])
+        with trace_span('pizza render'):
+            fig = _update_pizza_template(template, player_data[template['metrics']], player_name,
+                                         player_data['Squad'], player_data['Position Group'],
+                                         player_data.get('Season', season))
+        with trace_span('pizza serialize'):
+            show(fig)
+
+def benchmark_pizza_rendering(player_names, df=df_combined, repeats=3):
+    """
+    Times rendering pizzas to PNG by rebuilding PyPizza each time versus updating the
+    cached position-group template
+    
+    Args:
+    player_names (list): Players to render
+    df (DataFrame): DataFrame containing player data (default: df_combined)
+    repeats (int): Number of passes over player_names (default: 3)
+    
+    Returns:
+    DataFrame with the mean milliseconds per render for each approach and the speedup
+    """
+    players = [df[df['Player'] == name].iloc[0] for name in player_names]
+    timings = {'Full rebuild': [], 'Template update': []}
+    
+    for _ in range(repeats):
+        for name, player_data in zip(player_names, players):
+            start = time.perf_counter()
+            template = _build_pizza_template(player_data['Position Group'])
+            _update_pizza_template(template, player_data[template['metrics']], name, player_data['Squad'],
+                                   player_data['Position Group'], player_data.get('Season', season)).savefig(BytesIO(), format='png')
+            timings['Full rebuild'].append(time.perf_counter() - start)
+            
+            start = time.perf_counter()
+            template = _get_pizza_template(player_data['Position Group'])
+            _update_pizza_template(template, player_data[template['metrics']], name, player_data['Squad'],
+                                   player_data['Position Group'], player_data.get('Season', season)).savefig(BytesIO(), format='png')
+            timings['Template update'].append(time.perf_counter() - start)
+    
+    results = pd.DataFrame({
+        'Approach': list(timings),
+        'Mean ms': [mean(t) * 1000 for t in timings.values()]
+    })
+    results['Speedup'] = results['Mean ms'].iloc[0] / results['Mean ms']
+    return results
+
+# Example usage:
+# benchmark_pizza_rendering(df_combined.groupby('Position Group')['Player'].first().tolist())
+
+from sklearn import preprocessing
+from sklearn.decomposition import PCA
+from sklearn.cluster import KMeans
+
+def _max_distances(coords):
+    # Each point's largest distance to any point of `coords`, in blocks of rows so large groups
+    # never hold the whole distance matrix
+    block = max(1, 2**22 // len(coords))
+    return np.concatenate([
+        np.hypot(coords[start:start + block, :1] - coords[:, 0], coords[start:start + block, 1:] - coords[:, 1]).max(axis=1)
+        for start in range(0, len(coords), block)
+    ])
+
+def find_similar_players(player, df=df_combined, n_clusters=20, top_n=5):
+    """
     Find similar players using KMeans clustering, limited to players in the same position
+    
+    Args:
+    player (str): The player's row key (player_keys), or a name, which takes the name's first row
+    df (DataFrame): DataFrame containing player data (default: df_combined)
+    n_clusters (int): KMeans clusters (default: 20)
+    top_n (int): Similar players returned (default: 5)
+    
+    Returns:
+    DataFrame with 'Player', 'Squad', 'position', 'position group', 'Similarity %' and 'Cluster'
+    """
+    # Look the row up by its key, so namesakes and the player's other seasons aren't mixed up
+    keys = player_keys(df).to_numpy()
+    player_data = df[keys == player].head(1)
+    if player_data.empty:
+        player_data = df[df['Player'] == player].head(1)
+    if player_data.empty:
+        print(f"Player '{player}' not found")
+        return
+    
+    player_key = player_keys(player_data).iat[0]
+    player_name = player_data['Player'].iat[0]
+    player_position = player_data['Main Position'].iloc[0]
+    player_position_group = player_data['Position Group'].iloc[0]
+    
+    # Filter for same position players
+    in_group = (df['Position Group'] == player_position_group).to_numpy()
+    position_df = df[in_group]
+    
+    # Get metrics for player's position
+    metrics = similarity_metrics_by_position[player_position_group]
+    values = [round(player_data[metric]) for metric in metrics]
+    
+    # Create list of metrics for comparison
+    #metrics = ['Aerial Ability', 'Box Defending', '1v1 Defending', 'Defensive Awareness', 'Pass Progression', 'Pass Retention', 'Ball Carrying', 'Volume of Take-ons', 'Retention from Take-ons', 'Chance Creation', 'Impact in and around box', 'Shot Volume', 'Shot Quality', 'Self-created Shots', 'Switching Play', 'Defensive Intensity']
+    
+    # Select only the metrics that exist in the dataframe
+    available_metrics = [col for col in metrics if col in position_df.columns]
+    
+    # Create similarity DataFrame with available metrics
+    df_similar = position_df[['Player', 'Squad', 'Main Position', 'Position Group'] + available_metrics].copy()
+    
+    # Handle missing values (metric columns only, the identity columns may be categoricals)
+    df_similar[available_metrics] = df_similar[available_metrics].fillna(0)
+    
+    # Store row keys, player names, teams and positions
+    player_names = df_similar['Player'].tolist()
+    player_squads = df_similar['Squad'].tolist()
+    player_position = df_similar['Main Position'].tolist()
+    player_position_group = df_similar['Position Group'].tolist()
+    
+    # Drop non-numeric columns
+    df_similar = df_similar.drop(['Player', 'Squad', 'Main Position', 'Position Group'], axis=1)
+    
+    # Scale the features
+    scaler = preprocessing.MinMaxScaler()
+    x_scaled = scaler.fit_transform(df_similar.values)
+    x_norm = pd.DataFrame(x_scaled)
+    
+    # PCA transformation
+    pca = PCA(n_components=2)
+    df3 = pd.DataFrame(pca.fit_transform(x_norm))
+    
+    # Perform clustering
+    kmeans = KMeans(n_clusters=n_clusters, random_state=42)
+    clusters = kmeans.fit_predict(df3)
+    
+    # Add player info back to DataFrame
+    df3['clusters'] = clusters
+    df3['key'] = keys[in_group]
+    df3['name'] = player_names
+    df3['squad'] = player_squads
+    df3['position'] = player_position
+    df3['position group'] = player_position_group
+    df3.columns = ['x', 'y', 'clusters', 'key', 'name', 'squad', 'position', 'position group']
+    
+    # Each player's distance to the target, relative to their largest distance to any player of
+    # the group. Only the target's column of the distance matrix is needed, besides the maxima.
+    coords = df3[['x', 'y']].to_numpy()
+    target = np.flatnonzero(df3['key'].to_numpy() == player_key)[0]
+    max_euc_dist = _max_distances(coords)
+    distances = np.hypot(*(coords - coords[target]).T)
+    similarity = np.divide((max_euc_dist - distances) * 100, max_euc_dist,
+                           out=np.zeros(len(distances)), where=max_euc_dist > 0)
+    
+    # Get similar players
+    similar_players = pd.DataFrame({
+        'key': df3['key'],
+        'Similarity %': similarity
+    })
+    
+    # Sort by similarity
+    similar_players = similar_players.sort_values('Similarity %', ascending=False, kind='stable')
+    
+    # Add name, team, cluster and position information
+    similar_players = similar_players.merge(
+        df3[['key', 'name', 'squad', 'clusters', 'position', 'position group']],
+        on='key',
+        how='left'
+    )
+    
+    # Remove the target player and get top N
+    similar_players = similar_players[similar_players['name'] != player_name].head(top_n)
+    
+    # Clean up and reorder columns
+    similar_players = similar_players.rename(columns={'name': 'Player', 'squad': 'Squad', 'clusters': 'Cluster'})
+    similar_players = similar_players[['Player', 'Squad', 'position', 'position group', 'Similarity %', 'Cluster']]
+    
+    return similar_players
+
+import matplotlib.cm as cm
+
+# One pre-built multi-panel bar figure per position group. Between players only the bar widths,
+# colours and labels are updated, so render time and memory stay flat over a long session.
+_bar_templates = process_cache('bar templates')
+
+def _build_bar_template(position_group):
+    """
+    Builds a single figure with one axes per chart type for a position group
+    
+    Args:
+    position_group (str): Position group key in chart_metrics_by_position
+    
+    Returns:
+    dict with the figure and, per chart type, its metrics, bar patches and value labels
+    """
+    charts = chart_metrics_by_position[position_group]
+    heights = [len(metrics) for metrics in charts.values()]
+    
+    # Built with the object-oriented API so pyplot never holds a reference to the figure
+    fig = Figure(figsize=(16, sum(heights) + 1.5 * len(heights)))
+    axes = np.atleast_1d(fig.subplots(len(heights), 1, gridspec_kw={'height_ratios': heights}))
+    
+    panels = {}
+    for ax, (chart_type, metrics) in zip(axes, charts.items()):
+        bars = ax.barh(metrics, [0] * len(metrics))
+        
+        # Add dashed grey gridlines
+        ax.grid(axis='x', color='grey', linestyle='--', linewidth=0.5)
+        ax.axvline(x=50, color='black', linewidth=0.8)  # Adjust linewidth as needed
+        
+        # Remove axes splines
+        for s in ['top', 'right']:
+            ax.spines[s].set_visible(False)
+        
+        # Show top values 
+        ax.invert_yaxis()
+            
+        # Remove x, y Ticks
+        ax.xaxis.set_ticks_position('none')
+        ax.yaxis.set_ticks_position('none')
+        
+        # Value labels are created once and only have their text and position updated
+        labels = [ax.text(0.2, bar.get_y()+0.5, '',
+                          fontsize = 10, fontweight ='bold',
+                          color ='grey')
+                  for bar in bars]
+            
+        # Add Plot Title
+        ax.set_title(f"{chart_type} -",
+                     loc ='left', pad = 12.0, fontsize = 24, fontweight = 'normal', color = 'black', fontname = 'Arial', style = 'normal')
+
+        # Set x-axis limits from 0 to 100
+        ax.set_xlim(0, 100)
+        
+        panels[chart_type] = (metrics, bars, labels)
+    
+    fig.tight_layout()
+    return {'fig': fig, 'panels': panels}
+
+def release_bar_templates():
+    """
+    Clears and drops every cached bar chart figure
+    """
+    for template in _bar_templates.values():
+        template['fig'].clear()
+    _bar_templates.clear()
+
+def _get_bar_template(position_group):
+    template = _bar_templates.get(position_group)
+    if template is None:
+        template = _bar_templates[position_group] = _build_bar_template(position_group)
+    return template
+
+def _update_bar_template(template, values_by_chart):
+    """
+    Writes a player's values into a bar chart template
+    
+    Args:
+    values_by_chart (dict): Chart type -> the player's values of that panel's metrics, in order
+    """
+    for chart_type, (metrics, bars, labels) in template['panels'].items():
+        values = _chart_values(values_by_chart[chart_type])
+        
+        # Normalize values to range from 0 to 100
+        normalized_values = np.clip(values, 0, 100)  # Ensure values are within 0-100
+        colors = cm.RdYlGn(normalized_values / 100)  # Normalize to [0, 1] for colormap
+        
+        # Update bars and their annotations in place
+        for bar, label, value, color in zip(bars, labels, values, colors):
+            bar.set_width(value)
+            bar.set_color(color)
+            label.set_x(value + 0.2)
+            label.set_text(str(value))
+    return template['fig']
+
+def create_player_bars(player_name, df=df_combined, save_fig=False, squad=None, show=display):
+    """
+    Creates a bar chart for a specified player based on their position group
+    
+    Args:
+    squad (str): The player's squad, to tell namesakes apart (default: None)
+    show (callable): Called with the finished figure (default: IPython's display)
+    """
+    # Get player's data and position group
+    player_data = player_row(df, player_name, squad)
+    position_group = player_data['Position Group']
+    
+    with _template_lock('bars', position_group):
+        template = _get_bar_template(position_group)
+        with trace_span('bars render'):
+            fig = _update_bar_template(template, {chart_type: player_data[metrics] for chart_type, (metrics, _, _)
+                                                  in template['panels'].items()})
+
+        # Show Plot
+        with trace_span('bars serialize'):
+            show(fig)
+
+
+##################################################################################
+################ Client-side charts from a compact percentile payload ############
+##################################################################################
+
+# Instead of rendering rasters on the server, ship the player's rounded percentiles as JSON
+# and let the browser draw them with Vega-Lite (Jupyter and Streamlit both render it natively).
+# Metric labels only depend on the position group, so they are sent once and cached client-side.
+
+def chart_labels_payload():
+    """
+    Returns the static metric labels for every position group's pizza and bar charts
+    """
+    return {
+        group: {
+            'pizza': metrics_by_position[group],
+            'bars': chart_metrics_by_position[group]
+        }
+        for group in metrics_by_position
+    }
+
+def player_chart_payload(player_name, df=df_combined, squad=None):
+    """
+    Builds the per-player chart payload: identity, position group and rounded percentiles
+    in the same order as the labels from chart_labels_payload
+    
+    Args:
+    player_name (str): Name of the player
+    df (DataFrame): DataFrame containing player data (default: df_combined)
+    squad (str): The player's squad, to tell namesakes apart (default: None)
+    
+    Returns:
+    Compact JSON string (a few hundred bytes)
+    """
+    player_data = player_row(df, player_name, squad)
+    position_group = player_data['Position Group']
+    payload = {
+        'player': player_name,
+        'squad': player_data['Squad'],
+        'season': player_data.get('Season', season),
+        'group': position_group,
+        'pizza': _chart_values(player_data[metrics_by_position[position_group]]),
+        'bars': [_chart_values(player_data[metrics])
+                 for metrics in chart_metrics_by_position[position_group].values()]
+    }
+    return json.dumps(payload, separators=(',', ':'))
+
+def pizza_vega_spec(payload, labels):
+    """
+    Vega-Lite spec for the pizza chart of a player payload
+    
+    Args:
+    payload (str or dict): Output of player_chart_payload
+    labels (dict): Output of chart_labels_payload
+    """
+    if isinstance(payload, str):
+        payload = json.loads(payload)
+    metrics = labels[payload['group']]['pizza']
+    values = [{'metric': metric, 'value': value, 'start': i, 'end': i + 1, 'mid': i + 0.5}
+              for i, (metric, value) in enumerate(zip(metrics, payload['pizza']))]
+    
+    # Slice angles are given explicitly; stacking theta does not work alongside a quantitative radius
+    theta_scale = {'domain': [0, len(metrics)]}
+    radius = {'field': 'value', 'type': 'quantitative',
+              'scale': {'type': 'linear', 'domain': [0, 100], 'range': [30, 180]}}
+    return {
+        '$schema': 'https://vega.github.io/schema/vega-lite/v5.json',
+        'title': {
+            'text': f"{payload['player']} - {payload['squad']} | {payload['group']} Template | {season_label(payload.get('season', season))} Season",
+            'subtitle': f"Percentile Rank vs Top-Five League {payload['group']}'s"
+        },
+        'width': 420,
+        'height': 420,
+        'background': '#EBEBE9',
+        'data': {'values': values},
+        'layer': [
+            {'mark': {'type': 'arc', 'stroke': '#F2F2F2', 'color': '#1A78CF', 'opacity': 0.4, 'radius': 180},
+             'encoding': {'theta': {'field': 'start', 'type': 'quantitative', 'scale': theta_scale},
+                          'theta2': {'field': 'end'}}},
+            {'mark': {'type': 'arc', 'stroke': '#F2F2F2', 'color': '#1A78CF'},
+             'encoding': {'theta': {'field': 'start', 'type': 'quantitative', 'scale': theta_scale},
+                          'theta2': {'field': 'end'},
+                          'radius': radius,
+                          'tooltip': [{'field': 'metric'}, {'field': 'value'}]}},
+            {'mark': {'type': 'text', 'radiusOffset': 10},
+             'encoding': {'theta': {'field': 'mid', 'type': 'quantitative', 'scale': theta_scale},
+                          'radius': radius,
+                          'text': {'field': 'value'}}},
+            {'mark': {'type': 'text', 'radius': 205},
+             'encoding': {'theta': {'field': 'mid', 'type': 'quantitative', 'scale': theta_scale},
+                          'text': {'field': 'metric'}}}
+        ]
+    }
+
+def bars_vega_spec(payload, labels):
+    """
+    Vega-Lite spec for the bar charts of a player payload, one row per chart type
+    
+    Args:
+    payload (str or dict): Output of player_chart_payload
+    labels (dict): Output of chart_labels_payload
+    """
+    if isinstance(payload, str):
+        payload = json.loads(payload)
+    charts = labels[payload['group']]['bars']
+    values = [{'chart': chart_type, 'metric': metric, 'value': value}
+              for (chart_type, metrics), chart_values in zip(charts.items(), payload['bars'])
+              for metric, value in zip(metrics, chart_values)]
+    x = {'field': 'value', 'type': 'quantitative', 'scale': {'domain': [0, 100]}}
+    y = {'field': 'metric', 'sort': None, 'title': None}
+    return {
+        '$schema': 'https://vega.github.io/schema/vega-lite/v5.json',
+        'data': {'values': values},
+        'facet': {'row': {'field': 'chart', 'sort': list(charts), 'title': None,
+                          'header': {'labelAngle': 0, 'labelAlign': 'left', 'labelFontSize': 16}}},
+        'resolve': {'scale': {'y': 'independent'}},
+        'spec': {
+            'width': 600,
+            'layer': [
+                {'mark': 'bar',
+                 'encoding': {'x': x, 'y': y,
+                              'color': {'field': 'value', 'type': 'quantitative', 'legend': None,
+                                        'scale': {'scheme': 'redyellowgreen', 'domain': [0, 100]}}}},
+                {'mark': {'type': 'rule', 'color': 'black'}, 'encoding': {'x': {'datum': 50}}},
+                {'mark': {'type': 'text', 'align': 'left', 'dx': 3, 'color': 'grey', 'fontWeight': 'bold'},
+                 'encoding': {'x': x, 'y': y, 'text': {'field': 'value'}}}
+            ]
+        }
+    }
+
+def display_client_charts(payload, labels):
+    """
+    Hands the Vega-Lite specs to the notebook front end, which draws them in the browser
+    """
+    with trace_span('client serialize'):
+        display({'application/vnd.vegalite.v5+json': pizza_vega_spec(payload, labels)}, raw=True)
+        display({'application/vnd.vegalite.v5+json': bars_vega_spec(payload, labels)}, raw=True)
+
+def streamlit_page_data(snapshot_id=None):
+    """
+    What the Streamlit page shows of a snapshot: its dashboard frame, each row's search label and
+    the rows in the order the player box lists them. The `streamlit` run mode caches it per
+    snapshot with st.cache_data.
+    
+    Args:
+    snapshot_id (str): Snapshot to load (default: the latest)
+    """
+    df = load_dashboard_snapshot(snapshot_id)
+    choices = search_labels(df)
+    return df, choices, sorted(range(len(df)), key=choices.__getitem__)
+
+def streamlit_player_view(df=df_combined, choices=None, order=None):
+    """
+    Streamlit page that draws the selected player's charts client-side with st.vega_lite_chart.
+    The `streamlit` run mode opens it on the latest snapshot.
+    
+    Args:
+    df (DataFrame): DataFrame containing player data (default: df_combined)
+    choices, order: df's search labels and listing order, as from streamlit_page_data
+    (default: None, built from df)
+    """
+    # Only this page needs Streamlit, so the other run modes don't depend on it
+    import streamlit as st
+    
+    labels = chart_labels_payload()
+    # A row is picked by its search label, like the ipywidgets selector does
+    if choices is None:
+        choices = search_labels(df)
+        order = sorted(range(len(df)), key=choices.__getitem__)
+    row = st.selectbox('Player:', order, format_func=choices.__getitem__)
+    if row is not None:
+        payload = player_chart_payload(df['Player'].iat[row], df.iloc[[row]])
+        st.vega_lite_chart(pizza_vega_spec(payload, labels))
+        st.vega_lite_chart(bars_vega_spec(payload, labels))
+
+# Example usage:
+# similar_players = find_similar_players("Erling Haaland")
+# display(similar_players)
+
+##################################################################################
+############################ Player search index #################################
+##################################################################################
+
+import heapq
+import unicodedata
+
+# Letters that NFKD does not decompose into a base letter plus accent
+_FOLD_TABLE = str.maketrans({'ø': 'o', 'æ': 'ae', 'œ': 'oe', 'ß': 'ss', 'ł': 'l', 'đ': 'd',
+                             'ð': 'd', 'þ': 'th', 'ı': 'i'})
+
+def fold_text(text):
+    """
+    Lower-cases a string and strips accents, e.g. 'Ødegaard' -> 'odegaard'
+    """
+    text = unicodedata.normalize('NFKD', str(text).lower().translate(_FOLD_TABLE))
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+def _trigrams(token):
+    padded = f"  {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+# Added to a 'Player (Squad)' label, in order, while it still names more than one row
+search_label_columns = ['Comp', 'Season', 'Position Group']
+
+def search_labels(df):
+    """
+    One label per row: 'Player (Squad)', with the league, season or position group added where
+    the label repeats across them, e.g. 'Player (Squad, 2023-2024)' or 'Player (Squad, GK)'
+    """
+    labels = df['Player'].astype(str) + ' (' + df['Squad'].astype(str)
+    for column in [col for col in search_label_columns if col in df.columns]:
+        values = df[column].astype(str)
+        # Only where the column tells the rows sharing a label apart
+        varies = values.groupby(labels).transform('nunique') > 1
+        labels = labels.where(~varies, labels + ', ' + values)
+    # Rows that are still identical are numbered
+    repeated = labels.duplicated(keep=False)
+    labels = labels.where(~repeated, labels + ' #' + (labels.groupby(labels).cumcount() + 1).astype(str))
+    return (labels + ')').tolist()
+
+def build_player_search_index(df=df_combined):
+    """
+    Builds an accent-folded prefix and trigram index over player, squad and position
+    
+    Args:
+    df (DataFrame): DataFrame containing player data (default: df_combined)
+    
+    Returns:
+    dict with the labels (one per row, from search_labels) and the prefix/trigram lookup tables
+    """
+    labels = search_labels(df)
+    fields = zip(df['Player'].astype(str), df['Squad'].astype(str),
+                 df['Main Position'].astype(str), df['Position Group'].astype(str))
+    
+    # Prefix hits on the player's name weigh more than hits on squad or position
+    prefixes = defaultdict(dict)
+    trigrams = defaultdict(set)
+    for row_id, (player, squad, position, group) in enumerate(fields):
+        for weight, text in ((3, player), (1, squad), (1, f"{position} {group}")):
+            for token in fold_text(text).replace('-', ' ').split():
+                for end in range(1, len(token) + 1):
+                    hits = prefixes[token[:end]]
+                    hits[row_id] = max(hits.get(row_id, 0), weight + (end == len(token)))
+                if weight == 3:
+                    for trigram in _trigrams(token):
+                        trigrams[trigram].add(row_id)
+    
+    return {'labels': labels, 'prefixes': dict(prefixes), 'trigrams': dict(trigrams)}
+
+def search_players(index, query, top_n=10):
+    """
+    Returns the top-N row labels matching a query. Every query token must
+    prefix-match a player, squad or position token; tokens with no prefix match fall back
+    to trigram similarity against player names so small typos still match.
+    
+    Args:
+    index (dict): Output of build_player_search_index
+    query (str): Text typed by the user
+    top_n (int): Number of results to return (default: 10)
+    """
+    scores = None
+    for token in fold_text(query).replace('-', ' ').split():
+        hits = index['prefixes'].get(token)
+        if hits is None:
+            # Fuzzy fallback: share of the token's trigrams found in the player's name
+            query_trigrams = _trigrams(token)
+            counts = defaultdict(int)
+            for trigram in query_trigrams:
+                for row_id in index['trigrams'].get(trigram, ()):
+                    counts[row_id] += 1
+            hits = {row_id: 2 * count / len(query_trigrams)
+                    for row_id, count in counts.items() if count / len(query_trigrams) >= 0.5}
+        if scores is None:
+            scores = hits
+        else:
+            scores = {row_id: score + hits[row_id] for row_id, score in scores.items() if row_id in hits}
+        if not scores:
+            return []
+    
+    if scores is None:
+        return []
+    labels = index['labels']
+    ranked = heapq.nsmallest(top_n, scores, key=lambda row_id: (-scores[row_id], labels[row_id]))
+    return [labels[row_id] for row_id in ranked]
+
+# Example usage:
+# search_index = build_player_search_index()
+# search_players(search_index, 'odegaard')
+
+# Only the columns the dashboard actually reads. Position Group is a partition key, so it is
+# not stored inside the Parquet files and is requested separately.
+dashboard_id_columns = ['Player', 'Squad', 'Comp', 'Age', 'Min', 'Main Position', 'PlayerID']
+
+def dashboard_columns(available):
+    """
+    The identity and metric columns the pizza, bars and similarity views read, out of `available`
+    """
+    metric_columns = set()
+    for group in metrics_by_position:
+        metric_columns.update(metrics_by_position[group])
+        metric_columns.update(similarity_metrics_by_position[group])
+        for metrics in chart_metrics_by_position[group].values():
+            metric_columns.update(metrics)
+    return [col for col in dashboard_id_columns if col in available] + sorted(metric_columns & set(available))
+
+def load_dashboard_frame(position_groups=None, season=season):
+    """
+    Loads the projected columns used by the pizza, bars and similarity views from the store
+    
+    Args:
+    position_groups (list): Position groups to load, all if None (default: None)
+    season (str): Season to load (default: season)
+    """
+    columns = dashboard_columns(pq.read_schema(next(Path(combined_store).rglob('*.parquet'))).names)
+    
+    filters = [('Season', '==', season)]
+    if position_groups is not None:
+        filters.append(('Position Group', 'in', list(position_groups)))
+    return load_combined_store(columns + ['Position Group'], filters)
+
+##################################################################################
+##################### Player trends from the snapshot store ######################
+##################################################################################
+
+# Reading every snapshot on each click would not be interactive, so the trend view is served
+# from an index precomputed after each snapshot. Player rows (one per snapshot key) are laid
+# out contiguously: the points of key k are offsets[k]:offsets[k+1], 'snapshots' gives each
+# point's snapshot and 'values' holds one float32 row per metric.
+
+trend_index_path = os.path.join(snapshot_store, 'trend_index.npz')
+
+# Composites plus the percentiles shown in the bar charts
+trend_metrics = composite_columns + sorted({
+    metric for charts in chart_metrics_by_position.values()
+    for metrics in charts.values() for metric in metrics if metric.endswith('_PR')
+})
+
+@profiled('Build trend index')
+def build_trend_index(metrics=trend_metrics, store=snapshot_store, path=trend_index_path):
+    """
+    Precomputes the time series of every snapshot key for the given metrics
+    
+    Args:
+    metrics (list): Columns to index; ones missing from the snapshots are skipped
+    (default: trend_metrics)
+    store (str): Snapshot directory (default: snapshot_store)
+    path (str): Index file (default: trend_index_path)
+    """
+    snapshot_index = load_snapshot_index(store)
+    summaries = snapshot_index['snapshots']
+    snapshots = pd.DataFrame([summaries[snapshot_id] for snapshot_id in sorted(summaries)],
+                             columns=snapshot_summary_columns)
+    positions = {snapshot_id: position for position, snapshot_id in enumerate(snapshots['Snapshot'])}
+    points = defaultdict(list)
+    by_chunk = defaultdict(set)
+    for player_points in snapshot_index['players'].values():
+        for snapshot_id, key, row_hash, chunk in sorted(player_points):
+            points[key].append((positions[snapshot_id], row_hash))
+            by_chunk[chunk].add(row_hash)
+    
+    available = set()
+    for chunk in by_chunk:
+        available.update(pq.read_schema(os.path.join(store, 'chunks', chunk)).names)
+    metrics = [metric for metric in metrics if metric in available]
+    rows = _read_rows(by_chunk, metrics, store).drop_duplicates('RowHash').set_index('RowHash')
+    
+    keys = sorted(points)
+    offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(points[key]) for key in keys])
+    point_snapshots = np.array([position for key in keys for position, _ in points[key]], dtype=np.int32)
+    point_hashes = [row_hash for key in keys for _, row_hash in points[key]]
+    values = np.ascontiguousarray(rows.loc[point_hashes, metrics].to_numpy(dtype=np.float32).T)
+    
+    np.savez(f"{path}.tmp.npz", keys=np.array(keys, dtype=str), offsets=offsets,
+             point_snapshots=point_snapshots, values=values, metrics=np.array(metrics, dtype=str),
+             snapshots=snapshots['Snapshot'].to_numpy(dtype=str),
+             created=snapshots['Created'].to_numpy(dtype=str))
+    os.replace(f"{path}.tmp.npz", path)
+
+def load_trend_index(path=trend_index_path):
+    """
+    Loads the trend index with lookups from metric name and player id to their positions
+    """
+    with np.load(path) as data:
+        index = {name: data[name] for name in data.files}
+    index['metric_index'] = {metric: i for i, metric in enumerate(index['metrics'])}
+    index['player_keys'] = defaultdict(list)
+    for position, key in enumerate(index['keys']):
+        player_id, position_group = key.split('|')[:2]
+        index['player_keys'][player_id].append((position, position_group))
+    return index
+
+_trend_index = process_cache('trend index')
+
+def get_trend_index(path=trend_index_path):
+    """
+    The loaded trend index, reloaded only when the file has been rebuilt
+    """
+    modified = os.path.getmtime(path)
+    if _trend_index.get('modified') != modified:
+        _trend_index.clear()
+        _trend_index.update(load_trend_index(path))
+        _trend_index['modified'] = modified
+    return _trend_index
+
+def player_trend(index, player_id, metrics, position_group=None):
+    """
+    Slices one player's points out of the trend index
+    
+    Args:
+    index (dict): From get_trend_index()
+    player_id (str): FBref player id (or name, for rows scraped without one)
+    metrics (list): Metrics to return; ones not in the index are skipped
+    position_group (str): Only this position group's series, all if None (default: None)
+    
+    Returns:
+    DataFrame indexed by snapshot time, one column per metric
+    """
+    metrics = [metric for metric in metrics if metric in index['metric_index']]
+    positions = [position for position, group in index['player_keys'].get(player_id, [])
+                 if position_group is None or group == position_group]
+    points = np.concatenate([np.arange(index['offsets'][position], index['offsets'][position + 1])
+                             for position in positions]) if positions else np.array([], dtype=np.int64)
+    
+    rows = index['values'][[index['metric_index'][metric] for metric in metrics]][:, points]
+    created = pd.to_datetime(index['created'][index['point_snapshots'][points]])
+    return pd.DataFrame(rows.T, index=created, columns=metrics).sort_index()
+
+def create_player_trend(player_name, df=df_combined, metrics=None, squad=None):
+    """
+    Plots how a player's composites and percentiles moved across snapshots
+    
+    Args:
+    player_name (str): Player to plot
+    df (DataFrame): DataFrame containing player data (default: df_combined)
+    metrics (list): Metrics to plot (default: the player's pizza metrics)
+    squad (str): The player's squad, to tell namesakes apart (default: None)
+    """
+    player_data = player_row(df, player_name, squad)
+    position_group = player_data['Position Group']
+    player_id = player_data.get('PlayerID')
+    if pd.isna(player_id):
+        player_id = player_name
+    
+    trend = player_trend(get_trend_index(), str(player_id),
+                         metrics or metrics_by_position[position_group], position_group)
+    
+    fig = Figure(figsize=(10, 5))
+    ax = fig.subplots()
+    for metric in trend.columns:
+        ax.plot(trend.index, trend[metric], marker='o', linewidth=1.5, label=metric)
+    ax.axhline(y=50, color='black', linewidth=0.8)
+    ax.set_ylim(0, 100)
+    for s in ['top', 'right']:
+        ax.spines[s].set_visible(False)
+    ax.set_title(f"{player_name} - trend across snapshots", loc='left', fontsize=16)
+    ax.legend(loc='upper left', bbox_to_anchor=(1, 1), frameon=False, fontsize=9)
+    fig.autofmt_xdate()
+    fig.tight_layout()
+    display(fig)
+
+if pipeline_run:
+    build_trend_index()
+
+    # Timing report for this run, next to the previous run's
+    profile_summary = report_profile_run()
+
+# Example usage:
+# create_player_trend(df_combined['Player'].iloc[0])
+
+from ipywidgets import widgets
+from IPython.display import display, HTML
+import numpy as np
+
+def create_player_selector(df=df_combined, render_mode='server'):
+    """
+    Displays the player search box with pizza, bar, similar player and trend outputs
+    
+    Args:
+    df (DataFrame): DataFrame containing player data (default: df_combined)
+    render_mode (str): 'server' renders matplotlib images, 'client' ships a JSON percentile
+    payload and lets the browser draw Vega-Lite charts (default: 'server')
+    """
+    labels = chart_labels_payload()
+    
+    # Prebuilt search index; each label names one row
+    search_index = build_player_search_index(df)
+    player_rows = {label: row for row, label in enumerate(search_index['labels'])}
+    
+    # Create the search box and the ranked results list it feeds
+    player_search = widgets.Text(
+        placeholder='Search for a player...',
+        description='Player:',
+        style={'description_width': 'initial'}
+    )
+    player_dropdown = widgets.Select(options=[], rows=10)
+    
+    def on_search(change):
+        player_dropdown.options = search_players(search_index, change['new'])
+    
+    # Create output widgets for displaying results
+    output_pizza = widgets.Output()
+    output_bar = widgets.Output()
+    output_similar = widgets.Output()
+    output_trend = widgets.Output()
+    
+    # Create a function to handle selection
+    def on_player_select(change):
+        if change['type'] == 'change' and change['name'] == 'value':
+            selected = change['new']
+            if selected in player_rows:
+                with trace_span('select'):
+                    show_player(selected)
+    
+    def show_player(selected):
+        # Clear previous outputs
+        output_pizza.clear_output()
+        output_bar.clear_output()
+        output_similar.clear_output()
+        output_trend.clear_output()
+        
+        # The selected label's row, so namesakes and other seasons of the player aren't mixed up
+        with trace_span('lookup'):
+            player_data = df.iloc[[player_rows[selected]]]
+        player_name = player_data['Player'].iat[0]
+        
+        if not player_data.empty:
+            if render_mode == 'client':
+                with trace_span('payload'):
+                    payload = player_chart_payload(player_name, player_data)
+                with output_pizza:
+                    display_client_charts(payload, labels)
+            else:
+                # Display pizza chart
+                with output_pizza:
+                    create_player_pizza(player_name, player_data)
+
+                with output_bar:
+                    create_player_bars(player_name, player_data)
+            
+            # Display similar players
+            with output_similar:
+                with trace_span('similarity'):
+                    similar = find_similar_players(player_keys(player_data).iat[0], df)
+                # Format similarity percentage to 1 decimal place
+                similar['Similarity %'] = similar['Similarity %'].apply(lambda x: np.round(x, 1))
+                display(HTML(f"<h3>Similar Players to {player_name}</h3>"))
+                display(similar)
+            
+            # Display the player's trend across snapshots
+            if os.path.exists(trend_index_path):
+                with output_trend, trace_span('trend'):
+                    create_player_trend(player_name, player_data)
+    
+    # Attach the handlers to the search box and the results list
+    player_search.observe(on_search, names='value')
+    player_dropdown.observe(on_player_select)
+    
+    # Create layout
+    display(widgets.VBox([
+        player_search,
+        player_dropdown,
+        widgets.HBox([
+            output_pizza,
+            output_bar,
+            output_similar
+        ]),
+        output_trend
+    ]))
+
+# The ipywidgets selector is only for the notebook; the other modes have no notebook to show it in
+if interactive_run:
+    # Use the selector
+    create_player_selector()
+
+# Latency per interaction step; scrape http://127.0.0.1:8765/metrics or print latency_summary().
+# Only the notebook and the server take interactions to measure.
+if interactive_run or (serve_run and main_process):
+    start_metrics_server()
+
+# Or start from the columnar store, which only reads what the dashboard needs
+# create_player_selector(load_dashboard_frame())
+##################################################################################
+############################ Multi-user serving mode #############################
+##################################################################################
+
+# `python "Streamlit Player Dashboard.py" serve` serves the dashboard over HTTP to several scouts at
+# once. The processed frame, its feature matrix and compiled metric registry, the search index,
+# chart labels and similarity models are loaded once per process into a read-only state that every
+# request shares; a session only holds its current selection and comparison pool. Charts and
+# payloads gather a player's values by the registry's offsets. Chart templates are shared as well
+# and rendered under their lock (_template_lock).
+#
+#   GET /search?q=odeg             ranked row labels (see search_labels)
+#   GET /select?player=<label>     makes it the session's player and returns its chart payload
+#   GET /pizza.png, /bars.png      the session's player charts
+#   GET /similar                   the session's similar players
+#   GET /version                   the snapshot being served, and any stale scraped tables
+#   GET /pool?min_share=0.4&under_age=23&league=<Comp>
+#                                  sets the session's comparison pool; without parameters, resets it
+#
+# Charts and similar players take ?player=<label> to skip the session. With a comparison pool set,
+# payloads and charts show percentiles against that pool instead of the pipeline's cohort. `serve --load-test` runs
+# run_load_test against the server instead of serving until interrupted.
+#
+# The served data is a snapshot from the snapshot store. While serving, a background thread
+# rebuilds the dataset every refresh_interval seconds in a separate `build` process, so requests
+# never wait on FBref. Only when that process succeeds is its new snapshot loaded, off to the side,
+# and swapped in whole with its similarity models. A request keeps the state it started with, so
+# nobody sees a half-built table or a mix of two versions.
+
+import subprocess
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.cookiejar import CookieJar
+from urllib.parse import parse_qs, quote, urlparse
+from urllib.request import HTTPCookieProcessor, build_opener
+
+serve_port = 8501
+
+# Sessions beyond this many are dropped, least recently used first
+max_sessions = 10000
+
+# Seconds between background rebuilds while serving, and the longest a rebuild may take
+refresh_interval = 6 * 60 * 60
+refresh_timeout = 2 * 60 * 60
+
+# Comparison pools kept sorted per served snapshot, least recently used dropped first
+comparison_pool_cache_size = 32
+
+def build_similarity_models(df, features, registry, n_clusters=20):
+    """
+    Fits the scaling, PCA and KMeans steps of find_similar_players once per position group
+    
+    Args:
+    df (DataFrame): Player table with 'Position Group'
+    features (array): df's feature matrix, with registry['columns']
+    registry (mapping): Output of compile_metric_registry
+    n_clusters (int): KMeans clusters, capped at the group's size (default: 20)
+    
+    Returns:
+    dict of position group -> read-only mapping of arrays: the group's row positions in df, their
+    2-D coordinates, clusters and each player's largest distance to any player of the group
+    """
+    models = {}
+    groups = df['Position Group'].astype(str).to_numpy()
+    for position_group in similarity_metrics_by_position:
+        if position_group not in registry:
+            continue
+        rows = np.flatnonzero(groups == position_group)
+        offsets = registry[position_group]['similarity']
+        if len(rows) < 2 or not len(offsets):
+            continue
+        
+        x_scaled = preprocessing.MinMaxScaler().fit_transform(np.nan_to_num(features[np.ix_(rows, offsets)].astype(float)))
+        coords = PCA(n_components=2).fit_transform(x_scaled)
+        clusters = KMeans(n_clusters=min(n_clusters, len(rows)), random_state=42).fit_predict(coords)
+        model = {'rows': rows, 'coords': coords, 'clusters': clusters, 'max_dist': _max_distances(coords)}
+        for array in model.values():
+            array.setflags(write=False)
+        models[position_group] = MappingProxyType(model)
+    return models
+
+def serve_similar_players(state, row, top_n=5):
+    """
+    find_similar_players for one row of the served frame, from the precomputed models
+    
+    Returns:
+    DataFrame with 'Player', 'Squad', 'position', 'position group', 'Similarity %' and 'Cluster'
+    """
+    df = state['df']
+    position_group = str(df['Position Group'].iat[row])
+    model = state['similarity'][position_group]
+    target = np.searchsorted(model['rows'], row)
+    
+    # Same similarity as find_similar_players: distance relative to each player's largest distance
+    distances = np.hypot(*(model['coords'] - model['coords'][target]).T)
+    similarity = np.divide((model['max_dist'] - distances) * 100, model['max_dist'],
+                           out=np.zeros(len(distances)), where=model['max_dist'] > 0)
+    names = df['Player'].to_numpy()[model['rows']]
+    similarity[names == df['Player'].iat[row]] = -np.inf
+    best = np.argsort(-similarity, kind='stable')[:top_n]
+    best = best[np.isfinite(similarity[best])]
+    
+    rows = model['rows'][best]
+    return pd.DataFrame({
+        'Player': df['Player'].to_numpy()[rows],
+        'Squad': df['Squad'].to_numpy()[rows],
+        'position': df['Main Position'].to_numpy()[rows],
+        'position group': position_group,
+        'Similarity %': np.round(similarity[best], 1),
+        'Cluster': model['clusters'][best]
+    })
+
+# Comparison pools rank a player against a different pool than the pipeline's cohort: a stricter
+# minutes share, under-23s only or one league. Like the stored percentiles, a pool never reaches past
+# the player's percentile_pool (by default their competition and season), so a pool without
+# filters ranks against the same players as the stored percentiles. The raw metrics behind the served percentiles are held
+# as one matrix; a pool's rows are sorted once per metric, and memoized, so each percentile is then
+# two binary searches. Composites are re-averaged from the pool's percentiles.
+
+def comparison_columns(available):
+    """
+    The columns comparison pools need, out of `available`: the percentiles the dashboard and the
+    composites read, their raw metrics, 'TeamMins' and the percentile_pool columns
+    """
+    percentile_columns = {col for col in dashboard_columns(available) if col.endswith('_PR')}
+    for components in composite_metrics.values():
+        percentile_columns.update(components)
+    percentile_columns = sorted(col for col in percentile_columns if col in available and col[:-3] in available)
+    return (percentile_columns + [col[:-3] for col in percentile_columns]
+            + [col for col in ['TeamMins'] + percentile_pool_columns[percentile_pool] if col in available])
+
+def build_comparison_data(df):
+    """
+    Collects the raw metrics behind the served percentiles and what pools filter on
+    
+    Args:
+    df (DataFrame): Served frame with the comparison_columns
+    
+    Returns:
+    Read-only mapping of 'metrics' (percentile columns), 'values' (raw metric per row and metric),
+    'group', 'cohort' (percentile_pool code), 'share' (of the team's minutes), 'age' and 'league'
+    arrays, and 'pool', this data's memoized comparison_pool
+    """
+    metrics = [col for col in df.columns if col.endswith('_PR') and col[:-3] in df.columns]
+    # Lower-is-better metrics are negated, so they rank in reverse as in create_percentile_rankings
+    signs = np.array([-1.0 if col[:-3] in lower_is_better_metrics else 1.0 for col in metrics])
+    cohort_columns = [col for col in percentile_pool_columns[percentile_pool] if col in df.columns]
+    cohorts = (df[cohort_columns].astype(str).groupby(cohort_columns, sort=False).ngroup().to_numpy()
+               if cohort_columns else np.zeros(len(df), dtype=np.int64))
+    data = {
+        'metrics': metrics,
+        'values': df[[col[:-3] for col in metrics]].to_numpy(dtype=float) * signs,
+        'group': df['Position Group'].astype(str).to_numpy(),
+        'cohort': cohorts,
+        'share': df['Min'].to_numpy(dtype=float) / df['TeamMins'].to_numpy(dtype=float),
+        'age': pd.to_numeric(df['Age'].astype(str).str.split('-').str[0], errors='coerce').to_numpy(dtype=float),
+        'league': df['Comp'].astype(str).to_numpy()
+    }
+    for array in data.values():
+        if isinstance(array, np.ndarray):
+            array.setflags(write=False)
+    data['pool'] = lru_cache(maxsize=comparison_pool_cache_size)(lambda *pool: comparison_pool(data, *pool))
+    return MappingProxyType(data)
+
+def comparison_pool(data, position_group, cohort, min_share, under_age, league):
+    """
+    Sorts each metric's values over one pool; missing values sort to the end
+    
+    Args:
+    data (mapping): Output of build_comparison_data
+    position_group (str): Position group of the pool
+    cohort (int): percentile_pool code of the pool, as in data['cohort']
+    min_share (float): Minimum share of the team's minutes
+    under_age (int): Only players younger than this, or None for any age
+    league (str): Only players of this 'Comp', or None for every league
+    
+    Returns:
+    (rows, sorted values, non-missing count per metric)
     """
-    # Get player's position
-    player_data = df[df['Player'] == player_name]
-    if player_data.empty:
-        print(f"Player '{player_name}' not found")
-        return
+    pool = (data['group'] == position_group) & (data['cohort'] == cohort) & (data['share'] >= min_share)
+    if under_age is not None:
+        pool &= data['age'] < under_age
+    if league is not None:
+        pool &= data['league'] == league
+    ranked = np.sort(data['values'][pool], axis=0)
+    counts = (~np.isnan(ranked)).sum(axis=0)
+    return np.flatnonzero(pool), ranked, counts
+
+def comparison_percentiles(data, row, min_share=cohort_min_share, under_age=None, league=None):
+    """
+    Percentiles of one row of the served frame against a comparison pool of its position group
+    within its percentile_pool, ranked the way create_percentile_rankings ranks (average rank of ties)
     
-    player_position = player_data['Main Position'].iloc[0]
-    player_position_group = player_data['Position Group'].iloc[0]
+    Args:
+    data (mapping): Output of build_comparison_data
+    row (int): Row of the served frame
+    min_share (float): Minimum share of the team's minutes (default: cohort_min_share)
+    under_age (int): Only players younger than this (default: None, any age)
+    league (str): Only players of this 'Comp' (default: None, every league of the percentile_pool)
     
-    # Filter for same position players
-    position_df = df[df['Position Group'] == player_position_group]
-    
-    # Define metrics for each position group (same as radar chart)
-    metrics_by_position = {
-        'FB': [
-            'Aerial Ability', 'Defensive Awareness', 'Defensive Intensity', '1v1 Defending', 
-            'Pass Progression', 'Pass Retention', 'Ball Carrying',
-            'Volume of Take-ons', 'Chance Creation', 'Impact in and around box'
-        ],
-        'CB': [
-            'Aerial Ability', 'Box Defending', 'Defensive Awareness', '1v1 Defending',
-            'Defensive Intensity', 'Pass Progression', 'Pass Retention',
-            'Switching Play', 'Ball Carrying', 'Shot Volume'
-        ],
-        'DM': [
-            'Aerial Ability', 'Defensive Awareness', 'Defensive Intensity', '1v1 Defending',
-            'Pass Progression', 'Pass Retention', 'Switching Play', 'Volume of Take-ons',
-            'Retention from Take-ons', 'Shot Volume'
-        ],
-        'CM': [
-            'Defensive Awareness', 'Defensive Intensity', 'Pass Progression', 'Pass Retention',
-            'Ball Carrying', 'Volume of Take-ons', 'Retention from Take-ons',
-            'Chance Creation', 'Impact in and around box', 'Shot Volume'
-        ],
-        'AM': [
-            'Defensive Intensity', 'Pass Progression', 'Pass Retention',
-            'Volume of Take-ons', 'Retention from Take-ons', 'Chance Creation', 'Impact in and around box',
-            'Shot Volume', 'Shot Quality', 'Self-created Shots'
-        ],
-        'W': [
-            'Defensive Intensity', 'Pass Retention',
-            'Ball Carrying', 'Volume of Take-ons', 'Retention from Take-ons',
-            'Chance Creation', 'Impact in and around box',
-            'Shot Volume', 'Shot Quality', 'Self-created Shots'
-        ],
-        'ST': [
-            'Aerial Ability', 'Defensive Intensity',
-            'Pass Retention', 'Ball Carrying', 'Volume of Take-ons',
-            'Chance Creation', 'Impact in and around box',
-            'Shot Volume', 'Shot Quality', 'Self-created Shots'
-        ]
+    Returns:
+    Series of percentiles by percentile column; the pool's size is in .attrs['Pool size']
+    """
+    rows, ranked, counts = data['pool'](data['group'][row], int(data['cohort'][row]), float(min_share), under_age, league)
+    # A player outside the pool is placed among it without counting themself
+    position = np.searchsorted(rows, row)
+    in_pool = int(position < len(rows) and rows[position] == row)
+    
+    percentiles = np.full(len(data['metrics']), np.nan)
+    for metric, value in enumerate(data['values'][row]):
+        if np.isnan(value) or counts[metric] == 0:
+            continue
+        values = ranked[:counts[metric], metric]
+        below = np.searchsorted(values, value, side='left')
+        up_to = np.searchsorted(values, value, side='right')
+        percentiles[metric] = (below + up_to + in_pool) / 2 / counts[metric] * 100
+    percentiles = pd.Series(np.round(percentiles, 1), index=data['metrics'])
+    percentiles.attrs['Pool size'] = len(rows)
+    return percentiles
+
+def player_features(state, row, pool=None):
+    """
+    A row of the served feature matrix, with its percentiles and composites against a comparison
+    pool when one is given
+    
+    Args:
+    state (mapping): Serving state
+    row (int): Row of the served frame
+    pool (dict): comparison_percentiles keyword arguments, or None for the pipeline's percentiles
+    
+    Returns:
+    Array over state['registry']['columns']
+    """
+    if not pool:
+        return state['features'][row]
+    values = state['features'][row].astype(float)
+    percentiles = comparison_percentiles(state['comparison'], row, **pool)
+    values[state['pooled']] = percentiles.to_numpy()[state['pooled_from']]
+    for composite, components in state['registry']['composites']:
+        values[composite] = values[components].mean()
+    return values
+
+# Example usage: a player against under-23s with at least 40% of their team's minutes
+# state = get_serving_state()
+# player_features(state, state['rows']['Bukayo Saka (Arsenal)'], {'min_share': 0.4, 'under_age': 23})
+
+def load_dashboard_snapshot(snapshot_id=None, season=season, store=snapshot_store, comparison=False):
+    """
+    load_dashboard_frame for a snapshot: the dashboard columns of one season
+    
+    Args:
+    snapshot_id (str): Snapshot to load (default: the latest)
+    season (str): Season to load (default: season)
+    store (str): Snapshot directory (default: snapshot_store)
+    comparison (bool): Also load the comparison_columns (default: False)
+    """
+    if snapshot_id is None:
+        snapshot_id = list_snapshots(store)['Snapshot'].iloc[-1]
+    chunks = {chunk for _, chunk in _load_manifest(snapshot_id, store)['rows'].values()}
+    available = set.intersection(*[set(pq.read_schema(os.path.join(store, 'chunks', chunk)).names)
+                                   for chunk in chunks])
+    columns = dashboard_columns(available) + [col for col in ['Position Group', 'Season'] if col in available]
+    if comparison:
+        columns += [col for col in comparison_columns(available) if col not in columns]
+    df = load_snapshot(snapshot_id, columns, store)
+    if 'Season' in df.columns:
+        df = df[df['Season'] == season]
+    return df
+
+def load_serving_state(snapshot_id=None):
+    """
+    Loads everything requests read into one read-only mapping
+    
+    Args:
+    snapshot_id (str): Snapshot to serve (default: the latest)
+    """
+    if snapshot_id is None:
+        snapshot_id = list_snapshots()['Snapshot'].iloc[-1]
+    df = load_dashboard_snapshot(snapshot_id, comparison=True).reset_index(drop=True)
+    search_index = build_player_search_index(df)
+    registry = compile_metric_registry([col for col in feature_columns if col in df.columns])
+    features = df[list(registry['columns'])].to_numpy(dtype=np.float32)
+    features.setflags(write=False)
+    comparison = build_comparison_data(df)
+    # Where comparison percentiles go in a feature row, and which of them do
+    pooled = [(i, registry['columns'].index(metric)) for i, metric in enumerate(comparison['metrics'])
+              if metric in registry['columns']]
+    return MappingProxyType({
+        'snapshot': snapshot_id,
+        'df': df,
+        'search': search_index,
+        'rows': MappingProxyType({label: row for row, label in enumerate(search_index['labels'])}),
+        'labels': chart_labels_payload(),
+        'registry': registry,
+        'features': features,
+        'similarity': MappingProxyType(build_similarity_models(df, features, registry)),
+        'comparison': comparison,
+        'pooled_from': np.array([i for i, _ in pooled], dtype=np.intp),
+        'pooled': np.array([offset for _, offset in pooled], dtype=np.intp),
+        'loaded': datetime.now().isoformat(timespec='seconds')
+    })
+
+_serving_state = process_cache('serving state')
+_serving_state_lock = process_cache('serving state lock', threading.Lock)
+
+def get_serving_state():
+    """
+    The process's serving state, loaded on first use
+    """
+    with _serving_state_lock:
+        if 'state' not in _serving_state:
+            _serving_state['state'] = load_serving_state()
+        return _serving_state['state']
+
+def render_chart_png(state, row, kind, pool=None):
+    """
+    Renders a player's 'pizza' or 'bars' chart to PNG bytes; safe to call from concurrent sessions
+    
+    Args:
+    pool (dict): Comparison pool, as for player_features (default: None)
+    """
+    df = state['df']
+    position_group = str(df['Position Group'].iat[row])
+    compiled = state['registry'][position_group]
+    values = player_features(state, row, pool)
+    buffer = BytesIO()
+    with _template_lock(kind, position_group):
+        with trace_span(f'{kind} render'):
+            if kind == 'pizza':
+                fig = _update_pizza_template(_get_pizza_template(position_group), values[compiled['pizza']],
+                                             df['Player'].iat[row], df['Squad'].iat[row], position_group,
+                                             df['Season'].iat[row] if 'Season' in df.columns else season)
+            else:
+                fig = _update_bar_template(_get_bar_template(position_group),
+                                           {chart: values[offsets] for chart, offsets in compiled['bars'].items()})
+        with trace_span(f'{kind} serialize'):
+            fig.savefig(buffer, format='png')
+    return buffer.getvalue()
+
+def serve_chart_payload(state, row, pool=None):
+    """
+    player_chart_payload for one row of the served frame, gathered from its feature row
+    
+    Args:
+    pool (dict): Comparison pool, as for player_features (default: None)
+    """
+    df = state['df']
+    position_group = str(df['Position Group'].iat[row])
+    compiled = state['registry'][position_group]
+    values = player_features(state, row, pool)
+    payload = {
+        'player': df['Player'].iat[row],
+        'squad': df['Squad'].iat[row],
+        'season': df['Season'].iat[row] if 'Season' in df.columns else season,
+        'group': position_group,
+        'pizza': _chart_values(values[compiled['pizza']]),
+        'bars': [_chart_values(values[offsets]) for offsets in compiled['bars'].values()]
     }
+    return json.dumps(payload, separators=(',', ':'), default=str)
+
+_sessions = OrderedDict()
+_sessions_lock = threading.Lock()
+
+def _session(session_id):
+    # A session's state is its selection; unknown ids start a new session
+    with _sessions_lock:
+        if session_id not in _sessions:
+            _sessions[session_id] = {'selected': None, 'pool': None}
+            if len(_sessions) > max_sessions:
+                _sessions.popitem(last=False)
+        _sessions.move_to_end(session_id)
+        return _sessions[session_id]
+
+class _DashboardHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        try:
+            self._route()
+        except Exception as e:
+            self.send_error(500, f"{type(e).__name__}: {e}")
     
-    # Get metrics for player's position
-    metrics = metrics_by_position[player_position_group]
-    values = [round(player_data[metric]) for metric in metrics]
+    def _route(self):
+        url = urlparse(self.path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        state = get_serving_state()
+        
+        cookies = dict(cookie.strip().split('=', 1) for cookie in self.headers.get('Cookie', '').split(';') if '=' in cookie)
+        session_id = cookies.get('session') or uuid.uuid4().hex
+        session = _session(session_id)
+        
+        if url.path == '/search':
+            self._send(json.dumps(search_players(state['search'], query.get('q', ''))), 'application/json', session_id)
+            return
+        if url.path == '/version':
+            stale = {f"{competition} {season}": [table for kind in ('Scrape', 'Keeper Scrape')
+                                                 for table in scrape_status(competition, season, kind).query('stale == True').index]
+                     for competition, season in jobs}
+            version = {'snapshot': state['snapshot'], 'loaded': state['loaded'], 'rows': len(state['df']),
+                       'stale tables': {job: tables for job, tables in stale.items() if tables}}
+            self._send(json.dumps(version), 'application/json', session_id)
+            return
+        if url.path == '/pool':
+            pool = {}
+            if query.get('min_share'):
+                pool['min_share'] = float(query['min_share'])
+            if query.get('under_age'):
+                pool['under_age'] = int(query['under_age'])
+            if query.get('league'):
+                pool['league'] = query['league']
+            session['pool'] = pool or None
+            self._send(json.dumps({'pool': session['pool']}), 'application/json', session_id)
+            return
+        if url.path not in ('/select', '/pizza.png', '/bars.png', '/similar'):
+            self.send_error(404)
+            return
+        
+        label = query.get('player') or session['selected']
+        row = state['rows'].get(label)
+        if row is None:
+            self.send_error(404, 'Unknown player')
+            return
+        if url.path == '/select':
+            session['selected'] = label
+            with trace_span('payload'):
+                payload = serve_chart_payload(state, row, session['pool'])
+            self._send(payload, 'application/json', session_id)
+        elif url.path == '/similar':
+            with trace_span('similarity'):
+                similar = serve_similar_players(state, row)
+            body = json.dumps({'player': label, 'similar': similar.to_dict(orient='records')}, default=str)
+            self._send(body, 'application/json', session_id)
+        else:
+            self._send(render_chart_png(state, row, url.path[1:-4], session['pool']), 'image/png', session_id)
     
-    # Create list of metrics for comparison
-    #metrics = ['Aerial Ability', 'Box Defending', '1v1 Defending', 'Defensive Awareness', 'Pass Progression', 'Pass Retention', 'Ball Carrying', 'Volume of Take-ons', 'Retention from Take-ons', 'Chance Creation', 'Impact in and around box', 'Shot Volume', 'Shot Quality', 'Self-created Shots', 'Switching Play', 'Defensive Intensity']
+    def _send(self, body, content_type, session_id):
+        body = body.encode() if isinstance(body, str) else body
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Set-Cookie', f'session={session_id}; Path=/; HttpOnly')
+        self.end_headers()
+        self.wfile.write(body)
     
-    # Select only the metrics that exist in the dataframe
-    available_metrics = [col for col in metrics if col in position_df.columns]
+    def log_message(self, format, *args):
+        pass
+
+_dashboard_server = {}
+
+def start_dashboard_server(port=serve_port):
+    """
+    Loads the serving state and serves the dashboard on http://127.0.0.1:<port>/ from a
+    background thread, one thread per request. Calling it again returns the running server.
+    """
+    if 'server' not in _dashboard_server:
+        get_serving_state()
+        server = ThreadingHTTPServer(('127.0.0.1', port), _DashboardHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        _dashboard_server['server'] = server
+    return _dashboard_server['server']
+
+def run_load_test(url=f"http://127.0.0.1:{serve_port}", users=8, interactions=20, seed=0):
+    """
+    Simulates scouts using the server at once. Each user keeps their own session and, for random
+    players, searches, selects, loads both charts and the similar players. A similar players
+    response for anyone but the session's own selection counts as an error.
     
-    # Create similarity DataFrame with available metrics
-    df_similar = position_df[['Player', 'Main Position', 'Position Group'] + available_metrics].copy()
+    Args:
+    url (str): Server address (default: the local server on serve_port)
+    users (int): Concurrent users (default: 8)
+    interactions (int): Players each user looks at (default: 20)
+    seed (int): Random seed for the players picked (default: 0)
     
-    # Handle missing values
-    df_similar = df_similar.fillna(0)
+    Returns:
+    DataFrame per endpoint with 'Requests', 'Errors', 'p50 ms', 'p95 ms' and 'Max ms'; the
+    overall throughput is in .attrs['Requests/s']
+    """
+    labels = get_serving_state()['search']['labels']
+    picks = np.random.default_rng(seed).choice(len(labels), (users, interactions))
+    results = []
+    results_lock = threading.Lock()
     
-    # Store player names and positions
-    player_names = df_similar['Player'].tolist()
-    player_position = df_similar['Main Position'].tolist()
-    player_position_group = df_similar['Position Group'].tolist()
+    def user(picked):
+        opener = build_opener(HTTPCookieProcessor(CookieJar()))
+        for row in picked:
+            label = labels[row]
+            for endpoint, path in [('search', f"/search?q={quote(label[:4])}"),
+                                   ('select', f"/select?player={quote(label)}"),
+                                   ('pizza', '/pizza.png'), ('bars', '/bars.png'), ('similar', '/similar')]:
+                start = time.perf_counter()
+                try:
+                    with opener.open(url + path, timeout=60) as response:
+                        body = response.read()
+                    ok = endpoint != 'similar' or json.loads(body)['player'] == label
+                except Exception:
+                    ok = False
+                with results_lock:
+                    results.append((endpoint, (time.perf_counter() - start) * 1000, ok))
     
-    # Drop non-numeric columns
-    df_similar = df_similar.drop(['Player', 'Main Position', 'Position Group'], axis=1)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as pool:
+        list(pool.map(user, picks))
+    elapsed = time.perf_counter() - start
     
-    # Scale the features
-    scaler = preprocessing.MinMaxScaler()
-    x_scaled = scaler.fit_transform(df_similar.values)
-    x_norm = pd.DataFrame(x_scaled)
+    results = pd.DataFrame(results, columns=['Endpoint', 'ms', 'OK'])
+    summary = results.groupby('Endpoint', sort=False).agg(
+        **{'Requests': ('ms', 'size'), 'Errors': ('OK', lambda ok: int((~ok).sum())),
+           'p50 ms': ('ms', 'median'), 'p95 ms': ('ms', lambda ms: np.percentile(ms, 95)),
+           'Max ms': ('ms', 'max')}).round(1)
+    summary.attrs['Requests/s'] = round(len(results) / elapsed, 1)
+    print(f"{len(results)} requests from {users} users in {elapsed:.1f}s: {summary.attrs['Requests/s']} requests/s")
+    return summary
+
+_refresh_lock = threading.Lock()
+
+def refresh_dataset(timeout=refresh_timeout):
+    """
+    Builds the next dataset version in a separate `build` process and, if it succeeds, swaps it
+    in for the served one. Does nothing if a refresh is already running.
     
-    # PCA transformation
-    pca = PCA(n_components=2)
-    df3 = pd.DataFrame(pca.fit_transform(x_norm))
+    Args:
+    timeout (int): Seconds before the build is abandoned (default: refresh_timeout)
     
-    # Perform clustering
-    kmeans = KMeans(n_clusters=n_clusters, random_state=42)
-    clusters = kmeans.fit_predict(df3)
+    Returns:
+    The snapshot now served, or None when the build failed and the old one is kept
+    """
+    if not _refresh_lock.acquire(blocking=False):
+        return None
+    try:
+        # The script is run from the folder it lives in, like a normal run
+        command = [sys.executable, os.path.join(os.getcwd(), 'Streamlit Player Dashboard.py'), 'build']
+        if synthetic_players:
+            command += ['--synthetic', str(synthetic_players)]
+        with open(f"{root}Refresh.log", 'a') as log:
+            log.write(f"\n=== Refresh {datetime.now().isoformat(timespec='seconds')} ===\n")
+            log.flush()
+            try:
+                result = subprocess.run(command, cwd=os.getcwd(), stdout=log, stderr=subprocess.STDOUT, timeout=timeout)
+                succeeded = result.returncode == 0
+            except subprocess.TimeoutExpired:
+                succeeded = False
+        if not succeeded:
+            print(f"Refresh failed, still serving {get_serving_state()['snapshot']}; see {root}Refresh.log")
+            return None
+        
+        # Loaded before the swap, so requests carry on against the old state meanwhile
+        state = load_serving_state()
+        with _serving_state_lock:
+            _serving_state['state'] = state
+        print(f"Serving snapshot {state['snapshot']}")
+        return state['snapshot']
+    finally:
+        _refresh_lock.release()
+
+_refresher = {}
+
+def start_background_refresh(interval=refresh_interval):
+    """
+    Calls refresh_dataset every `interval` seconds from a background thread. Calling it again
+    returns the running thread's stop event.
+    """
+    if 'stop' not in _refresher:
+        stop = threading.Event()
+        def refresh_loop():
+            while not stop.wait(interval):
+                refresh_dataset()
+        threading.Thread(target=refresh_loop, daemon=True).start()
+        _refresher['stop'] = stop
+    return _refresher['stop']
+
+if streamlit_run and main_process:
+    # Keyed by the latest snapshot id, so a re-run only reads the snapshot index and a new
+    # snapshot is picked up on the next interaction
+    streamlit_page_data = st.cache_data(show_spinner=False)(streamlit_page_data)
+    streamlit_player_view(*streamlit_page_data(list_snapshots()['Snapshot'].iloc[-1]))
+
+if serve_run and main_process:
+    start_dashboard_server()
+    if '--load-test' in sys.argv:
+        print(run_load_test().to_string())
+        print(latency_summary().to_string())
+    else:
+        start_background_refresh()
+        print(f"Serving the dashboard on http://127.0.0.1:{serve_port}/")
+        threading.Event().wait()
+
+##################################################################################
+############################## Shortlist exports #################################
+##################################################################################
+
+# Analysts export shortlists instead of copying numbers out of the widgets. export_shortlist reads the
+# combined store in batches, with the position, league, season, age and minutes filters pushed down
+# to the Parquet files, and writes each batch as it comes, so a multi-season export only ever holds
+# one batch and the similarity models of the (season, position group) pools it has met. The top-k
+# similar players come from the same models and similarity as the served dashboard, fitted on the
+# player's season and position group across competitions. An export run builds nothing itself: it
+# reads the store the last build wrote. XLSX output needs openpyxl.
+#
+#   python "Streamlit Player Dashboard.py" export --output "CB Shortlist.xlsx" --positions CB \
+#       --max-age 23 --min-minutes 900 --columns per90 percentiles --top-k 5
+
+import argparse
+import pyarrow as pa
+import pyarrow.dataset as pads
+
+# Rows per batch read from the store and written out
+export_chunk_rows = 50000
+
+# Identity columns every export starts with
+export_id_columns = ['Player', 'Squad', 'Comp', 'Competition', 'Season', 'Position Group', 'Main Position',
+                     'Age', 'Min', 'PlayerID']
+
+# Bookkeeping columns of the final table that aren't exported as raw stats
+export_internal_columns = ['Fingerprint', 'PlayerFBref', 'UrlFBref', 'UrlTmarkt']
+
+# File formats by extension
+export_formats = {'.parquet': 'parquet', '.csv': 'csv', '.xlsx': 'xlsx'}
+
+# Rows per XLSX sheet, the header included; Excel stops at 1,048,576
+xlsx_sheet_rows = 1048576
+
+def export_columns(available, selection=None):
+    """
+    Resolves a column selection against the store's columns
     
-    # Add player info back to DataFrame
-    df3['clusters'] = clusters
-    df3['name'] = player_names
-    df3['position'] = player_position
-    df3['position group'] = player_position_group
-    df3.columns = ['x', 'y', 'clusters', 'name', 'position', 'position group']
+    Args:
+    available (list): Columns of the combined store
+    selection (list): Column sets ('raw', 'per90', 'percentiles', 'composites') and/or column
+    names, all four sets if None (default: None)
+    
+    Returns:
+    Columns to export, the identity columns first
+    """
+    composites = [col for col in composite_metrics if col in available]
+    column_sets = {
+        'percentiles': [col for col in available if col.endswith('_PR')],
+        'composites': composites,
+        'per90': [col for col in available if col.endswith('Per90')],
+    }
+    taken = set(export_id_columns) | set(export_internal_columns) | set(composites)
+    taken.update(*column_sets.values())
+    column_sets['raw'] = [col for col in available if col not in taken]
+    
+    columns = [col for col in export_id_columns if col in available]
+    unknown = []
+    for item in selection or ['raw', 'per90', 'percentiles', 'composites']:
+        if item in column_sets:
+            columns += column_sets[item]
+        elif item in available:
+            columns.append(item)
+        else:
+            unknown.append(item)
+    if unknown:
+        raise ValueError(f"Unknown export columns: {', '.join(unknown)}. Use column names or one of {', '.join(column_sets)}")
+    return list(dict.fromkeys(columns))
+
+def export_filter(positions=None, leagues=None, seasons=None, min_age=None, max_age=None, min_minutes=None):
+    """
+    Builds the pyarrow filter of a shortlist; every argument left as None doesn't filter
     
-    # Create distance matrix
-    dist_matrix = pd.DataFrame(index=df3['name'], columns=df3['name'])
+    Args:
+    positions (list): Position groups, e.g. ['CB', 'FB']
+    leagues (list): Leagues as in 'Comp', e.g. ['eng Premier League']
+    seasons (list): Seasons, e.g. ['2024-2025']
+    min_age, max_age (int): Age bounds, inclusive
+    min_minutes (int): Minimum minutes played
+    """
+    conditions = []
+    for column, values in [('Position Group', positions), ('Comp', leagues), ('Season', seasons)]:
+        if values:
+            conditions.append(pads.field(column).isin(list(values)))
+    if min_age is not None:
+        conditions.append(pads.field('Age') >= min_age)
+    if max_age is not None:
+        conditions.append(pads.field('Age') <= max_age)
+    if min_minutes is not None:
+        conditions.append(pads.field('Min') >= min_minutes)
+    expression = None
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+def _similarity_pool(dataset, season, position_group):
+    # Similarity model of one season and position group, over every competition in the store
+    metrics = [col for col in similarity_metrics_by_position.get(position_group, []) if col in dataset.schema.names]
+    pool = dataset.to_table(columns=['Player', 'Squad', 'Fingerprint'] + metrics,
+                            filter=(pads.field('Season') == season) & (pads.field('Position Group') == position_group)).to_pandas()
+    pool = pool.drop_duplicates('Fingerprint').reset_index(drop=True)
+    pool['Position Group'] = position_group
+    features = pool[metrics].to_numpy(dtype=np.float32)
+    model = build_similarity_models(pool, features, {position_group: {'similarity': np.arange(len(metrics))}}).get(position_group)
+    if model is None:
+        return None
+    return {
+        'model': model,
+        'fingerprints': pd.Index(pool['Fingerprint'].to_numpy()[model['rows']]),
+        'names': pool['Player'].astype(str).to_numpy()[model['rows']],
+        'labels': np.asarray(search_labels(pool), dtype=object)[model['rows']]
+    }
+
+def _top_k_similar(pool, fingerprints, top_k):
+    """
+    The top_k most similar players of each fingerprint's player, as serve_similar_players ranks them
     
-    # Calculate distances
-    for i in range(len(dist_matrix)):
-        x_i = df3.iloc[i,0]
-        y_i = df3.iloc[i,1]
-        for j in range(len(dist_matrix)):
-            x_j = df3.iloc[j,0]
-            y_j = df3.iloc[j,1]
-            dist_matrix.iloc[i,j] = ((((x_i-x_j)**2) + ((y_i-y_j)**2))**(0.5))
+    Returns:
+    (labels, similarity) arrays of shape (len(fingerprints), top_k); None and NaN where there are none
+    """
+    labels = np.full((len(fingerprints), top_k), None, dtype=object)
+    similarity = np.full((len(fingerprints), top_k), np.nan, dtype=np.float32)
+    if pool is None:
+        return labels, similarity
+    coords, max_dist = pool['model']['coords'], pool['model']['max_dist']
+    targets = pool['fingerprints'].get_indexer(fingerprints)
+    found = np.flatnonzero(targets >= 0)
     
-    # Calculate max distances
-    max_euc_dist = list(dist_matrix.max())
+    # In blocks of rows, so a large pool never holds a full distance matrix
+    block = max(1, 2**22 // len(coords))
+    for start in range(0, len(found), block):
+        rows = found[start:start + block]
+        target = targets[rows]
+        distances = np.hypot(coords[target, :1] - coords[:, 0], coords[target, 1:] - coords[:, 1])
+        scores = np.divide((max_dist - distances) * 100, max_dist, out=np.zeros(distances.shape), where=max_dist > 0)
+        scores[pool['names'][target][:, None] == pool['names']] = -np.inf
+        best = np.argsort(-scores, axis=1, kind='stable')[:, :top_k]
+        best_scores = np.take_along_axis(scores, best, axis=1)
+        keep = np.isfinite(best_scores)
+        width = best.shape[1]
+        labels[rows, :width] = np.where(keep, pool['labels'][best], None)
+        similarity[rows, :width] = np.where(keep, np.round(best_scores, 1), np.nan)
+    return labels, similarity
+
+def shortlist_chunks(columns=None, filters=None, top_k=0, chunk_rows=export_chunk_rows, store=combined_store):
+    """
+    Streams a shortlist out of the combined store
     
-    # Create similarity matrix
-    sim_matrix = pd.DataFrame(index=df3['name'], columns=df3['name'])
-    for i in range(len(dist_matrix)):
-        for j in range(len(dist_matrix)):
-            sim_matrix.iloc[i,j] = ((max_euc_dist[i]-dist_matrix.iloc[i,j])*100/max_euc_dist[i])
+    Args:
+    columns (list): Column selection, as for export_columns (default: None, everything)
+    filters: Output of export_filter (default: None, every player)
+    top_k (int): Similar players per player, as 'Similar i' and 'Similar i %' columns (default: 0)
+    chunk_rows (int): Rows per batch (default: export_chunk_rows)
+    store (str): Combined store directory (default: combined_store)
     
-    # Get similar players
-    similar_players = pd.DataFrame({
-        'Player': sim_matrix.index,
-        'Similarity %': sim_matrix[player_name].values
-    })
+    Yields:
+    pyarrow Tables, all with the same schema; one empty table when nothing matches
+    """
+    dataset = pads.dataset(store, format='parquet', partitioning='hive')
+    selected = export_columns(dataset.schema.names, columns)
+    keys = ['Season', 'Position Group', 'Fingerprint'] if top_k else []
+    read = selected + [col for col in keys if col not in selected]
+    pools = {}
     
-    # Sort by similarity
-    similar_players = similar_players.sort_values('Similarity %', ascending=False)
+    def with_similar(table):
+        table = table.select(read)
+        if top_k:
+            seasons = table['Season'].to_numpy(zero_copy_only=False).astype(str)
+            groups = table['Position Group'].to_numpy(zero_copy_only=False).astype(str)
+            fingerprints = table['Fingerprint'].to_numpy(zero_copy_only=False)
+            labels = np.full((len(table), top_k), None, dtype=object)
+            similarity = np.full((len(table), top_k), np.nan, dtype=np.float32)
+            for season, group in set(zip(seasons, groups)):
+                if (season, group) not in pools:
+                    pools[(season, group)] = _similarity_pool(dataset, season, group)
+                rows = np.flatnonzero((seasons == season) & (groups == group))
+                labels[rows], similarity[rows] = _top_k_similar(pools[(season, group)], fingerprints[rows], top_k)
+            for i in range(top_k):
+                table = table.append_column(f'Similar {i + 1}', pa.array(labels[:, i], type=pa.string()))
+                table = table.append_column(f'Similar {i + 1} %', pa.array(similarity[:, i], type=pa.float32(), from_pandas=True))
+        return table.select(selected + [name for name in table.column_names if name.startswith('Similar ')])
     
-    # Add cluster and position information
-    similar_players = similar_players.merge(
-        df3[['name', 'clusters', 'position', 'position group']],
-        left_on='Player',
-        right_on='name',
-        how='left'
-    )
+    empty = True
+    for batch in dataset.to_batches(columns=read, filter=filters, batch_size=chunk_rows):
+        if batch.num_rows:
+            empty = False
+            yield with_similar(pa.Table.from_batches([batch]))
+    if empty:
+        yield with_similar(dataset.schema.empty_table().select(read))
+
+def _write_xlsx(chunks, path):
+    # openpyxl's write-only workbook streams rows to disk instead of holding the sheet
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet, header, rows = None, None, 0
+    for table in chunks:
+        header = table.column_names
+        frame = table.to_pandas().astype(object)
+        for row in frame.where(frame.notna(), None).itertuples(index=False):
+            if sheet is None or rows == xlsx_sheet_rows:
+                sheet = workbook.create_sheet(f"Shortlist {len(workbook.worksheets) + 1}" if sheet else 'Shortlist')
+                sheet.append(header)
+                rows = 1
+            sheet.append(list(row))
+            rows += 1
+    if sheet is None:
+        workbook.create_sheet('Shortlist').append(header)
+    workbook.save(path)
+
+def export_shortlist(path, positions=None, leagues=None, seasons=None, min_age=None, max_age=None,
+                     min_minutes=None, columns=None, top_k=0, fmt=None, chunk_rows=export_chunk_rows,
+                     store=combined_store):
+    """
+    Writes the players matching a filter to a Parquet, CSV or XLSX file, one batch at a time
     
-    # Remove the target player and get top N
-    similar_players = similar_players[similar_players['Player'] != player_name].head(top_n)
+    Args:
+    path (str): Output file
+    positions, leagues, seasons, min_age, max_age, min_minutes: Filter, as for export_filter
+    columns (list): Column selection, as for export_columns (default: None, everything)
+    top_k (int): Similar players to add per player (default: 0)
+    fmt (str): 'parquet', 'csv' or 'xlsx' (default: from the file extension)
+    chunk_rows (int): Rows per batch (default: export_chunk_rows)
+    store (str): Combined store directory (default: combined_store)
     
-    # Add team information
-    similar_players = similar_players.merge(
-        df[['Player', 'Squad']], 
-        on='Player', 
-        how='left'
-    )
+    Returns:
+    Number of players written
+    """
+    fmt = fmt or export_formats.get(os.path.splitext(path)[1].lower())
+    if fmt not in export_formats.values():
+        raise ValueError(f"Unknown export format for {path}; use one of {', '.join(export_formats)}")
     
-    # Clean up and reorder columns
-    similar_players = similar_players.drop('name', axis=1)
-    similar_players = similar_players[['Player', 'Squad', 'position', 'position group', 'Similarity %', 'clusters']]
-    similar_players = similar_players.rename(columns={'clusters': 'Cluster'})
+    written = 0
+    def counted(chunks):
+        nonlocal written
+        for table in chunks:
+            written += len(table)
+            yield table
     
-    return similar_players
+    with profile_stage('Export shortlist', file=os.path.basename(path)) as record:
+        chunks = counted(shortlist_chunks(columns, export_filter(positions, leagues, seasons, min_age, max_age, min_minutes),
+                                          top_k, chunk_rows, store))
+        if fmt == 'parquet':
+            writer = None
+            for table in chunks:
+                writer = writer or pq.ParquetWriter(path, table.schema)
+                writer.write_table(table)
+            writer.close()
+        elif fmt == 'csv':
+            with open(path, 'w', newline='', encoding='utf-8-sig') as f:
+                for i, table in enumerate(chunks):
+                    table.to_pandas().to_csv(f, header=i == 0, index=False)
+        else:
+            _write_xlsx(chunks, path)
+        record['Rows'] = written
+    return written
 
-import matplotlib.cm as cm
+# Example usage: under-23 centre-backs of the Premier League with their 5 most similar players
+# export_shortlist(f"{root}CB Shortlist.xlsx", positions=['CB'], leagues=['eng Premier League'],
+#                  max_age=23, min_minutes=900, columns=['per90', 'percentiles'], top_k=5)
 
-def create_player_bars(player_name, df=df_combined, save_fig=False):
+def export_arguments(argv):
     """
-    Creates a bar chart for a specified player based on their position group
+    Parses the export command line: everything after `export`
     """
-    # Get player's data and position group
-    player_data = df[df['Player'] == player_name].iloc[0]
-    position_group = player_data['Position Group']
-    #chart_types = 'Pass Types', 'Touch Areas', 'Tackle Areas', 'Defensive Play', 'Ball Progression and Retention', 'Ball Carrying and Dribbling', 'Creativity and Attacking Play', 'Goal Threat'
-    squad = player_data['Squad']
-    
-    # Define metrics for each position group
-    chart_metrics_by_position = {
-        'FB': {
-            'Pass Types': [
-                'ShortPass%_PR',
-                'MediumPass%_PR',
-                'LongPass%_PR',
-                'ProgPass%_PR',
-                'Switch%_PR',
-                'KeyPass%_PR',
-                'Final3rdPass%_PR',
-                'ThroughPass%_PR'
-            ],
-            'Touch Areas': [
-                'TouchesPer90_PR',
-                'TouchCentrality_PR',
-                'Def3rdTouch%_PR',
-                'Mid3rdTouch%_PR',
-                'Att3rdTouch%_PR',
-                'AttPenTouch%_PR'
-            ],
-            'Tackle Areas': [
-                'Def3rdTkl%_PR',
-                'Mid3rdTkl%_PR',
-                'Att3rdTkl%_PR'
-            ],
-            'Defensive Play': [
-                'TklPer90_PR',
-                'DrbTkl%_PR',
-                'FlsPer90_PR',
-                'PassBlocksPer90_PR',
-                'IntPer90_PR',
-                'RecovPer90_PR',
-                'pAdjClrPer90_PR',
-                'pAdjShBlocksPer90_PR',
-                'AerialWinsPer90_PR',
-                'AerialWin%_PR'
-            ],
-            'Ball Progression and Retention': [
-                'PassesCompletedPer90_PR',
-                'TotCmp%_PR',
-                'Final1/3CmpPer90_PR',
-                'ProgPassesPer90',
-                'SwitchesPer90_PR',
-                'ReceivedPassPer90_PR',
-                'ProgPassesRecPer90_PR'
-            ],
-            'Ball Carrying and Dribbling': [
-                'AttDrbPer90_PR',
-                'DrbSucc%_PR',
-                'CarriesPer90_PR',
-                'CarriesToFinalThirdPer90_PR',
-                'CarriesToPenAreaPer90_PR',
-                'ProgCarriesPer50Touches_PR',
-                'ProgDistancePerCarry_PR',
-                'FldPer90_PR'
-            ],
-            'Creativity and Attacking Play': [
-                'AssistsPer90_PR',
-                'xAPer90_PR',
-                'KeyPassesPer90_PR',
-                'PenAreaCmpPer90_PR',
-                'ThruBallsPer90_PR',
-                'CrsPer90_PR'
-            ],
-            'Goal Threat': [
-                'GoalsPer90_PR',
-                'ShotsPer90_PR',
-                'npxGPer90_PR',
-                'SCAPer90_PR'
-            ]
-        },
-        'CB': {
-            'Pass Types': [
-                'ShortPass%_PR',
-                'MediumPass%_PR',
-                'LongPass%_PR',
-                'ProgPass%_PR',
-                'Switch%_PR',
-                'Final3rdPass%_PR'
-            ],
-            'Tackle Areas': [
-                'Def3rdTkl%_PR',
-                'Mid3rdTkl%_PR',
-                'Att3rdTkl%_PR'
-            ],
-            'Defensive Play': [
-                'TklPer90_PR',
-                'DrbTkl%_PR',
-                'FlsPer90_PR',
-                'PKconPer90_PR',
-                'OGPer90_PR',
-                'PassBlocksPer90_PR',
-                'IntPer90_PR',
-                'RecovPer90_PR',
-                'pAdjClrPer90_PR',
-                'pAdjShBlocksPer90_PR',
-                'AerialWinsPer90_PR',
-                'AerialWin%_PR'
-            ],
-            'Ball Progression and Retention': [
-                'PassesCompletedPer90_PR',
-                'TotCmp%_PR',
-                'Final1/3CmpPer90_PR',
-                'ProgPassesPer90',
-                'SwitchesPer90_PR'
-            ],
-            'Ball Carrying and Dribbling': [
-                'CarriesPer90_PR',
-                'CarriesToFinalThirdPer90_PR',
-                'ProgCarriesPer50Touches_PR',
-                'ProgDistancePerCarry_PR'
-            ],
-            'Goal Threat': [
-                'GoalsPer90_PR',
-                'ShotsPer90_PR',
-                'npxGPer90_PR'
-            ]
-        },
-        'DM': {
-            'Pass Types': [
-                'ShortPass%_PR',
-                'MediumPass%_PR',
-                'LongPass%_PR',
-                'ProgPass%_PR',
-                'Switch%_PR',
-                'KeyPass%_PR',
-                'Final3rdPass%_PR',
-                'ThroughPass%_PR'
-            ],
-            'Touch Areas': [
-                'TouchesPer90_PR',
-                'TouchCentrality_PR',
-                'Def3rdTouch%_PR',
-                'Mid3rdTouch%_PR',
-                'Att3rdTouch%_PR'
-            ],
-            'Tackle Areas': [
-                'Def3rdTkl%_PR',
-                'Mid3rdTkl%_PR',
-                'Att3rdTkl%_PR'
-            ],
-            'Defensive Play': [
-                'TklPer90_PR',
-                'DrbTkl%_PR',
-                'FlsPer90_PR',
-                'PassBlocksPer90_PR',
-                'IntPer90_PR',
-                'RecovPer90_PR',
-                'pAdjClrPer90_PR',
-                'pAdjShBlocksPer90_PR',
-                'AerialWinsPer90_PR',
-                'AerialWin%_PR'
-            ],
-            'Ball Progression and Retention': [
-                'PassesCompletedPer90_PR',
-                'TotCmp%_PR',
-                'Final1/3CmpPer90_PR',
-                'ProgPassesPer90',
-                'SwitchesPer90_PR',
-                'ReceivedPassPer90_PR',
-                'ProgPassesRecPer90_PR'
-            ],
-            'Ball Carrying and Dribbling': [
-                'AttDrbPer90_PR',
-                'DrbSucc%_PR',
-                'CarriesPer90_PR',
-                'CarriesToFinalThirdPer90_PR',
-                'ProgCarriesPer50Touches_PR',
-                'ProgDistancePerCarry_PR',
-                'FldPer90_PR'
-            ],
-            'Creativity and Attacking Play': [
-                'AssistsPer90_PR',
-                'xAPer90_PR',
-                'KeyPassesPer90_PR',
-                'ThruBallsPer90_PR'
-            ],
-            'Goal Threat': [
-                'GoalsPer90_PR',
-                'ShotsPer90_PR',
-                'npxGPer90_PR'
-            ]
-        },
-        'CM': {
-            'Pass Types': [
-                'ShortPass%_PR',
-                'MediumPass%_PR',
-                'LongPass%_PR',
-                'ProgPass%_PR',
-                'Switch%_PR',
-                'KeyPass%_PR',
-                'Final3rdPass%_PR',
-                'ThroughPass%_PR'
-            ],
-            'Touch Areas': [
-                'TouchesPer90_PR',
-                'TouchCentrality_PR',
-                'Def3rdTouch%_PR',
-                'Mid3rdTouch%_PR',
-                'Att3rdTouch%_PR',
-                'AttPenTouch%_PR'
-            ],
-            'Tackle Areas': [
-                'Def3rdTkl%_PR',
-                'Mid3rdTkl%_PR',
-                'Att3rdTkl%_PR'
-            ],
-            'Defensive Play': [
-                'TklPer90_PR',
-                'DrbTkl%_PR',
-                'FlsPer90_PR',
-                'PassBlocksPer90_PR',
-                'IntPer90_PR',
-                'RecovPer90_PR',
-                'AerialWinsPer90_PR',
-                'AerialWin%_PR'
-            ],
-            'Ball Progression and Retention': [
-                'PassesCompletedPer90_PR',
-                'TotCmp%_PR',
-                'Final1/3CmpPer90_PR',
-                'ProgPassesPer90',
-                'SwitchesPer90_PR',
-                'ReceivedPassPer90_PR',
-                'ProgPassesRecPer90_PR'
-            ],
-            'Ball Carrying and Dribbling': [
-                'AttDrbPer90_PR',
-                'DrbSucc%_PR',
-                'CarriesPer90_PR',
-                'CarriesToFinalThirdPer90_PR',
-                'CarriesToPenAreaPer90_PR',
-                'ProgCarriesPer50Touches_PR',
-                'ProgDistancePerCarry_PR',
-                'FldPer90_PR'
-            ],
-            'Creativity and Attacking Play': [
-                'AssistsPer90_PR',
-                'xAPer90_PR',
-                'KeyPassesPer90_PR',
-                'PenAreaCmpPer90_PR',
-                'CrsPenAreaCmpPer90_PR',
-                'ThruBallsPer90_PR',
-                'CrsPer90_PR'
-            ],
-            'Goal Threat': [
-                'GoalsPer90_PR',
-                'ShotsPer90_PR',
-                'npxGPer90_PR',
-                'npxG/ShPer90_PR',
-                'SCAPer90_PR',
-                'SCADribPer90_PR'
-            ]
-        },
-        'AM': {
-            'Pass Types': [
-                'ShortPass%_PR',
-                'MediumPass%_PR',
-                'LongPass%_PR',
-                'ProgPass%_PR',
-                'Switch%_PR',
-                'KeyPass%_PR',
-                'Final3rdPass%_PR',
-                'ThroughPass%_PR'
-            ],
-            'Touch Areas': [
-                'TouchesPer90_PR',
-                'TouchCentrality_PR',
-                'Def3rdTouch%_PR',
-                'Mid3rdTouch%_PR',
-                'Att3rdTouch%_PR',
-                'AttPenTouch%_PR'
-            ],
-            'Tackle Areas': [
-                'Def3rdTkl%_PR',
-                'Mid3rdTkl%_PR',
-                'Att3rdTkl%_PR'
-            ],
-            'Defensive Play': [
-                'TklPer90_PR',
-                'FlsPer90_PR',
-                'PassBlocksPer90_PR',
-                'IntPer90_PR',
-                'AerialWinsPer90_PR',
-                'AerialWin%_PR'
-            ],
-            'Ball Progression and Retention': [
-                'PassesCompletedPer90_PR',
-                'TotCmp%_PR',
-                'Final1/3CmpPer90_PR',
-                'ProgPassesPer90',
-                'SwitchesPer90_PR',
-                'ReceivedPassPer90_PR',
-                'ProgPassesRecPer90_PR'
-            ],
-            'Ball Carrying and Dribbling': [
-                'AttDrbPer90_PR',
-                'DrbSucc%_PR',
-                'CarriesPer90_PR',
-                'CarriesToFinalThirdPer90_PR',
-                'CarriesToPenAreaPer90_PR',
-                'ProgCarriesPer50Touches_PR',
-                'ProgDistancePerCarry_PR',
-                'ProgCarryEfficiency_PR',
-                'FldPer90_PR'
-            ],
-            'Creativity and Attacking Play': [
-                'AssistsPer90_PR',
-                'xAPer90_PR',
-                'KeyPassesPer90_PR',
-                'PenAreaCmpPer90_PR',
-                'CrsPenAreaCmpPer90_PR',
-                'ThruBallsPer90_PR',
-                'CrsPer90_PR'
-            ],
-            'Goal Threat': [
-                'GoalsPer90_PR',
-                'ShotsPer90_PR',
-                'SoT%Per90',
-                'npxGPer90_PR',
-                'npxG/ShPer90_PR',
-                'SCAPer90_PR',
-                'SCADribPer90_PR'
-            ]
-        },
-        'W': {
-            'Pass Types': [
-                'ShortPass%_PR',
-                'MediumPass%_PR',
-                'LongPass%_PR',
-                'ProgPass%_PR',
-                'Switch%_PR',
-                'KeyPass%_PR',
-                'Final3rdPass%_PR',
-                'ThroughPass%_PR'
-            ],
-            'Touch Areas': [
-                'TouchesPer90_PR',
-                'TouchCentrality_PR',
-                'Def3rdTouch%_PR',
-                'Mid3rdTouch%_PR',
-                'Att3rdTouch%_PR',
-                'AttPenTouch%_PR'
-            ],
-            'Tackle Areas': [
-                'Def3rdTkl%_PR',
-                'Mid3rdTkl%_PR',
-                'Att3rdTkl%_PR'
-            ],
-            'Defensive Play': [
-                'TklPer90_PR',
-                'FlsPer90_PR',
-                'PassBlocksPer90_PR',
-                'IntPer90_PR',
-                'AerialWinsPer90_PR',
-                'AerialWin%_PR'
-            ],
-            'Ball Progression and Retention': [
-                'PassesCompletedPer90_PR',
-                'TotCmp%_PR',
-                'Final1/3CmpPer90_PR',
-                'ProgPassesPer90',
-                'SwitchesPer90_PR',
-                'ReceivedPassPer90_PR',
-                'ProgPassesRecPer90_PR'
-            ],
-            'Ball Carrying and Dribbling': [
-                'AttDrbPer90_PR',
-                'DrbSucc%_PR',
-                'CarriesPer90_PR',
-                'CarriesToFinalThirdPer90_PR',
-                'CarriesToPenAreaPer90_PR',
-                'ProgCarriesPer50Touches_PR',
-                'ProgDistancePerCarry_PR',
-                'ProgCarryEfficiency_PR',
-                'FldPer90_PR'
-            ],
-            'Creativity and Attacking Play': [
-                'AssistsPer90_PR',
-                'xAPer90_PR',
-                'KeyPassesPer90_PR',
-                'PenAreaCmpPer90_PR',
-                'CrsPenAreaCmpPer90_PR',
-                'ThruBallsPer90_PR',
-                'CrsPer90_PR'
-            ],
-            'Goal Threat': [
-                'GoalsPer90_PR',
-                'ShotsPer90_PR',
-                'SoT%Per90',
-                'npxGPer90_PR',
-                'npxG/ShPer90_PR',
-                'SCAPer90_PR',
-                'SCADribPer90_PR'
-            ]
-        },
-        'ST': {
-            'Pass Types': [
-                'ShortPass%_PR',
-                'MediumPass%_PR',
-                'LongPass%_PR',
-                'ProgPass%_PR',
-                'Switch%_PR',
-                'KeyPass%_PR',
-                'Final3rdPass%_PR',
-                'ThroughPass%_PR'
-            ],
-            'Touch Areas': [
-                'TouchesPer90_PR',
-                'TouchCentrality_PR',
-                'Def3rdTouch%_PR',
-                'Mid3rdTouch%_PR',
-                'Att3rdTouch%_PR',
-                'AttPenTouch%_PR'
-            ],
-            'Defensive Play': [
-                'TklPer90_PR',
-                'FlsPer90_PR',
-                'PassBlocksPer90_PR',
-                'IntPer90_PR',
-                'AerialWinsPer90_PR',
-                'AerialWin%_PR'
-            ],
-            'Ball Progression and Retention': [
-                'PassesCompletedPer90_PR',
-                'TotCmp%_PR',
-                'Final1/3CmpPer90_PR',
-                'ProgPassesPer90',
-                'SwitchesPer90_PR',
-                'ReceivedPassPer90_PR',
-                'ProgPassesRecPer90_PR'
-            ],
-            'Ball Carrying and Dribbling': [
-                'AttDrbPer90_PR',
-                'DrbSucc%_PR',
-                'CarriesPer90_PR',
-                'CarriesToFinalThirdPer90_PR',
-                'CarriesToPenAreaPer90_PR',
-                'ProgCarriesPer50Touches_PR',
-                'ProgDistancePerCarry_PR',
-                'ProgCarryEfficiency_PR',
-                'FldPer90_PR'
-            ],
-            'Creativity and Attacking Play': [
-                'AssistsPer90_PR',
-                'xAPer90_PR',
-                'KeyPassesPer90_PR',
-                'PenAreaCmpPer90_PR',
-                'CrsPenAreaCmpPer90_PR',
-                'ThruBallsPer90_PR',
-                'CrsPer90_PR'
-            ],
-            'Goal Threat': [
-                'GoalsPer90_PR',
-                'ShotsPer90_PR',
-                'SoT%Per90',
-                'npxGPer90_PR',
-                'npxG/ShPer90_PR',
-                'AvgShotDistancePer90_PR',
-                'SCAPer90_PR',
-                'SCADribPer90_PR'
-            ]
-        }
-    }
+    parser = argparse.ArgumentParser(prog='export', description='Writes a shortlist out of the combined store')
+    parser.add_argument('--output', required=True, help='.parquet, .csv or .xlsx file')
+    parser.add_argument('--positions', nargs='+', help='Position groups, e.g. CB FB')
+    parser.add_argument('--leagues', nargs='+', help="Leagues as in 'Comp', e.g. 'eng Premier League'")
+    parser.add_argument('--seasons', nargs='+', help='Seasons, e.g. 2024-2025')
+    parser.add_argument('--min-age', type=int)
+    parser.add_argument('--max-age', type=int)
+    parser.add_argument('--min-minutes', type=int)
+    parser.add_argument('--columns', nargs='+', help='raw, per90, percentiles, composites and/or column names')
+    parser.add_argument('--top-k', type=int, default=0, help='Similar players per player')
+    parser.add_argument('--format', choices=sorted(set(export_formats.values())))
+    parser.add_argument('--chunk-rows', type=int, default=export_chunk_rows)
+    # --synthetic is read at the top of the file
+    arguments, _ = parser.parse_known_args(argv)
+    return arguments
 
-        # Get metrics for player's position
-    for chart_type in chart_metrics_by_position[position_group]:
-        metrics = chart_metrics_by_position[position_group][chart_type]
-        values = [round(player_data[metric]) for metric in metrics]
-        
-        # Normalize values to range from 0 to 100
-        normalized_values = np.clip(values, 0, 100)  # Ensure values are within 0-100
-        colors = cm.RdYlGn(normalized_values / 100)  # Normalize to [0, 1] for colormap
+if export_run and main_process:
+    arguments = export_arguments(sys.argv[2:])
+    exported = export_shortlist(arguments.output, arguments.positions, arguments.leagues, arguments.seasons,
+                                arguments.min_age, arguments.max_age, arguments.min_minutes, arguments.columns,
+                                arguments.top_k, arguments.format, arguments.chunk_rows)
+    print(f"Exported {exported} players to {arguments.output}")
 
-        fig, ax = plt.subplots(figsize=(16, len(metrics)))
-        bars = ax.barh(metrics, values, color=colors)
-        
-        # Add dashed grey gridlines
-        ax.grid(axis='x', color='grey', linestyle='--', linewidth=0.5)
-        ax.axvline(x=50, color='black', linewidth=0.8)  # Adjust linewidth as needed
-        
-        # Remove axes splines
-        for s in ['top', 'right']:
-            ax.spines[s].set_visible(False)
-        
-        # Show top values 
-        ax.invert_yaxis()
-            
-        # Remove x, y Ticks
-        ax.xaxis.set_ticks_position('none')
-        ax.yaxis.set_ticks_position('none')
-        
-        # Add annotation to bars
-        for i in ax.patches:
-            plt.text(i.get_width()+0.2, i.get_y()+0.5, 
-                     str(round((i.get_width()), 2)),
-                     fontsize = 10, fontweight ='bold',
-                     color ='grey')
-            
-        # Add Plot Title
-        ax.set_title(f"{chart_type} -",
-                     loc ='left', pad = 12.0, fontsize = 24, fontweight = 'normal', color = 'black', fontname = 'Arial', style = 'normal')
+##################################################################################
+################################ Benchmark suite #################################
+##################################################################################
 
-        # Set x-axis limits from 0 to 100
-        ax.set_xlim(0, 100)
+# Times the hot paths offline: the transform, percentile, similarity and render stages on
+# generated tables of benchmark_players player-seasons, so the suite runs from a clean checkout.
+# Results are written to Benchmarks/ and compared with a saved baseline, so an optimisation can
+# be shown and a regression caught.
+#
+#   python "Streamlit Player Dashboard.py" benchmark                   # run and compare
+#   python "Streamlit Player Dashboard.py" benchmark --save-baseline   # also make it the baseline
+#   python "Streamlit Player Dashboard.py" benchmark --synthetic 100000
+#   python "Streamlit Player Dashboard.py" benchmark --fixtures        # recorded FBref pages
+#
+# --fixtures also times HTML parsing, on pages recorded once with fixture_mode = 'record' and a
+# normal run (they are not committed), and scales the replayed table up 10 times.
 
-        # Show Plot
-        plt.show()
+import platform
 
-        #plt.barh(metrics, values, color ='green', width = 0.5)
-        #plt.xlabel("Metrics")
-        #plt.ylabel("Percentile Rank")
-        #plt.title(f"{chart_type} -")
-        #plt.show()
+benchmark_dir = f"{os.getcwd()}/Benchmarks"
 
+def scale_raw_tables(tables, factor=10):
+    """
+    Repeats every raw stat table `factor` times under renamed players, keeping the tables
+    row-aligned by player and squad
+    """
+    scaled = {}
+    for stat, table in tables.items():
+        copies = []
+        for k in range(factor):
+            copy = table.copy()
+            if k:
+                # FBref's repeated header rows have no player and are dropped in the merge
+                copy = copy[copy['Player'].notna()].copy()
+                copy['Player'] = copy['Player'] + f' #{k}'
+                if 'PlayerID' in copy.columns:
+                    copy['PlayerID'] = copy['PlayerID'] + f'-{k}'
+            copies.append(copy)
+        table = pd.concat(copies, ignore_index=True)
+        table.sort_values(['Player', 'Squad'], ascending=[True, True], inplace=True)
+        scaled[stat] = table.reset_index(drop=True)
+    return scaled
 
+def scale_player_table(df, factor=10, seed=0):
+    """
+    Repeats a processed player table `factor` times under renamed players, with multiplicative
+    noise on every float column so the copies do not tie. Percentile and composite columns are
+    kept within 0-100.
+    """
+    rng = np.random.default_rng(seed)
+    float_columns = df.select_dtypes(include='float').columns
+    bounded = [col for col in float_columns if col.endswith('_PR') or col in composite_columns]
+    copies = []
+    for k in range(factor):
+        copy = df.copy()
+        for col in categorical_columns:
+            if col in copy.columns:
+                copy[col] = copy[col].astype(str)
+        if k:
+            copy['Player'] = copy['Player'] + f' #{k}'
+            if 'PlayerID' in copy.columns:
+                copy['PlayerID'] = copy['PlayerID'].astype(str) + f'-{k}'
+            copy[float_columns] = copy[float_columns] * rng.lognormal(0, 0.1, (len(copy), len(float_columns)))
+            copy[bounded] = copy[bounded].clip(0, 100)
+        copies.append(copy)
+    return compact_dtypes(pd.concat(copies, ignore_index=True))
 
-# Example usage:
-# similar_players = find_similar_players("Erling Haaland")
-# display(similar_players)
+def _time_benchmark(function, repeats, warmup=1):
+    # Median, min and max wall time of `repeats` calls after the warm-up calls
+    for _ in range(warmup):
+        function()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return {'median s': round(statistics.median(times), 4), 'min s': round(min(times), 4),
+            'max s': round(max(times), 4), 'repeats': repeats}
 
-from ipywidgets import widgets
-from IPython.display import display, HTML
-import numpy as np
+def _render_to_png(obj, **kwargs):
+    # What the notebook front end does with a displayed figure
+    if isinstance(obj, Figure):
+        obj.savefig(BytesIO(), format='png')
 
-def create_player_selector(df=df_combined):
-    # Get sorted list of unique player names with teams
-    player_list = sorted([f"{row['Player']} ({row['Squad']})" 
-                         for _, row in df.iterrows()])
+def run_benchmarks(factor=10, repeats=3, competition='Big5', season=current_season, players=10,
+                   synthetic=synthetic_players):
+    """
+    Runs every benchmark on the generated tables, or on the replayed fixtures and a `factor`-times
+    table without synthetic players
     
-    # Create the dropdown widget
-    player_dropdown = widgets.Combobox(
-        placeholder='Search for a player...',
-        options=player_list,
-        description='Player:',
-        ensure_option=True,
-        style={'description_width': 'initial'}
-    )
+    Args:
+    factor (int): How many times to scale the player tables (default: 10)
+    repeats (int): Timed calls per benchmark, after one warm-up call (default: 3)
+    competition, season: Recorded job to benchmark (default: 'Big5', current_season)
+    players (int): Players per render and similarity call batch (default: 10)
+    synthetic (int): Benchmark generated tables of this many player-seasons instead, with no
+    scaling and no HTML parsing (default: synthetic_players)
     
-    # Create output widgets for displaying results
-    output_pizza = widgets.Output()
-    output_bar = widgets.Output()
-    output_similar = widgets.Output()
+    Returns:
+    dict of benchmark name -> timings, or the error for benchmarks that fail
+    """
+    if synthetic:
+        pages = {}
+        tables, squad_tables, tm_pos = generate_synthetic_competition(synthetic, competition, season)
+        team_table = build_team_table(*squad_tables, competition)
+    else:
+        pages = {stat: fetch_page(fbref_url(stat, competition, season))
+                 for stat in player_stat_pages}
+        tables = scale_raw_tables(scrape_player_tables(competition, season), factor)
+        team_table = scrape_team_table(competition, season)
+        tm_pos = pd.read_csv(io.BytesIO(fetch_page(tm_mapping_url, delay=0)))
+    # Same CSV round trip as build_competition_season, which also parses the team columns
+    team_table.to_csv(f"{root}Benchmark Teams.csv", index=False)
+    teams = pd.read_csv(f"{root}Benchmark Teams.csv")
+    raw = merge_player_tables(tables)
+    raw_path = f"{root}Benchmark Raw.csv"
+    raw.to_csv(raw_path, index=False)
+    per90 = add_per90(raw_path)
     
-    # Create a function to handle selection
-    def on_player_select(change):
-        if change['type'] == 'change' and change['name'] == 'value':
-            selected = change['new']
-            if selected in player_list:
-                # Clear previous outputs
-                output_pizza.clear_output()
-                output_bar.clear_output()
-                output_similar.clear_output()
-                
-                # Extract player name and team from selection
-                player_name = selected.split(' (')[0]
-                team_name = selected.split('(')[1].rstrip(')')
-                
-                # Get the specific player row using both name and team
-                player_data = df[(df['Player'] == player_name) & 
-                               (df['Squad'] == team_name)]
-                
-                if not player_data.empty:
-                    # Display pizza chart
-                    with output_pizza:
-                        create_player_pizza(player_name)
-
-                    with output_bar:
-                        create_player_bars(player_name)
-                    
-                    # Display similar players
-                    with output_similar:
-                        similar = find_similar_players(player_name)
-                        # Format similarity percentage to 1 decimal place
-                        similar['Similarity %'] = similar['Similarity %'].apply(lambda x: np.round(x, 1))
-                        display(HTML(f"<h3>Similar Players to {player_name}</h3>"))
-                        display(similar)
-    
-    # Attach the handler to the dropdown
-    player_dropdown.observe(on_player_select)
+    combined = df_combined if synthetic else scale_player_table(df_combined, factor)
+    ranking_input = combined.drop(columns=[col for col in combined.columns if col.endswith('_PR')])
+    sample = combined.drop_duplicates('Player').sample(min(players, len(combined)), random_state=0)
+    sample_keys = player_keys(sample).tolist()
+    sample = sample['Player'].tolist()
     
-    # Create layout
-    display(widgets.VBox([
-        player_dropdown,
-        widgets.HBox([
-            output_pizza,
-            output_bar,
-            output_similar
-        ])
-    ]))
+    benchmarks = {
+        'parse get_df pages': lambda: [parse_table_html(page, table_id=None if competition == 'Big5' else table_id)
+                                       for page, table_id in zip(pages.values(), player_stat_pages.values())],
+        'merge player tables': lambda: merge_player_tables(tables),
+        'per 90': lambda: add_per90(raw_path),
+        'team enrichment': lambda: enrich_with_team_data(per90.copy(), teams, tm_pos),
+        'percentile rankings': lambda: [create_percentile_rankings(rows, keeper_metrics_to_rank if group in keeper_group_order else metrics_to_rank)
+                                        for group, rows in ranking_input.groupby('Position Group', observed=True)],
+        'find similar players': lambda: [find_similar_players(key, combined) for key in sample_keys],
+        'pizza render': lambda: [create_player_pizza(player, combined, show=_render_to_png) for player in sample],
+        'bars render': lambda: [create_player_bars(player, combined, show=_render_to_png) for player in sample]
+    }
+    sizes = {
+        'parse get_df pages': sum(len(page) for page in pages.values()),
+        'merge player tables': len(raw),
+        'per 90': len(per90),
+        'team enrichment': len(per90),
+        'percentile rankings': len(ranking_input),
+        'find similar players': len(combined),
+        'pizza render': len(sample),
+        'bars render': len(sample)
+    }
+    if synthetic:
+        del benchmarks['parse get_df pages'], sizes['parse get_df pages']
+    
+    results = {}
+    for name, function in benchmarks.items():
+        try:
+            results[name] = _time_benchmark(function, repeats)
+        except Exception as e:
+            results[name] = {'error': f"{type(e).__name__}: {e}"}
+        results[name]['size'] = sizes[name]
+        print(f"{name}: {results[name]}")
+    return results
+
+def save_benchmark_results(results, factor, save_baseline=False, path=benchmark_dir):
+    """
+    Writes the results with the environment they ran in, compares them with the baseline and
+    optionally makes them the new baseline
+    
+    Returns:
+    Comparison DataFrame with 'median s', 'baseline s' and 'change %'
+    """
+    os.makedirs(path, exist_ok=True)
+    run = {
+        'run': datetime.now().isoformat(timespec='seconds'),
+        'factor': factor,
+        'synthetic players': synthetic_players,
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'pandas': pd.__version__, 'numpy': np.__version__},
+        'results': results
+    }
+    with open(os.path.join(path, f"results-{run['run'].replace(':', '')}.json"), 'w') as f:
+        json.dump(run, f, indent=2)
+    
+    comparison = pd.DataFrame({name: {'median s': result.get('median s')}
+                               for name, result in results.items()}).T
+    baseline_path = os.path.join(path, 'baseline.json')
+    if os.path.exists(baseline_path):
+        with open(baseline_path) as f:
+            baseline = json.load(f)
+        if baseline['factor'] != factor:
+            print(f"Baseline was run at {baseline['factor']}x, this run at {factor}x")
+        comparison['baseline s'] = pd.Series({name: result.get('median s')
+                                              for name, result in baseline['results'].items()})
+        comparison['change %'] = ((comparison['median s'].astype(float) / comparison['baseline s'].astype(float) - 1) * 100).round(1)
+    if save_baseline:
+        with open(baseline_path, 'w') as f:
+            json.dump(run, f, indent=2)
+    print(comparison.to_string())
+    return comparison
 
-# Use the selector
-create_player_selector()
\ No newline at end of file
+if benchmark_run and main_process:
+    benchmark_factor = 1 if synthetic_players else 10
+    benchmark_results = run_benchmarks(benchmark_factor)
+    save_benchmark_results(benchmark_results, benchmark_factor, save_baseline='--save-baseline' in sys.argv)